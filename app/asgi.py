@@ -1,3 +1,24 @@
+"""
+Entrada ASGI.
+
+Modo ASGI (SERVER=asgi no entrypoint.sh): gunicorn com workers uvicorn, ex.
+    gunicorn app.asgi:application -k uvicorn_worker.UvicornWorker --workers 3
+Com SERVER=asgi, LEADS_ASYNC_VIEWS liga a lista/exportação async
+(leads.views.AsyncLeadListView): cada download vem de um iterador async sobre
+aiterator(), então um export lento não ocupa um worker inteiro. CONN_MAX_AGE fica em 0.
+
+Todos os middlewares são async (os estáticos saem por leads.static.StaticFilesMiddleware,
+não pelo WhiteNoiseMiddleware, que é só síncrono e faria o Django adaptar a cadeia
+inteira). O que continua síncrono roda via sync_to_async(thread_sensitive=True): o
+ASGIHandler abre um ThreadSensitiveContext por request, então o código síncrono de um
+mesmo request fica sempre na mesma thread, mas requests concorrentes usam threads
+diferentes do executor (limitado por ASGI_THREADS) e rodam em paralelo. Isso vale
+para as views síncronas, a página HTML da lista e o validador/COUNT da exportação;
+só o corpo da exportação fica no loop, sem ocupar thread.
+
+Comparação de exportações concorrentes nos dois modos:
+    python manage.py benchmark concurrency --clients 20
+"""
 import os
 
 from django.core.asgi import get_asgi_application
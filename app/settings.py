@@ -47,8 +47,12 @@ INSTALLED_APPS = [
 
 # -------- Middleware ----
 MIDDLEWARE = [
+    "leads.metrics.MetricsMiddleware",
+    # primeiro da lista: mede também sessão/autenticação; inativo sem LEADS_PROFILING
+    "leads.profiling.QueryProfilingMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    # WhiteNoise com suporte a async: sob ASGI a cadeia de middlewares continua async
+    "leads.static.StaticFilesMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -79,14 +83,43 @@ TEMPLATES = [
     },
 ]
 
+# -------- Servidor -----
+# "wsgi" (gunicorn com workers síncronos) ou "asgi" (gunicorn + uvicorn); ver entrypoint.sh
+SERVER = os.getenv("SERVER", "wsgi").strip().lower()
+# lista e exportação com views async; padrão: ligado quando SERVER=asgi
+LEADS_ASYNC_VIEWS = _env_bool("LEADS_ASYNC_VIEWS", "True" if SERVER == "asgi" else "False")
+
 # -------- Databases -----
 USE_SQLITE = _env_bool("USE_SQLITE", "True")
 
+# Perfil SQLite, aplicado a cada conexão nova: WAL deixa leituras seguirem durante uma
+# escrita; BEGIN IMMEDIATE + busy_timeout fazem os escritores esperarem a vez em vez de
+# falharem com "database is locked" no meio da transação (ex.: importações).
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    # NORMAL com WAL: não perde consistência, só as últimas transações numa queda de energia
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    # negativo = KiB (-65536 = 64 MiB de cache de páginas por conexão)
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),
+    # ms esperando o lock de escrita
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000")),
+}
+SQLITE_OPTIONS = {
+    "init_command": ";".join(f"PRAGMA {name}={value}" for name, value in SQLITE_PRAGMAS.items()),
+    "transaction_mode": os.getenv("SQLITE_TRANSACTION_MODE", "IMMEDIATE"),
+}
+
+# Perfil PostgreSQL: pool do psycopg 3 por processo (total = workers x PG_POOL_MAX_SIZE).
+# PG_POOL=False volta às conexões persistentes (CONN_MAX_AGE) com health check.
+PG_POOL = _env_bool("PG_POOL", "True")
+
 if USE_SQLITE:
     DATABASES = {
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
             "NAME": BASE_DIR / "db.sqlite3",
+            "OPTIONS": SQLITE_OPTIONS,
         }
     }
 else:
@@ -98,9 +131,68 @@ else:
             "PASSWORD": os.getenv("PG_PASSWORD", ""),
             "HOST": os.getenv("PG_HOST", "localhost"),
             "PORT": os.getenv("PG_PORT", "5432"),
-            "CONN_MAX_AGE": 600,
+            # sob ASGI cada request async abre a própria conexão: conexões persistentes se acumulariam
+            "CONN_MAX_AGE": int(os.getenv("PG_CONN_MAX_AGE", "0" if SERVER == "asgi" else "600")),
+            # conexão persistente derrubada pelo servidor é trocada antes de ser usada
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {},
         }
     }
+    if PG_POOL:
+        from psycopg_pool import ConnectionPool
+
+        DATABASES["default"]["CONN_MAX_AGE"] = 0  # o pool é quem reaproveita as conexões
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": int(os.getenv("PG_POOL_MIN_SIZE", "2")),
+            "max_size": int(os.getenv("PG_POOL_MAX_SIZE", "10")),
+            # segundos esperando uma conexão livre antes de PoolTimeout
+            "timeout": float(os.getenv("PG_POOL_TIMEOUT", "10")),
+            # conexões ociosas além de min_size são fechadas depois de max_idle segundos
+            "max_idle": float(os.getenv("PG_POOL_MAX_IDLE", "600")),
+            # testa cada conexão ao sair do pool: descarta as que o servidor derrubou
+            "check": ConnectionPool.check_connection,
+        }
+
+# -------- Cache -----
+# Contagens, validadores de ETag, linhas da tabela e dropdowns são invalidados por versão
+# (leads.cache): todos os processos precisam ver o mesmo cache, senão os outros workers
+# servem dados (e 304) antigos até o timeout. Padrão: arquivos num diretório comum
+# (no docker-compose, um volume de web e worker); em volume alto prefira redis
+# (CACHE_BACKEND=django.core.cache.backends.redis.RedisCache, CACHE_LOCATION=redis://...).
+# locmem só serve para um processo (runserver); o check leads.W001 avisa fora do DEBUG.
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "django.core.cache.backends.filebased.FileBasedCache")
+CACHES = {
+    "default": {
+        "BACKEND": CACHE_BACKEND,
+        "LOCATION": os.getenv("CACHE_LOCATION", "/tmp/portal-leads-cache"),
+        # o filebased apaga 1/3 das entradas ao passar do limite (padrão do Django: 300)
+        "OPTIONS": {"MAX_ENTRIES": int(os.getenv("CACHE_MAX_ENTRIES", "20000"))},
+    }
+}
+# locmem/dummy: cada processo com o seu cache
+CACHE_SHARED = not CACHE_BACKEND.endswith((".LocMemCache", ".DummyCache"))
+
+# -------- Sessão / autenticação -----
+# "cached_db" (leitura pelo cache, gravação também no banco), "signed_cookies" (sessão
+# assinada no próprio cookie, sem banco nem cache), "db" ou "cache"; aceita o caminho completo.
+# Sessão e usuário em cache só valem com cache compartilhado: com locmem um logout ou uma
+# troca de senha só limpa o cache do worker que recebeu o request. Por isso o padrão é
+# cached_db apenas com CACHE_SHARED; configurar explicitamente com locmem é erro (leads.E002/E003).
+_session_engine = os.getenv("SESSION_ENGINE", "cached_db" if CACHE_SHARED else "db").strip()
+SESSION_ENGINE = (
+    _session_engine if "." in _session_engine else f"django.contrib.sessions.backends.{_session_engine}"
+)
+SESSION_CACHE_ALIAS = os.getenv("SESSION_CACHE_ALIAS", "default")
+# usuário da sessão em cache (leads.backends.CachedModelBackend); 0 = busca no banco a cada request.
+# A instância inteira vai para o cache, hash da senha incluído (é ele que valida a sessão):
+# o cache precisa ser tão restrito quanto o banco (o FileBasedCache grava arquivos 0600).
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv("AUTH_USER_CACHE_TIMEOUT", "300" if CACHE_SHARED else "0"))
+AUTHENTICATION_BACKENDS = [
+    "leads.backends.CachedModelBackend",
+    # sessões abertas antes do CachedModelBackend guardam este caminho: continuam válidas
+    "django.contrib.auth.backends.ModelBackend",
+]
+
 # -------- Passwords -----
 AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"},
@@ -130,6 +222,58 @@ WHITENOISE_USE_FINDERS = DEBUG
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# -------- Lista de leads -----
+# "offset" (Página X de Y, com COUNT) ou "keyset" (cursor por created_at/id, sem COUNT)
+LEADS_PAGINATION = os.getenv("LEADS_PAGINATION", "offset").strip().lower()
+# "auto" (tsvector no PostgreSQL, FTS5 no SQLite) ou "icontains" (LIKE, sem índice)
+LEADS_SEARCH_BACKEND = os.getenv("LEADS_SEARCH_BACKEND", "auto").strip().lower()
+# segundos que a contagem de um filtro fica em cache (invalidada por alterações em leads)
+LEADS_COUNT_CACHE_TIMEOUT = int(os.getenv("LEADS_COUNT_CACHE_TIMEOUT", "300"))
+# PostgreSQL: acima deste total estimado pelo planner, usa a estimativa em vez do COUNT (0 = desligado)
+LEADS_APPROX_COUNT_THRESHOLD = int(os.getenv("LEADS_APPROX_COUNT_THRESHOLD", "0"))
+# segundos que o HTML de cada linha da tabela fica em cache (0 = sem cache de linhas)
+LEADS_ROW_CACHE_TIMEOUT = int(os.getenv("LEADS_ROW_CACHE_TIMEOUT", "3600"))
+
+# -------- Importação / exportação CSV -----
+# linhas por bloco do iterator() na exportação (1 SELECT de tags por bloco)
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "2000"))
+# bytes acumulados antes de enviar (e comprimir) um bloco da exportação
+EXPORT_BUFFER_SIZE = int(os.getenv("EXPORT_BUFFER_SIZE", "65536"))
+# nível do gzip (1 = mais rápido, 9 = menor) nos formatos .gz e no Content-Encoding
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+# comprime CSV/NDJSON quando o cliente envia Accept-Encoding: gzip (desligar se o proxy já comprime)
+EXPORT_GZIP_RESPONSE = _env_bool("EXPORT_GZIP_RESPONSE", "True")
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+# PostgreSQL: importação e exportação CSV por COPY (False = ORM em lote, como nos demais bancos)
+LEADS_PG_COPY = _env_bool("LEADS_PG_COPY", "True")
+# segundos sem heartbeat até um job em execução ser considerado abandonado
+IMPORT_JOB_STALE_AFTER = int(os.getenv("IMPORT_JOB_STALE_AFTER", "300"))
+
+# Profiling por request (leads.profiling): Server-Timing + log JSON com queries, tempo
+# de banco/templates e suspeitas de N+1. Custo por query: deixe desligado em produção.
+LEADS_PROFILING = _env_bool("LEADS_PROFILING", "False")
+# mesmo formato de SQL repetido tantas vezes no request = provável N+1
+LEADS_PROFILING_REPEAT_THRESHOLD = int(os.getenv("LEADS_PROFILING_REPEAT_THRESHOLD", "5"))
+LEADS_PROFILING_SLOWEST = int(os.getenv("LEADS_PROFILING_SLOWEST", "5"))
+
+# Métricas Prometheus (GET /metrics, leads.metrics). Com vários processos (gunicorn,
+# process_imports, dispatch_outbox) aponte METRICS_DIR para um diretório comum: cada
+# processo grava um snapshot lá a cada METRICS_FLUSH_INTERVAL segundos e o /metrics soma todos.
+METRICS_ENABLED = _env_bool("METRICS_ENABLED", "True")
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+# o /metrics exige "Authorization: Bearer <token>"; fora do DEBUG, sem token, responde 404
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "leads.profiling": {"handlers": ["console"], "level": "INFO", "propagate": False},
+    },
+}
+
 # -------- Email (SMTP real) -----
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 EMAIL_HOST = os.getenv("EMAIL_HOST", "smtp.gmail.com")
@@ -140,6 +284,13 @@ EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER", "")
 EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD", "")
 DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", EMAIL_HOST_USER)
 
+# -------- Outbox de e-mails (manage.py dispatch_outbox) -----
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", "50"))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "5"))
+# backoff base em segundos (dobra a cada tentativa) e lease de um lote em envio
+EMAIL_OUTBOX_BACKOFF = int(os.getenv("EMAIL_OUTBOX_BACKOFF", "60"))
+EMAIL_OUTBOX_LEASE = int(os.getenv("EMAIL_OUTBOX_LEASE", "300"))
+
 # -------- Provedores SMTP (para mailers.py) -----
 DEFAULT_SMTP_PROVIDER = os.getenv("DEFAULT_SMTP_PROVIDER", "gmail")
 SMTP_PROVIDERS = {
@@ -170,6 +321,8 @@ LOGOUT_REDIRECT_URL = "login"
 
 # -------- Segurança extra (produção/HTTPS) -----
 SECURE_SSL_REDIRECT = _env_bool("SECURE_SSL_REDIRECT")
+# probes e scrape do Prometheus (com METRICS_TOKEN) chegam por HTTP direto no container
+SECURE_REDIRECT_EXEMPT = [r"^healthz$", r"^readyz$", r"^metrics$"]
 SESSION_COOKIE_SECURE = _env_bool("SESSION_COOKIE_SECURE")
 CSRF_COOKIE_SECURE = _env_bool("CSRF_COOKIE_SECURE")
 SECURE_BROWSER_XSS_FILTER = True
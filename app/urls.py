@@ -1,13 +1,37 @@
+import logging
+
 from django.contrib import admin
+from django.db import DatabaseError, connection
+from django.http import JsonResponse
 from django.urls import path, include
 from django.contrib.auth import views as auth_views
 
+from leads.metrics import metrics_view
+
+logger = logging.getLogger(__name__)
+
 
 def healthz(_request):
+    # liveness: só confirma que o processo responde (sem banco)
     return JsonResponse({"status": "ok"})
 
+
+def readyz(_request):
+    # readiness: fora do balanceador enquanto o banco não responde
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+    except DatabaseError:
+        # o detalhe (host, mensagem do driver) fica no log, não na resposta pública
+        logger.warning("readyz: banco indisponível", exc_info=True)
+        return JsonResponse({"status": "unavailable"}, status=503)
+    return JsonResponse({"status": "ok"})
+
+
 urlpatterns = [
     path("healthz", healthz, name="healthz"),
+    path("readyz", readyz, name="readyz"),
+    path("metrics", metrics_view, name="metrics"),
     path("admin/", admin.site.urls),
     path(
         "accounts/login/",
@@ -12,9 +12,24 @@ if [ "${COLLECTSTATIC}" = "1" ]; then
   python manage.py collectstatic --noinput || true
 fi
 
-if [ "${DJANGO_ENV}" = "prod" ]; then
+# snapshots de métricas de processos anteriores: os contadores recomeçam com o serviço
+if [ -n "${METRICS_DIR}" ]; then
+  mkdir -p "${METRICS_DIR}"
+  find "${METRICS_DIR}" -maxdepth 1 -name '*.json' -delete
+fi
+
+# SERVER=asgi: workers uvicorn (app.asgi); a lista/exportação usa as views async
+# (LEADS_ASYNC_VIEWS) e vários downloads dividem o mesmo worker.
+# SERVER=wsgi (padrão): workers síncronos, um request por worker.
+if [ "${DJANGO_ENV}" = "prod" ] && [ "${SERVER}" = "asgi" ]; then
+  echo ">> Iniciando Gunicorn + Uvicorn (produção, ASGI)..."
+  exec gunicorn app.asgi:application -k uvicorn_worker.UvicornWorker --bind 0.0.0.0:8000 --workers 3 --timeout 60
+elif [ "${DJANGO_ENV}" = "prod" ]; then
   echo ">> Iniciando Gunicorn (produção)..."
   exec gunicorn app.wsgi:application --bind 0.0.0.0:8000 --workers 3 --timeout 60
+elif [ "${SERVER}" = "asgi" ]; then
+  echo ">> Iniciando Uvicorn (desenvolvimento, ASGI)..."
+  exec uvicorn app.asgi:application --host 0.0.0.0 --port 8000 --reload
 else
   echo ">> Iniciando runserver (desenvolvimento)..."
   exec python manage.py runserver 0.0.0.0:8000
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Lead, Tag
+from .models import EmailOutbox, ImportJob, Lead, PipelineRollup, Tag
 
 
 @admin.register(Tag)
@@ -13,4 +13,26 @@ class LeadAdmin(admin.ModelAdmin):
     list_filter = ('status', 'source', 'owner', 'tags', 'created_at')
     search_fields = ('name', 'email', 'company', 'phone', 'notes')
     autocomplete_fields = ('owner', 'tags')
-    date_hierarchy = 'created_at'
\ No newline at end of file
+    date_hierarchy = 'created_at'
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'owner', 'mode', 'status', 'row_cursor', 'total_rows', 'created_count', 'updated_count',
+        'error_count', 'created_at',
+    )
+    list_filter = ('status', 'mode')
+    readonly_fields = ('row_cursor', 'total_rows', 'created_count', 'updated_count', 'error_count', 'errors', 'heartbeat_at')
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('subject',)
+    readonly_fields = ('attempts', 'last_error', 'sent_at')
+
+@admin.register(PipelineRollup)
+class PipelineRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'status', 'source', 'owner', 'lead_count', 'total_value')
+    list_filter = ('status', 'source')
+    date_hierarchy = 'day'
@@ -0,0 +1,234 @@
+"""
+API JSON/NDJSON de leads.
+
+GET  /api/leads/  lista em NDJSON (um lead por linha, em streaming), com os mesmos
+                  filtros da lista HTML (q, status, source, tag, owner).
+POST /api/leads/  upsert em lote: corpo NDJSON, um lead por linha, chave natural
+                  (email, company). Responde com o resumo em JSON.
+
+Autenticação: sessão (com CSRF) ou HTTP Basic, para integrações.
+"""
+import base64
+import binascii
+import json
+import time
+from decimal import Decimal
+from functools import wraps
+from typing import Iterator, Optional
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_http_methods
+
+from . import metrics
+from .bulk import UPSERT_KEY_ERROR, TagCache, UpsertResult, upsert_leads
+from .conditional import list_validator
+from .exports import iter_leads
+from .filters import LeadFilters
+from .importer import MAX_STORED_ERRORS, chunked
+from .models import Lead
+
+NDJSON = 'application/x-ndjson'
+
+# campos aceitos no upsert (owner é quem envia; id/datas são do servidor)
+UPSERT_FIELDS = ('name', 'email', 'phone', 'company', 'status', 'source', 'value', 'notes')
+
+
+def _basic_auth_user(request):
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    scheme, _, credentials = header.partition(' ')
+    if scheme.lower() != 'basic':
+        return None
+    try:
+        username, _, password = base64.b64decode(credentials).decode().partition(':')
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    return authenticate(request, username=username, password=password)
+
+
+def api_auth(view):
+    """
+    HTTP Basic (sem sessão, sem CSRF) ou usuário da sessão, com a verificação de CSRF
+    de sempre. Sem credenciais válidas: 401 em JSON, em vez do redirect para o login.
+    """
+    protected = csrf_protect(view)
+
+    @csrf_exempt
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if 'HTTP_AUTHORIZATION' in request.META:
+            user = _basic_auth_user(request)
+            if user is not None:
+                request.user = user
+                return view(request, *args, **kwargs)
+        elif request.user.is_authenticated:
+            return protected(request, *args, **kwargs)
+        resp = JsonResponse({'detail': 'Autenticação necessária.'}, status=401)
+        resp['WWW-Authenticate'] = 'Basic realm="portal-de-leads"'
+        return resp
+
+    return wrapper
+
+
+def lead_json(lead: Lead) -> dict:
+    return {
+        'id': lead.pk,
+        'name': lead.name,
+        'email': lead.email,
+        'phone': lead.phone,
+        'company': lead.company,
+        'status': lead.status,
+        'source': lead.source,
+        'owner': lead.owner.get_username() if lead.owner else None,
+        'value': f'{lead.value:.2f}',
+        # usa o prefetch do bloco do iterator() (sem query por linha)
+        'tags': [t.name for t in lead.tags.all()],
+        'notes': lead.notes,
+        'created_at': lead.created_at,
+        'update_at': lead.update_at,
+    }
+
+
+def ndjson_stream(qs) -> Iterator[str]:
+    encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    for lead in iter_leads(qs):
+        yield encoder.encode(lead_json(lead)) + '\n'
+
+
+def parse_lead(obj) -> tuple[dict, Optional[list[str]]]:
+    """Valida um objeto do NDJSON com as regras dos campos do model. Levanta ValidationError."""
+    if not isinstance(obj, dict):
+        raise ValidationError('Esperado um objeto JSON.')
+    if not obj.get('name'):
+        raise ValidationError({'name': 'Campo obrigatório.'})
+    if obj.get('email') and 'company' not in obj:
+        raise ValidationError({'company': UPSERT_KEY_ERROR})
+
+    values, errors = {}, {}
+    for name in UPSERT_FIELDS:
+        if name not in obj:
+            continue
+        raw = obj[name]
+        if isinstance(raw, str):
+            raw = raw.strip()
+        elif raw is None and name != 'value':
+            raw = ''
+        elif isinstance(raw, float):
+            raw = Decimal(str(raw))
+        try:
+            values[name] = Lead._meta.get_field(name).clean(raw, None)
+        except ValidationError as exc:
+            errors[name] = exc.messages
+
+    tags = obj.get('tags')
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    if tags is not None:
+        if not isinstance(tags, list) or not all(isinstance(t, str) for t in tags):
+            errors['tags'] = ['Esperada uma lista de nomes.']
+        else:
+            tags = [t.strip() for t in tags if t.strip()]
+    if errors:
+        raise ValidationError(errors)
+    return values, tags
+
+
+def _error_text(exc: ValidationError) -> str:
+    if hasattr(exc, 'error_dict'):
+        return '; '.join(f'{field}: {" ".join(msgs)}' for field, msgs in exc.message_dict.items())
+    return ' '.join(exc.messages)
+
+
+class LeadUpserter:
+    """
+    Processa o NDJSON em blocos de IMPORT_CHUNK_SIZE linhas, cada bloco na própria
+    transação. Se o bloco falhar no banco, refaz linha a linha para isolar o erro
+    (mesma estratégia do LeadImporter).
+    """
+
+    def __init__(self, owner=None, chunk_size: Optional[int] = None):
+        self.owner = owner
+        self.chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+        self.tag_cache = TagCache()
+        self.result = UpsertResult()
+        self.rows = 0
+        self.error_count = 0
+        self.errors: list[dict] = []
+
+    def _error(self, line: int, message: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_STORED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def upsert_chunk(self, lines: list[tuple[int, bytes]]) -> None:
+        started = time.perf_counter()
+        parsed = []
+        for number, raw in lines:
+            try:
+                parsed.append((number, parse_lead(json.loads(raw))))
+            except ValueError as exc:  # JSONDecodeError / UnicodeDecodeError
+                self._error(number, f'JSON inválido: {exc}')
+            except ValidationError as exc:
+                self._error(number, _error_text(exc))
+        self.rows += len(lines)
+        try:
+            with transaction.atomic():
+                self._add(upsert_leads([item for _, item in parsed], self.tag_cache, self.owner))
+        except DatabaseError:
+            self.tag_cache = TagCache()
+            for number, item in parsed:
+                try:
+                    with transaction.atomic():
+                        self._add(upsert_leads([item], self.tag_cache, self.owner))
+                except DatabaseError as exc:
+                    self.tag_cache = TagCache()
+                    self._error(number, str(exc))
+        metrics.inc('leads_import_rows_total', len(lines), source='api')
+        metrics.inc('leads_import_duration_seconds_total', time.perf_counter() - started, source='api')
+
+    def _add(self, result: UpsertResult) -> None:
+        self.result.created += result.created
+        self.result.updated += result.updated
+
+    def run(self, stream) -> dict:
+        started = time.perf_counter()
+        lines = ((number, line) for number, line in enumerate(stream, start=1) if line.strip())
+        for chunk in chunked(lines, self.chunk_size):
+            self.upsert_chunk(chunk)
+        elapsed = time.perf_counter() - started
+        return {
+            'created': self.result.created,
+            'updated': self.result.updated,
+            'rows': self.rows,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'rows_per_second': round(self.rows / elapsed) if elapsed else 0,
+        }
+
+
+@api_auth
+@require_http_methods(['GET', 'HEAD', 'POST'])
+def leads_api(request):
+    if request.method == 'POST':
+        # lê o corpo linha a linha (sem carregar o NDJSON inteiro em memória)
+        return JsonResponse(LeadUpserter(owner=request.user).run(request))
+
+    filters = LeadFilters.from_params(request.GET)
+    validator = list_validator(filters, 'ndjson')
+    resp = get_conditional_response(
+        request, etag=validator.etag, last_modified=validator.last_modified.timestamp(),
+    )
+    if resp is None:
+        qs = filters.apply(Lead.objects.all()).order_by('-created_at', '-id')
+        resp = StreamingHttpResponse(ndjson_stream(qs), content_type=NDJSON)
+    resp['ETag'] = validator.etag
+    resp['Last-Modified'] = http_date(validator.last_modified.timestamp())
+    resp['Cache-Control'] = 'private, no-cache'
+    return resp
@@ -3,4 +3,12 @@ from django.apps import AppConfig
 
 class LeadsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'leads'
\ No newline at end of file
+    name = 'leads'
+
+    def ready(self):
+        from django.conf import settings
+
+        from . import checks, metrics, signals  # noqa: F401
+
+        if settings.METRICS_ENABLED:
+            metrics.install()
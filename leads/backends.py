@@ -0,0 +1,60 @@
+"""
+ModelBackend com o usuário autenticado em cache.
+
+A cada request o AuthenticationMiddleware carrega o usuário da sessão (um SELECT
+em auth_user). CachedModelBackend guarda a instância no cache por
+AUTH_USER_CACHE_TIMEOUT segundos; salvar ou excluir o usuário apaga a entrada
+(leads.signals), então troca de senha, desativação e edições no admin valem no
+request seguinte. update() em massa não dispara sinais: nesse caso vale o timeout.
+
+Com vários workers o cache precisa ser compartilhado (ver CACHES), senão os
+outros processos só enxergam a mudança quando a entrada expira (check leads.E003).
+A instância guardada inclui o hash da senha, que o Django usa para validar a sessão.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+
+
+def _user_key(user_id) -> str:
+    return f'leads:user:{user_id}'
+
+
+def forget_user(user_id) -> None:
+    cache.delete(_user_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        user = super().authenticate(request, username=username, password=password, **kwargs)
+        if user is None and password is not None:
+            # o ModelBackend seguinte em AUTHENTICATION_BACKENDS (só para sessões antigas)
+            # refaria o mesmo hash da senha: encerra aqui
+            raise PermissionDenied
+        return user
+
+    def get_user(self, user_id):
+        timeout = settings.AUTH_USER_CACHE_TIMEOUT
+        if not timeout:
+            return super().get_user(user_id)
+        key = _user_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            # None (inexistente/inativo) não vai para o cache
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, timeout)
+        return user
+
+    async def aget_user(self, user_id):
+        timeout = settings.AUTH_USER_CACHE_TIMEOUT
+        if not timeout:
+            return await super().aget_user(user_id)
+        key = _user_key(user_id)
+        user = await cache.aget(key)
+        if user is None:
+            user = await super().aget_user(user_id)
+            if user is not None:
+                await cache.aset(key, user, timeout)
+        return user
@@ -0,0 +1,249 @@
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, Sequence
+
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from . import cache as leads_cache
+from . import rollup
+from .models import Lead, Tag, normalize_company
+
+LeadTag = Lead.tags.through
+
+# sem a empresa a chave ficaria (email, '') e todo lead de outra empresa viraria um novo
+UPSERT_KEY_ERROR = 'o upsert identifica o lead por email + empresa: envie company junto com email.'
+
+
+class TagCache:
+    """
+    Cache em memória nome -> id das tags.
+    Cada tag distinta custa no máximo uma consulta (ou um insert) durante a vida do cache.
+    """
+
+    def __init__(self):
+        self._ids: dict[str, int] = {}
+
+    def resolve(self, names: Iterable[str]) -> dict[str, int]:
+        names = set(names)
+        missing = [n for n in names if n not in self._ids]
+        if missing:
+            self._ids.update(Tag.objects.filter(name__in=missing).values_list('name', 'id'))
+            to_create = [n for n in missing if n not in self._ids]
+            if to_create:
+                # ignore_conflicts protege contra outro processo criando a mesma tag
+                Tag.objects.bulk_create([Tag(name=n) for n in to_create], ignore_conflicts=True)
+                leads_cache.invalidate(leads_cache.TAGS)
+                self._ids.update(Tag.objects.filter(name__in=to_create).values_list('name', 'id'))
+        return {n: self._ids[n] for n in names}
+
+
+def insert_leads(
+    rows: Sequence[tuple[Lead, list[str]]], tag_cache: TagCache, update_rollup: bool = True,
+) -> list[Lead]:
+    """
+    Insere (lead, nomes_de_tags) em lote: um bulk_create para os leads e
+    um único insert para as linhas da tabela M2M.
+    `update_rollup=False` deixa o rollup para um rollup.rebuild() no fim da carga
+    (cargas com muitos dias/owners distintos custariam uma query por grupo).
+    Deve ser chamado dentro de uma transação.
+    """
+    if not rows:
+        return []
+    tag_ids = tag_cache.resolve(n for _, names in rows for n in names)
+    leads = Lead.objects.bulk_create([lead for lead, _ in rows])
+    links = [
+        LeadTag(lead_id=lead.pk, tag_id=tag_ids[name])
+        for lead, (_, names) in zip(leads, rows)
+        for name in dict.fromkeys(names)
+    ]
+    if links:
+        LeadTag.objects.bulk_create(links)
+    # bulk_create não dispara post_save: rollup e caches são atualizados explicitamente
+    if update_rollup:
+        rollup.add_leads(leads)
+    leads_cache.invalidate(leads_cache.LEADS)
+    return leads
+
+
+@dataclass
+class UpsertResult:
+    created: int = 0
+    updated: int = 0
+
+
+def upsert_leads(
+    rows: Sequence[tuple[dict, Optional[list[str]]]], tag_cache: TagCache, owner=None,
+) -> UpsertResult:
+    """
+    Cria ou atualiza leads em lote usando (email sem caixa, company normalizada) como chave
+    natural (constraint unique_lead_email_ci_per_company; leads sem email sempre são criados).
+    Linha com email e sem company levanta ValueError (UPSERT_KEY_ERROR).
+
+    `rows` traz (campos, nomes_de_tags): só os campos presentes são alterados num lead
+    existente e tags=None mantém as tags atuais. Custo fixo por lote: um SELECT dos
+    existentes, um INSERT para os novos, um upsert por pk para os existentes
+    e o insert em lote das tags.
+    Deve ser chamado dentro de uma transação.
+    """
+    keyed: dict[tuple[str, str], tuple[dict, Optional[list[str]]]] = {}
+    unkeyed = []
+    for values, tags in rows:
+        if 'company' in values:
+            # bulk_create não passa pelo Lead.save(): normaliza aqui
+            values = {**values, 'company': normalize_company(values['company'])}
+        if values.get('email'):
+            if 'company' not in values:
+                raise ValueError(UPSERT_KEY_ERROR)
+            # chave repetida no mesmo lote: vale a última ocorrência
+            keyed[(values['email'].lower(), values['company'])] = (values, tags)
+        else:
+            unkeyed.append((values, tags))
+
+    existing = {}
+    if keyed:
+        emails = {email for email, _ in keyed}
+        existing = {
+            (lead.email.lower(), lead.company): lead
+            # Lower('email') usa o índice da constraint
+            for lead in Lead.objects.annotate(email_key=Lower('email')).filter(email_key__in=emails)
+            .exclude(email='')
+        }
+
+    now = timezone.now()
+    to_create, to_update, changes, update_fields = [], [], [], {'update_at'}
+    tagged: list[tuple[Lead, Optional[list[str]]]] = []
+    for key, (values, tags) in keyed.items():
+        lead = existing.get(key)
+        if lead is None:
+            continue
+        old = rollup.lead_state(lead)
+        for name, value in values.items():
+            setattr(lead, name, value)
+        # update_at alimenta ETags e o cache de linhas
+        lead.update_at = now
+        update_fields.update(values)
+        to_update.append(lead)
+        changes.append((old, rollup.lead_state(lead)))
+        tagged.append((lead, tags))
+    for values, tags in [item for key, item in keyed.items() if key not in existing] + unkeyed:
+        lead = Lead(owner=owner, **values)
+        to_create.append(lead)
+        tagged.append((lead, tags))
+
+    Lead.objects.bulk_create(to_create)
+    if to_update:
+        # INSERT ... ON CONFLICT (id) DO UPDATE: um statement por lote, bem mais barato
+        # que o CASE WHEN por linha/campo do bulk_update. Os pks já existem, então
+        # não consome sequence e o conflito é sempre na pk.
+        Lead.objects.bulk_create(
+            to_update, update_conflicts=True, unique_fields=['id'], update_fields=sorted(update_fields),
+        )
+
+    # tags enviadas substituem as atuais (os primeiros de `tagged` são os atualizados)
+    retagged = [lead.pk for lead, tags in tagged[:len(to_update)] if tags is not None]
+    if retagged:
+        LeadTag.objects.filter(lead_id__in=retagged).delete()
+    tag_ids = tag_cache.resolve(n for _, tags in tagged for n in tags or ())
+    links = [
+        LeadTag(lead_id=lead.pk, tag_id=tag_ids[name])
+        for lead, tags in tagged
+        for name in dict.fromkeys(tags or ())
+    ]
+    if links:
+        LeadTag.objects.bulk_create(links)
+
+    changes.extend((None, rollup.lead_state(lead)) for lead in to_create)
+    rollup.move_many(changes)
+    leads_cache.invalidate(leads_cache.LEADS)
+    return UpsertResult(created=len(to_create), updated=len(to_update))
+
+
+# ---- ações em lote da lista -------------------------------------------------
+# A seleção (ids marcados ou tudo que bate com os filtros) é resolvida uma vez em
+# ids; cada bloco de BULK_CHUNK_SIZE ids roda um número fixo de statements
+# (UPDATE / DELETE / INSERT ... SELECT), sem save() por objeto. Resolver antes
+# importa: remover tags muda o resultado de um filtro por tag no meio da ação.
+# Como não há signals, update_at, rollup e caches são mantidos aqui.
+
+BULK_CHUNK_SIZE = 5000
+
+
+def _id_chunks(qs: QuerySet) -> Iterator[list[int]]:
+    ids = list(qs.order_by().values_list('pk', flat=True))
+    for start in range(0, len(ids), BULK_CHUNK_SIZE):
+        yield ids[start:start + BULK_CHUNK_SIZE]
+
+
+@transaction.atomic
+def bulk_update_leads(qs: QuerySet, status: Optional[str] = None, owner=rollup.KEEP) -> int:
+    changes = {}
+    if status:
+        changes['status'] = status
+    if owner is not rollup.KEEP:
+        changes['owner'] = owner
+    if not changes:
+        return 0
+    count = 0
+    for ids in _id_chunks(qs):
+        selection = Lead.objects.filter(pk__in=ids)
+        rollup.move_selection(selection, status=status, owner_id=getattr(owner, 'pk', owner))
+        count += selection.update(**changes, update_at=timezone.now())
+    leads_cache.invalidate(leads_cache.LEADS)
+    return count
+
+
+@transaction.atomic
+def bulk_add_tags(qs: QuerySet, tags: Sequence[Tag]) -> int:
+    qn = connection.ops.quote_name
+    tag_ids = [tag.pk for tag in tags]
+    if not tag_ids:
+        # IN () é SQL inválido; _id_chunks nunca gera bloco vazio
+        return 0
+    count = 0
+    for ids in _id_chunks(qs):
+        with connection.cursor() as cursor:
+            # um INSERT ... SELECT por bloco; o WHERE também desfaz a ambiguidade do ON CONFLICT no SQLite
+            cursor.execute(
+                f'INSERT INTO {qn(LeadTag._meta.db_table)} ({qn("lead_id")}, {qn("tag_id")}) '
+                f'SELECT l.{qn("id")}, t.{qn("id")} FROM {qn(Lead._meta.db_table)} l, {qn(Tag._meta.db_table)} t '
+                f'WHERE l.{qn("id")} IN ({", ".join(["%s"] * len(ids))}) '
+                f'AND t.{qn("id")} IN ({", ".join(["%s"] * len(tag_ids))}) '
+                f'ON CONFLICT DO NOTHING',
+                (*ids, *tag_ids),
+            )
+        count += Lead.objects.filter(pk__in=ids).update(update_at=timezone.now())
+    leads_cache.invalidate(leads_cache.LEADS)
+    return count
+
+
+@transaction.atomic
+def bulk_remove_tags(qs: QuerySet, tags: Sequence[Tag]) -> int:
+    count = 0
+    for ids in _id_chunks(qs):
+        # a tabela M2M não tem signals nem dependentes: delete() vira um único DELETE
+        LeadTag.objects.filter(lead_id__in=ids, tag__in=tags).delete()
+        count += Lead.objects.filter(pk__in=ids).update(update_at=timezone.now())
+    leads_cache.invalidate(leads_cache.LEADS)
+    return count
+
+
+@transaction.atomic
+def bulk_delete_leads(qs: QuerySet) -> int:
+    qn = connection.ops.quote_name
+    count = 0
+    for ids in _id_chunks(qs):
+        selection = Lead.objects.filter(pk__in=ids)
+        rollup.remove_selection(selection)
+        LeadTag.objects.filter(lead_id__in=ids).delete()
+        with connection.cursor() as cursor:
+            # um DELETE por bloco, sem carregar objetos nem enviar signals por lead: Lead não
+            # tem dependentes além da M2M (já removida) e o índice de busca segue por trigger
+            cursor.execute(
+                f'DELETE FROM {qn(Lead._meta.db_table)} WHERE {qn("id")} IN ({", ".join(["%s"] * len(ids))})',
+                ids,
+            )
+            count += cursor.rowcount
+    leads_cache.invalidate(leads_cache.LEADS)
+    return count
@@ -0,0 +1,56 @@
+"""
+Cache versionado por namespace.
+
+Cada namespace ("leads", "tags", "owners") tem um número de versão guardado no
+cache; as chaves derivadas incluem a versão. Invalidar é só incrementar a
+versão: as chaves antigas deixam de ser lidas e expiram sozinhas.
+Com vários workers (gunicorn) o backend de cache precisa ser compartilhado
+(filebased, redis...) para a invalidação valer para todos.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+LEADS = 'leads'
+TAGS = 'tags'
+OWNERS = 'owners'
+
+
+def _version_key(namespace: str) -> str:
+    return f'leads:v:{namespace}'
+
+
+def get_version(namespace: str) -> int:
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # começa do relógio: após um flush do cache nunca reaproveita uma versão antiga
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def _bump(namespaces) -> None:
+    for namespace in namespaces:
+        key = _version_key(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def invalidate(*namespaces: str) -> None:
+    """
+    Invalida agora e de novo após o commit: assim um request concorrente que
+    leu o estado antigo antes do commit não deixa um valor velho em cache.
+    """
+    _bump(namespaces)
+    transaction.on_commit(lambda: _bump(namespaces))
+
+
+def versioned_key(namespace: str, *parts) -> str:
+    raw = '|'.join(str(p) for p in parts)
+    digest = hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()
+    return f'leads:{namespace}:{get_version(namespace)}:{digest}'
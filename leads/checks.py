@@ -0,0 +1,47 @@
+"""
+Checks de configuração (python manage.py check --deploy e na subida do servidor).
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+# backends que guardam o cache na memória de cada processo
+LOCAL_CACHES = ('.LocMemCache', '.DummyCache')
+CACHED_SESSION_ENGINES = ('django.contrib.sessions.backends.cache', 'django.contrib.sessions.backends.cached_db')
+
+
+def _shared(alias: str) -> bool:
+    return not settings.CACHES[alias]['BACKEND'].endswith(LOCAL_CACHES)
+
+
+@register(Tags.caches)
+def shared_cache_check(app_configs, **kwargs):
+    if settings.DEBUG or _shared('default'):
+        return []
+    return [Warning(
+        'CACHE_BACKEND guarda o cache em cada processo: com vários workers as invalidações '
+        'de leads.cache não chegam aos outros e contagens/ETags ficam antigas até o timeout.',
+        hint='Use um backend compartilhado (FileBasedCache num diretório comum ou RedisCache).',
+        id='leads.W001',
+    )]
+
+
+@register(Tags.caches, Tags.security)
+def session_cache_check(app_configs, **kwargs):
+    if settings.DEBUG:
+        return []
+    errors = []
+    if settings.SESSION_ENGINE in CACHED_SESSION_ENGINES and not _shared(settings.SESSION_CACHE_ALIAS):
+        errors.append(Error(
+            'SESSION_ENGINE em cache com um cache por processo: após um logout a sessão '
+            'continua válida nos outros workers até expirar.',
+            hint='Use SESSION_ENGINE=db ou signed_cookies, ou um CACHE_BACKEND compartilhado.',
+            id='leads.E002',
+        ))
+    if settings.AUTH_USER_CACHE_TIMEOUT and not _shared('default'):
+        errors.append(Error(
+            'AUTH_USER_CACHE_TIMEOUT com um cache por processo: troca de senha e desativação '
+            'só valem nos outros workers quando a entrada expira.',
+            hint='Use AUTH_USER_CACHE_TIMEOUT=0 ou um CACHE_BACKEND compartilhado.',
+            id='leads.E003',
+        ))
+    return errors
@@ -0,0 +1,78 @@
+"""
+Validadores (ETag / Last-Modified) da lista de leads e da exportação CSV.
+
+O validador de um filtro é (max(update_at), total) dos leads filtrados, em cache
+sob a versão do namespace LEADS, mais as versões de TAGS/OWNERS (nomes exibidos).
+Um GET condicional que bate com ele responde 304 sem executar a consulta principal.
+O total calculado aqui já abastece o cache de COUNT do paginator.
+
+Onde a lista evita o COUNT (paginação keyset, contagem estimada) o validador usa só
+a versão de LEADS: mais conservador (qualquer alteração muda a ETag), mas sem consulta.
+"""
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from . import cache as leads_cache
+from . import metrics
+from .filters import LeadFilters
+from .models import Lead
+
+
+@dataclass(frozen=True)
+class Validator:
+    etag: str
+    last_modified: datetime
+
+
+def count_cache_key(filters: LeadFilters) -> str:
+    return leads_cache.versioned_key(leads_cache.LEADS, 'count', filters.signature())
+
+
+def _aggregate(filters: LeadFilters) -> tuple[Optional[datetime], int]:
+    key = leads_cache.versioned_key(leads_cache.LEADS, 'validator', filters.signature())
+    cached = cache.get(key)
+    metrics.cache_lookup('validator', hits=cached is not None, misses=cached is None)
+    if cached is None:
+        agg = filters.apply(Lead.objects.all()).aggregate(last=Max('update_at'), total=Count('id'))
+        cached = (agg['last'], agg['total'])
+        cache.set(key, cached, settings.LEADS_COUNT_CACHE_TIMEOUT)
+        # mesmo total que o paginator contaria: poupa o COUNT da página
+        cache.add(count_cache_key(filters), (agg['total'], False), settings.LEADS_COUNT_CACHE_TIMEOUT)
+    return cached
+
+
+def list_validator(filters: LeadFilters, *variant, exact: bool = True) -> Validator:
+    """
+    `variant` distingue representações da mesma URL (CSV, página inteira, parcial HTMX...).
+    `exact=False` dispensa o agregado e usa a versão de LEADS.
+
+    Last-Modified é o instante em que esta ETag foi vista pela primeira vez: max(update_at)
+    sozinho não muda quando um lead é removido ou uma tag é renomeada.
+    """
+    if exact:
+        last, total = _aggregate(filters)
+        state = (last.isoformat() if last else '', total)
+    else:
+        state = ('v', leads_cache.get_version(leads_cache.LEADS))
+    raw = '|'.join(str(p) for p in (
+        filters.signature(), *state,
+        leads_cache.get_version(leads_cache.TAGS), leads_cache.get_version(leads_cache.OWNERS),
+        *variant,
+    ))
+    etag = hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()
+
+    since_key = 'leads:etag:' + hashlib.md5(
+        '|'.join((filters.signature(), *map(str, variant))).encode(), usedforsecurity=False,
+    ).hexdigest()
+    seen = cache.get(since_key)
+    if seen is None or seen[0] != etag:
+        seen = (etag, timezone.now().replace(microsecond=0))  # HTTP-date tem resolução de segundos
+        cache.set(since_key, seen, None)
+    return Validator(f'"{etag}"', seen[1])
@@ -0,0 +1,184 @@
+"""
+Detecção de leads duplicados por blocagem.
+
+Comparar todos os pares é O(n²) (1M de leads = 5·10¹¹ pares). Em vez disso cada
+lead entra em alguns "blocos" por chaves normalizadas e só leads que dividem um
+bloco são comparados:
+
+- email normalizado (minúsculas, sem pontos/"+tag" na parte local de provedores gratuitos)
+- domínio do email, quando não é de provedor gratuito
+- últimos 8 dígitos do telefone (ignora DDI/DDD e formatação)
+- empresa normalizada (sem acentos, pontuação e sufixos como "Ltda", "S/A")
+
+Blocos maiores que `max_block` (ex.: um domínio corporativo enorme) não geram
+pares e são apenas contados: a chave não discrimina o suficiente.
+A leitura é em streaming (values_list + iterator), guardando só tuplas compactas.
+"""
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import dataclass, field
+from itertools import combinations
+from typing import Iterable, Iterator, Optional
+
+from .models import Lead
+
+FREE_EMAIL_DOMAINS = frozenset({
+    'gmail.com', 'googlemail.com', 'hotmail.com', 'outlook.com', 'live.com', 'yahoo.com',
+    'yahoo.com.br', 'icloud.com', 'bol.com.br', 'uol.com.br', 'terra.com.br', 'ig.com.br',
+    'protonmail.com',
+})
+COMPANY_SUFFIXES = frozenset({
+    'ltda', 'sa', 'me', 'mei', 'epp', 'eireli', 'inc', 'llc', 'ltd', 'corp', 'co', 'cia',
+})
+PHONE_DIGITS = 8
+
+# pesos do score quando o email não bate exatamente (somam 1)
+WEIGHTS = {'phone': 0.35, 'name': 0.3, 'company': 0.25, 'domain': 0.1}
+
+_NON_WORD_RE = re.compile(r'[^a-z0-9]+')
+
+
+def strip_accents(text: str) -> str:
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+
+def words(text: str) -> list[str]:
+    return [w for w in _NON_WORD_RE.split(strip_accents(text).lower()) if w]
+
+
+def normalize_email(email: str) -> tuple[str, str]:
+    """(email normalizado, domínio). Pontos e "+tag" só são ignorados em provedores gratuitos."""
+    local, _, domain = email.strip().lower().partition('@')
+    if not domain:
+        return '', ''
+    if domain in FREE_EMAIL_DOMAINS:
+        local = local.split('+', 1)[0].replace('.', '')
+    return f'{local}@{domain}', domain
+
+
+def normalize_phone(phone: str) -> str:
+    return ''.join(c for c in phone if c.isdigit())[-PHONE_DIGITS:]
+
+
+def company_block_key(company: str) -> str:
+    """
+    Chave de blocking/comparação da deduplicação: sem pontuação e sem sufixos
+    societários ("Acme Ltda" == "ACME"). Não é a chave de upsert/unicidade;
+    essa é models.normalize_company.
+    """
+    tokens = words(company)
+    while tokens and tokens[-1] in COMPANY_SUFFIXES:
+        tokens.pop()
+    return ' '.join(tokens)
+
+
+@dataclass(frozen=True)
+class Record:
+    pk: int
+    email: str
+    domain: str
+    phone: str
+    company: str
+    name: frozenset
+
+
+def make_record(pk, name, email, phone, company) -> Record:
+    email, domain = normalize_email(email or '')
+    return Record(
+        pk=pk, email=email, domain=domain, phone=normalize_phone(phone or ''),
+        company=company_block_key(company or ''), name=frozenset(words(name or '')),
+    )
+
+
+def block_keys(record: Record) -> Iterator[str]:
+    if record.email:
+        yield f'e:{record.email}'
+    if record.domain and record.domain not in FREE_EMAIL_DOMAINS:
+        yield f'd:{record.domain}'
+    if len(record.phone) == PHONE_DIGITS:
+        yield f'p:{record.phone}'
+    if record.company:
+        yield f'c:{record.company}'
+
+
+def score(a: Record, b: Record) -> tuple[float, list[str]]:
+    if a.email and a.email == b.email:
+        return 1.0, ['email']
+    total, reasons = 0.0, []
+    if a.phone and a.phone == b.phone:
+        total += WEIGHTS['phone']
+        reasons.append('phone')
+    if a.name and b.name:
+        jaccard = len(a.name & b.name) / len(a.name | b.name)
+        if jaccard:
+            total += WEIGHTS['name'] * jaccard
+            reasons.append('name')
+    if a.company and a.company == b.company:
+        total += WEIGHTS['company']
+        reasons.append('company')
+    if a.domain and a.domain == b.domain and a.domain not in FREE_EMAIL_DOMAINS:
+        total += WEIGHTS['domain']
+        reasons.append('domain')
+    return round(total, 3), reasons
+
+
+@dataclass(frozen=True)
+class DuplicatePair:
+    lead_a: int
+    lead_b: int
+    score: float
+    reasons: tuple
+
+
+@dataclass
+class DedupeResult:
+    pairs: list[DuplicatePair] = field(default_factory=list)
+    leads: int = 0
+    blocks: int = 0
+    comparisons: int = 0
+    skipped_blocks: int = 0
+
+
+def lead_records(qs=None, chunk_size: int = 5000) -> Iterator[Record]:
+    qs = Lead.objects.all() if qs is None else qs
+    rows = qs.order_by().values_list('pk', 'name', 'email', 'phone', 'company')
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield make_record(*row)
+
+
+def find_duplicates(
+    records: Optional[Iterable[Record]] = None,
+    threshold: float = 0.6,
+    max_block: int = 200,
+) -> DedupeResult:
+    """Pares com score >= threshold, do maior para o menor score."""
+    result = DedupeResult()
+    by_pk: dict[int, Record] = {}
+    blocks: dict[str, list[int]] = defaultdict(list)
+    for record in lead_records() if records is None else records:
+        by_pk[record.pk] = record
+        for key in block_keys(record):
+            blocks[key].append(record.pk)
+    result.leads = len(by_pk)
+
+    seen: set[tuple[int, int]] = set()
+    for pks in blocks.values():
+        if len(pks) < 2:
+            continue
+        if len(pks) > max_block:
+            result.skipped_blocks += 1
+            continue
+        result.blocks += 1
+        for a, b in combinations(sorted(pks), 2):
+            # o mesmo par pode aparecer em vários blocos (email e telefone, por exemplo)
+            if (a, b) in seen:
+                continue
+            seen.add((a, b))
+            result.comparisons += 1
+            value, reasons = score(by_pk[a], by_pk[b])
+            if value >= threshold:
+                result.pairs.append(DuplicatePair(a, b, value, tuple(reasons)))
+
+    result.pairs.sort(key=lambda p: (-p.score, p.lead_a, p.lead_b))
+    return result
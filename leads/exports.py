@@ -0,0 +1,252 @@
+"""
+Exportação em streaming da lista de leads: CSV, NDJSON e as versões .gz.
+
+As linhas são agrupadas em blocos de ~EXPORT_BUFFER_SIZE bytes antes de sair
+(e antes de comprimir): menos escritas no socket e um zlib por bloco, não por linha.
+A memória fica constante: um bloco do iterator() e um bloco de saída por vez.
+"""
+import csv
+import re
+import zlib
+from dataclasses import dataclass
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator, Optional
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch, QuerySet
+
+from . import pgcopy
+from .models import Tag
+
+EXPORT_COLUMNS = [
+    'name', 'email', 'phone', 'company', 'status', 'source',
+    'owner', 'value', 'tags', 'notes', 'created_at',
+]
+
+# mesma regra do GZipMiddleware do Django
+_ACCEPTS_GZIP_RE = re.compile(r'\bgzip\b')
+
+
+def export_columns(raw: str) -> list[str]:
+    """Colunas do parâmetro `fields` ("name,email,..."), na ordem padrão; vazio = todas."""
+    wanted = {c.strip() for c in (raw or '').split(',')}
+    return [c for c in EXPORT_COLUMNS if c in wanted] or list(EXPORT_COLUMNS)
+
+
+def accepts_gzip(request) -> bool:
+    return bool(_ACCEPTS_GZIP_RE.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+
+
+class Echo:
+    """Pseudo-buffer: csv.writer devolve a linha em vez de escrever."""
+
+    @staticmethod
+    def write(value):
+        return value
+
+
+def _model_fields(column: str) -> list[str]:
+    if column == 'owner':
+        return [f'owner__{get_user_model().USERNAME_FIELD}']
+    return [] if column == 'tags' else [column]
+
+
+def export_queryset(qs: QuerySet, columns: list[str] = EXPORT_COLUMNS) -> QuerySet:
+    """
+    Prepara o queryset para exportação: owner vem no mesmo SELECT (join) e as
+    tags são pré-carregadas por bloco do iterator(), com um único SELECT por bloco.
+    Com um subconjunto de colunas, o SELECT traz só os campos usados (sem `notes`, por exemplo).
+    """
+    qs = qs.select_related('owner' if 'owner' in columns else None).prefetch_related(None)
+    if 'tags' in columns:
+        qs = qs.prefetch_related(Prefetch('tags', queryset=Tag.objects.only('name')))
+    if list(columns) != EXPORT_COLUMNS:
+        qs = qs.only(*(f for column in columns for f in _model_fields(column)))
+    return qs
+
+
+def iter_leads(qs: QuerySet, chunk_size: Optional[int] = None, columns: list[str] = EXPORT_COLUMNS):
+    """
+    Percorre o queryset em blocos com memória constante. No PostgreSQL o
+    iterator() usa cursor do lado do servidor; no SQLite lê via fetchmany.
+    """
+    return export_queryset(qs, columns).iterator(chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE)
+
+
+CSV_VALUES: dict[str, Callable] = {
+    'name': lambda lead: lead.name,
+    'email': lambda lead: lead.email,
+    'phone': lambda lead: lead.phone,
+    'company': lambda lead: lead.company,
+    'status': lambda lead: lead.get_status_display(),
+    'source': lambda lead: lead.get_source_display(),
+    'owner': lambda lead: lead.owner.get_username() if lead.owner else '',
+    'value': lambda lead: f'{lead.value:.2f}',
+    # lead.tags.all() usa o prefetch do bloco (sem query por linha)
+    'tags': lambda lead: ', '.join(t.name for t in lead.tags.all()),
+    'notes': lambda lead: (lead.notes or '').replace('\r\n', ' ').replace('\n', ' '),
+    'created_at': lambda lead: lead.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+}
+
+# NDJSON é para integrações: códigos de status/source em vez dos rótulos, tags em lista
+JSON_VALUES: dict[str, Callable] = {
+    **CSV_VALUES,
+    'status': lambda lead: lead.status,
+    'source': lambda lead: lead.source,
+    'owner': lambda lead: lead.owner.get_username() if lead.owner else None,
+    'tags': lambda lead: [t.name for t in lead.tags.all()],
+    'notes': lambda lead: lead.notes,
+    'created_at': lambda lead: lead.created_at,
+}
+
+
+async def aiter_leads(qs: QuerySet, chunk_size: Optional[int] = None, columns: list[str] = EXPORT_COLUMNS):
+    """iter_leads() para views async: aiterator() busca cada bloco (e o prefetch das tags) sem bloquear o loop."""
+    async for lead in export_queryset(qs, columns).aiterator(chunk_size=chunk_size or settings.EXPORT_CHUNK_SIZE):
+        yield lead
+
+
+def lead_row(lead, columns: list[str] = EXPORT_COLUMNS) -> list:
+    return [CSV_VALUES[c](lead) for c in columns]
+
+
+def csv_stream(qs: QuerySet, chunk_size: Optional[int] = None, columns: list[str] = EXPORT_COLUMNS) -> Iterator[str]:
+    # BOM para Excel (Windows) reconhecer UTF-8
+    yield '\ufeff'
+    writer = csv.writer(Echo(), lineterminator='\n')
+    yield writer.writerow(columns)
+    for lead in iter_leads(qs, chunk_size, columns):
+        yield writer.writerow(lead_row(lead, columns))
+
+
+async def acsv_stream(qs: QuerySet, chunk_size: Optional[int] = None, columns: list[str] = EXPORT_COLUMNS) -> AsyncIterator[str]:
+    yield '\ufeff'
+    writer = csv.writer(Echo(), lineterminator='\n')
+    yield writer.writerow(columns)
+    async for lead in aiter_leads(qs, chunk_size, columns):
+        yield writer.writerow(lead_row(lead, columns))
+
+
+def _json_row(columns: list[str]) -> Callable[..., str]:
+    encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    values = [(c, JSON_VALUES[c]) for c in columns]
+    return lambda lead: encoder.encode({c: value(lead) for c, value in values}) + '\n'
+
+
+def ndjson_stream(qs: QuerySet, chunk_size: Optional[int] = None, columns: list[str] = EXPORT_COLUMNS) -> Iterator[str]:
+    row = _json_row(columns)
+    for lead in iter_leads(qs, chunk_size, columns):
+        yield row(lead)
+
+
+async def andjson_stream(qs: QuerySet, chunk_size: Optional[int] = None, columns: list[str] = EXPORT_COLUMNS) -> AsyncIterator[str]:
+    row = _json_row(columns)
+    async for lead in aiter_leads(qs, chunk_size, columns):
+        yield row(lead)
+
+
+class _Buffer:
+    """Acumula str/bytes e devolve um bloco quando passa de `size` bytes."""
+
+    def __init__(self, size: Optional[int] = None):
+        self.size = size or settings.EXPORT_BUFFER_SIZE
+        self.parts, self.length = [], 0
+
+    def add(self, chunk) -> Optional[bytes]:
+        data = chunk.encode() if isinstance(chunk, str) else bytes(chunk)
+        self.parts.append(data)
+        self.length += len(data)
+        return self.flush() if self.length >= self.size else None
+
+    def flush(self) -> bytes:
+        block = b''.join(self.parts)
+        self.parts, self.length = [], 0
+        return block
+
+
+def buffered(chunks: Iterable, size: Optional[int] = None) -> Iterator[bytes]:
+    """Junta as linhas (str ou bytes) em blocos de ~size bytes (UTF-8)."""
+    buffer = _Buffer(size)
+    for chunk in chunks:
+        if block := buffer.add(chunk):
+            yield block
+    if block := buffer.flush():
+        yield block
+
+
+async def abuffered(chunks: AsyncIterable, size: Optional[int] = None) -> AsyncIterator[bytes]:
+    buffer = _Buffer(size)
+    async for chunk in chunks:
+        if block := buffer.add(chunk):
+            yield block
+    if block := buffer.flush():
+        yield block
+
+
+def _gzip_compressor(level: Optional[int] = None):
+    level = settings.EXPORT_GZIP_LEVEL if level is None else level
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def gzip_stream(blocks: Iterable[bytes], level: Optional[int] = None) -> Iterator[bytes]:
+    """Comprime incrementalmente (formato gzip), um bloco por vez."""
+    compressor = _gzip_compressor(level)
+    for block in blocks:
+        if data := compressor.compress(block):
+            yield data
+    yield compressor.flush()
+
+
+async def agzip_stream(blocks: AsyncIterable[bytes], level: Optional[int] = None) -> AsyncIterator[bytes]:
+    compressor = _gzip_compressor(level)
+    async for block in blocks:
+        if data := compressor.compress(block):
+            yield data
+    yield compressor.flush()
+
+
+@dataclass(frozen=True)
+class ExportFormat:
+    stream: Callable[..., Iterator[str]]
+    astream: Callable[..., AsyncIterator[str]]
+    content_type: str
+    filename: str
+    gzip: bool = False
+
+
+EXPORT_FORMATS = {
+    'csv': ExportFormat(csv_stream, acsv_stream, 'text/csv; charset=utf-8', 'leads.csv'),
+    'csv.gz': ExportFormat(csv_stream, acsv_stream, 'application/gzip', 'leads.csv.gz', gzip=True),
+    'ndjson': ExportFormat(ndjson_stream, andjson_stream, 'application/x-ndjson', 'leads.ndjson'),
+    'ndjson.gz': ExportFormat(ndjson_stream, andjson_stream, 'application/gzip', 'leads.ndjson.gz', gzip=True),
+}
+
+
+def export_stream(fmt: ExportFormat, qs: QuerySet, columns: list[str], compress: bool = False) -> Iterator[bytes]:
+    """Bytes da exportação; comprime quando o formato é .gz ou `compress` (Content-Encoding)."""
+    if fmt.stream is csv_stream and pgcopy.enabled():
+        # PostgreSQL: o CSV sai pronto do COPY, sem instanciar leads
+        blocks = buffered(pgcopy.csv_stream(qs, columns))
+    else:
+        blocks = buffered(fmt.stream(qs, columns=columns))
+    return gzip_stream(blocks) if fmt.gzip or compress else blocks
+
+
+async def _aiterate(iterator: Iterator):
+    """Consome um iterador síncrono (que acessa o banco) fora do loop, um item por vez."""
+    done = object()
+    while (item := await sync_to_async(next)(iterator, done)) is not done:
+        yield item
+
+
+def aexport_stream(fmt: ExportFormat, qs: QuerySet, columns: list[str], compress: bool = False) -> AsyncIterator[bytes]:
+    """export_stream() para servir via ASGI: vários downloads no mesmo processo/loop."""
+    if fmt.stream is csv_stream and pgcopy.enabled():
+        # o COPY é síncrono: cada bloco de ~64 KiB é lido numa thread
+        blocks = _aiterate(buffered(pgcopy.csv_stream(qs, columns)))
+    else:
+        blocks = abuffered(fmt.astream(qs, columns=columns))
+    return agzip_stream(blocks) if fmt.gzip or compress else blocks
@@ -0,0 +1,70 @@
+from dataclasses import dataclass, fields
+from typing import Optional
+
+from django.db.models import Exists, OuterRef, QuerySet
+
+from .models import Lead
+from .search import get_search_backend
+
+# maior id aceito por um BigAutoField (e pelo INTEGER do SQLite)
+MAX_ID = 2 ** 63 - 1
+
+
+def parse_id(value: str) -> Optional[int]:
+    """Id positivo da querystring ou None (texto, '²', valores fora do intervalo do banco)."""
+    try:
+        number = int(value)
+    except ValueError:
+        return None
+    return number if 0 < number <= MAX_ID else None
+
+
+@dataclass(frozen=True)
+class LeadFilters:
+    """Filtros da lista de leads (q, status, source, tag, owner), já normalizados."""
+
+    q: str = ''
+    status: str = ''
+    source: str = ''
+    tag: str = ''
+    owner: str = ''
+
+    @classmethod
+    def from_params(cls, params) -> 'LeadFilters':
+        return cls(**{f.name: (params.get(f.name) or '').strip() for f in fields(cls)})
+
+    def params(self) -> dict:
+        """Filtros preenchidos, para reconstruir a querystring da lista."""
+        return {f.name: getattr(self, f.name) for f in fields(self) if getattr(self, f.name)}
+
+    def signature(self) -> str:
+        """Assinatura estável do filtro, para chaves de cache (q na forma que o backend de busca compara)."""
+        q = get_search_backend().cache_key(self.q) if self.q else ''
+        return '&'.join(f'{name}={value}' for name, value in (
+            ('q', q), ('status', self.status), ('source', self.source), ('tag', self.tag), ('owner', self.owner),
+        ) if value)
+
+    def apply(self, qs: QuerySet, rank: bool = False) -> QuerySet:
+        if self.q:
+            backend = get_search_backend()
+            qs = backend.filter(qs, self.q)
+            if rank and backend.ranked:
+                qs = backend.rank(qs, self.q).order_by('-search_rank', '-created_at')
+        if self.status:
+            qs = qs.filter(status=self.status)
+        if self.source:
+            qs = qs.filter(source=self.source)
+        if self.tag:
+            tag_id = parse_id(self.tag)
+            if tag_id is None:
+                return qs.none()
+            # EXISTS em vez de JOIN: não duplica linhas, então dispensa o DISTINCT
+            qs = qs.filter(Exists(
+                Lead.tags.through.objects.filter(lead_id=OuterRef('pk'), tag_id=tag_id)
+            ))
+        if self.owner:
+            owner_id = parse_id(self.owner)
+            if owner_id is None:
+                return qs.none()
+            qs = qs.filter(owner_id=owner_id)
+        return qs
@@ -1,5 +1,9 @@
 from django import forms
-from .models import Lead
+from django.contrib.auth import get_user_model
+
+from .filters import parse_id
+from .importer import read_columns, upsert_columns_error
+from .models import ImportJob, Lead, Tag, normalize_company
 
 
 class LeadForm(forms.ModelForm):
@@ -20,11 +24,81 @@ class LeadForm(forms.ModelForm):
             else:
                 field.widget.attrs.setdefault('class', 'form-control')
 
+    def clean_company(self):
+        # normalizada antes da validação da constraint (email sem caixa, empresa), como no save()
+        return normalize_company(self.cleaned_data.get('company'))
+
 class CSVImportForm(forms.Form):
     file = forms.FileField(
         help_text='CSV com colunas: name,email,phone,company,status,source,value,notes,tags'
     )
+    mode = forms.ChoiceField(
+        label='Modo', choices=ImportJob.Mode.choices, initial=ImportJob.Mode.CREATE, required=False,
+        help_text='No modo atualizar, só as colunas presentes no CSV mudam leads já existentes.',
+    )
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['file'].widget.attrs.setdefault('class', 'form-control')
\ No newline at end of file
+        self.fields['file'].widget.attrs.setdefault('class', 'form-control')
+        self.fields['mode'].widget.attrs.setdefault('class', 'form-select')
+
+    def clean_mode(self):
+        return self.cleaned_data.get('mode') or ImportJob.Mode.CREATE
+
+    def clean(self):
+        data = super().clean()
+        upload = data.get('file')
+        if upload and data.get('mode') == ImportJob.Mode.UPSERT:
+            if upsert_columns_error(read_columns(upload)):
+                self.add_error('file', 'No modo atualizar o CSV precisa da coluna company junto com email.')
+        return data
+
+
+class LeadIdsField(forms.Field):
+    """Lista de ids vinda de vários checkboxes com o mesmo name."""
+
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        ids = []
+        for raw in value or []:
+            # parse_id recusa também ids além do INTEGER do banco (OverflowError no pk__in)
+            pk = parse_id(str(raw))
+            if pk is None:
+                raise forms.ValidationError('Seleção inválida.')
+            ids.append(pk)
+        return ids
+
+
+class LeadBulkActionForm(forms.Form):
+    ACTIONS = [
+        ('status', 'Alterar status'),
+        ('owner', 'Trocar owner'),
+        ('add_tag', 'Adicionar tag'),
+        ('remove_tag', 'Remover tag'),
+        ('delete', 'Remover leads'),
+    ]
+    SCOPES = [
+        ('selected', 'Selecionados'),
+        ('filtered', 'Todos os leads do filtro atual'),
+    ]
+
+    action = forms.ChoiceField(choices=ACTIONS)
+    scope = forms.ChoiceField(choices=SCOPES, initial='selected')
+    ids = LeadIdsField(required=False)
+    # prefixo set_: o mesmo POST leva os filtros da lista (status, tag, owner...)
+    set_status = forms.ChoiceField(choices=Lead.Status.choices, required=False)
+    # vazio = leads ficam sem owner
+    set_owner = forms.ModelChoiceField(get_user_model().objects.all(), required=False)
+    set_tag = forms.ModelChoiceField(Tag.objects.all(), required=False)
+
+    def clean(self):
+        data = super().clean()
+        action = data.get('action')
+        if data.get('scope') == 'selected' and not data.get('ids'):
+            raise forms.ValidationError('Selecione ao menos um lead.')
+        if action == 'status' and not data.get('set_status'):
+            self.add_error('set_status', 'Escolha o novo status.')
+        if action in ('add_tag', 'remove_tag') and not data.get('set_tag'):
+            self.add_error('set_tag', 'Escolha a tag.')
+        return data
@@ -0,0 +1,328 @@
+import csv
+import io
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from typing import IO, Iterable, Iterator, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import metrics, pgcopy
+from .bulk import UPSERT_KEY_ERROR, TagCache, UpsertResult, insert_leads, upsert_leads
+from .dedupe import strip_accents
+from .models import ImportJob, Lead
+
+# quantos erros de linha guardar no ImportJob (o total fica em error_count)
+MAX_STORED_ERRORS = 100
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_memory_bytes() -> Optional[int]:
+    """Pico de memória residente do processo (None quando indisponível)."""
+    if resource is None:
+        return None
+    # ru_maxrss vem em KB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def open_csv(fileobj: IO[bytes]) -> Iterator[dict]:
+    """
+    Decodifica o upload como stream (sem carregar o arquivo inteiro em memória).
+    'utf-8-sig' aceita o BOM gerado pela própria exportação.
+    """
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', errors='ignore', newline='')
+    try:
+        yield from csv.DictReader(text)
+    finally:
+        # não fecha o arquivo original junto com o wrapper
+        text.detach()
+
+
+def read_columns(fileobj: IO[bytes]) -> list[str]:
+    """Colunas do cabeçalho, sem consumir o arquivo (volta para o início)."""
+    header = fileobj.readline().decode('utf-8-sig', errors='ignore')
+    fileobj.seek(0)
+    return [name.strip() for name in next(csv.reader([header]), [])]
+
+
+def upsert_columns_error(columns: Iterable[str]) -> Optional[str]:
+    """Erro do arquivo inteiro no modo upsert: email sem a coluna company."""
+    columns = set(columns)
+    return UPSERT_KEY_ERROR if 'email' in columns and 'company' not in columns else None
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    it = iter(iterable)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def _choice_lookup(choices) -> dict:
+    # aceita o código ("WON"), o rótulo ("Ganho") ou o nome ("won"), sem caixa nem acentos
+    lookup = {}
+    for member in choices:
+        for alias in (member.value, member.label, member.name):
+            lookup[strip_accents(alias).casefold()] = member.value
+    return lookup
+
+
+_STATUSES = _choice_lookup(Lead.Status)
+_SOURCES = _choice_lookup(Lead.Source)
+
+
+def parse_choice(raw: Optional[str], lookup: dict, default: str, field_name: str) -> str:
+    """Código da choice para o texto do CSV (vazio = `default`). Levanta ValueError se não existir."""
+    raw = (raw or '').strip()
+    if not raw:
+        return default
+    try:
+        return lookup[strip_accents(raw).casefold()]
+    except KeyError:
+        raise ValueError(f'{field_name} desconhecido: {raw!r}') from None
+
+
+def parse_values(row: dict) -> tuple[dict, list[str]]:
+    """
+    Campos normalizados de uma linha do CSV (todas as colunas) e nomes das tags.
+    Levanta ValueError para status/source fora das choices.
+    """
+    # tags
+    tag_names = [t.strip() for t in (row.get('tags') or '').split(',') if t.strip()]
+
+    # valor
+    value_raw = (row.get('value') or '0').replace(',', '.')
+    try:
+        value = Decimal(value_raw)
+    except (InvalidOperation, ValueError):
+        value = Decimal('0')
+
+    values = dict(
+        name=' '.join((row.get('name') or '').split()),
+        # email em minúsculas e empresa sem espaços repetidos: a chave (email, company)
+        # não deixa passar "Acme  Ltda" / "ALICE@acme.com" como leads diferentes
+        email=(row.get('email') or '').strip().lower(),
+        phone=(row.get('phone') or '').strip(),
+        company=' '.join((row.get('company') or '').split()),
+        status=parse_choice(row.get('status'), _STATUSES, Lead.Status.NEW, 'status'),
+        source=parse_choice(row.get('source'), _SOURCES, Lead.Source.OTHER, 'source'),
+        value=value,
+        notes=(row.get('notes') or '').strip(),
+    )
+    return values, tag_names
+
+
+def parse_row(row: dict, owner=None) -> tuple[Lead, list[str]]:
+    values, tag_names = parse_values(row)
+    return Lead(owner=owner, **values), tag_names
+
+
+# colunas do CSV que o modo upsert copia para um lead existente
+UPSERT_COLUMNS = ('name', 'email', 'phone', 'company', 'status', 'source', 'value', 'notes')
+
+
+def parse_upsert_row(row: dict) -> tuple[dict, Optional[list[str]]]:
+    """
+    Para upsert_leads: só as colunas presentes no CSV alteram um lead existente;
+    sem a coluna tags, as tags atuais são mantidas.
+    """
+    values, tag_names = parse_values(row)
+    values = {name: value for name, value in values.items() if name in row}
+    return values, (tag_names if 'tags' in row else None)
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    rows: int = 0
+    errors: list[str] = field(default_factory=list)
+    elapsed: float = 0.0
+    peak_memory: Optional[int] = None
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> str:
+        text = f'{self.created} leads'
+        if self.updated:
+            text += f' ({self.updated} atualizados)'
+        text += f', {self.rows_per_second:.0f} linhas/s'
+        if self.peak_memory:
+            text += f', pico de memória {self.peak_memory / 1024 / 1024:.0f} MB'
+        return text
+
+
+class LeadImporter:
+    """
+    Importa leads de um CSV em blocos de tamanho fixo.
+    Cada bloco roda na própria transação: um bulk_create para os leads e um
+    insert em lote para as tags, com as tags resolvidas por um cache em memória.
+    No modo upsert, leads com o mesmo (email, company) são atualizados (ver upsert_leads).
+    No PostgreSQL o bloco vai por COPY para uma tabela temporária (ver leads.pgcopy).
+    """
+
+    def __init__(
+        self, owner=None, chunk_size: Optional[int] = None, mode: str = ImportJob.Mode.CREATE,
+        copy: Optional[bool] = None,
+    ):
+        self.owner = owner
+        self.chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+        self.mode = mode
+        self.copy = pgcopy.enabled() if copy is None else copy
+        self.tag_cache = TagCache()
+
+    def _parse(self, rows: list[dict], first_line: int) -> tuple[list, list[int], list[str]]:
+        """Linhas válidas, o número de cada uma no arquivo e os erros das recusadas."""
+        parse = parse_upsert_row if self.mode == ImportJob.Mode.UPSERT else parse_values
+        parsed, lines, errors = [], [], []
+        for offset, row in enumerate(rows):
+            try:
+                parsed.append(parse(row))
+            except ValueError as exc:
+                errors.append(f'Linha {first_line + offset}: {exc}')
+                continue
+            lines.append(first_line + offset)
+        return parsed, lines, errors
+
+    def _write(self, parsed: list, result: ImportResult, copy: bool = False) -> list[int]:
+        """Grava o bloco. Devolve as posições (em `parsed`) recusadas por já existirem."""
+        upsert = self.mode == ImportJob.Mode.UPSERT
+        skipped = []
+        if copy:
+            written, skipped = pgcopy.import_leads(parsed, owner=self.owner, upsert=upsert)
+        elif upsert:
+            written = upsert_leads(parsed, self.tag_cache, owner=self.owner)
+        else:
+            leads = [(Lead(owner=self.owner, **values), tags) for values, tags in parsed]
+            written = UpsertResult(created=len(insert_leads(leads, self.tag_cache)))
+        result.created += written.created
+        result.updated += written.updated
+        return skipped
+
+    def import_chunk(self, rows: list[dict], first_line: int, result: ImportResult) -> None:
+        started = time.perf_counter()
+        if self.mode == ImportJob.Mode.UPSERT and rows and upsert_columns_error(rows[0]):
+            raise ValueError(UPSERT_KEY_ERROR)
+        parsed, lines, parse_errors = self._parse(rows, first_line)
+        result.errors.extend(parse_errors)
+        try:
+            with transaction.atomic():
+                chunk_result = ImportResult()
+                skipped = self._write(parsed, chunk_result, copy=self.copy)
+            result.created += chunk_result.created
+            result.updated += chunk_result.updated
+            result.errors.extend(f'Linha {lines[i]}: {pgcopy.DUPLICATE_ERROR}' for i in skipped)
+        except DatabaseError:
+            # algum registro inválido no bloco: refaz linha a linha (pelo ORM) para isolar o problema.
+            # O rollback pode ter desfeito tags recém-criadas, então o cache é descartado.
+            self.tag_cache = TagCache()
+            parsed, lines, _ = self._parse(rows, first_line)
+            for line, item in zip(lines, parsed):
+                try:
+                    with transaction.atomic():
+                        self._write([item], result)
+                except DatabaseError as exc:
+                    self.tag_cache = TagCache()
+                    result.errors.append(f'Linha {line}: {exc}')
+        result.rows += len(rows)
+        metrics.inc('leads_import_rows_total', len(rows), source='csv')
+        metrics.inc('leads_import_duration_seconds_total', time.perf_counter() - started, source='csv')
+
+    def run(self, fileobj: IO[bytes]) -> ImportResult:
+        result = ImportResult()
+        started = time.perf_counter()
+        line = 2  # linha 1 é o cabeçalho
+        for rows in chunked(open_csv(fileobj), self.chunk_size):
+            self.import_chunk(rows, line, result)
+            line += len(rows)
+        result.elapsed = time.perf_counter() - started
+        result.peak_memory = peak_memory_bytes()
+        return result
+
+
+class JobLost(Exception):
+    """O job foi reassumido por outro worker."""
+
+
+def claim_job() -> Optional[ImportJob]:
+    """
+    Reserva o próximo job da fila: pendente, ou em execução com heartbeat expirado
+    (worker que morreu no meio). A reserva é um UPDATE condicional, então dois
+    workers nunca pegam o mesmo job.
+    """
+    stale = timezone.now() - timedelta(seconds=settings.IMPORT_JOB_STALE_AFTER)
+    candidates = ImportJob.objects.filter(
+        Q(status=ImportJob.Status.PENDING)
+        | Q(status=ImportJob.Status.RUNNING, heartbeat_at__lt=stale)
+    ).order_by('created_at')
+    for job in candidates[:10]:
+        now = timezone.now()
+        claimed = ImportJob.objects.filter(
+            pk=job.pk, status=job.status, heartbeat_at=job.heartbeat_at
+        ).update(status=ImportJob.Status.RUNNING, heartbeat_at=now, started_at=job.started_at or now)
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def run_job(job: ImportJob, chunk_size: Optional[int] = None) -> ImportJob:
+    """
+    Processa o job a partir de row_cursor. O bloco importado e o avanço do cursor
+    são commitados na mesma transação: se o worker cair, o job recomeça do último
+    bloco commitado.
+    """
+    importer = LeadImporter(owner=job.owner, chunk_size=chunk_size, mode=job.mode)
+    try:
+        with job.file.open('rb') as fh:
+            if job.total_rows is None:
+                job.total_rows = sum(1 for _ in open_csv(fh))
+                fh.seek(0)
+                ImportJob.objects.filter(pk=job.pk).update(total_rows=job.total_rows)
+
+            rows = islice(open_csv(fh), job.row_cursor, None)
+            for chunk in chunked(rows, importer.chunk_size):
+                result = ImportResult()
+                with transaction.atomic():
+                    importer.import_chunk(chunk, job.row_cursor + 2, result)
+                    errors = (job.errors + result.errors)[:MAX_STORED_ERRORS]
+                    advanced = ImportJob.objects.filter(pk=job.pk, row_cursor=job.row_cursor).update(
+                        row_cursor=job.row_cursor + len(chunk),
+                        created_count=job.created_count + result.created,
+                        updated_count=job.updated_count + result.updated,
+                        error_count=job.error_count + len(result.errors),
+                        errors=errors,
+                        heartbeat_at=timezone.now(),
+                    )
+                    if not advanced:
+                        # outro worker assumiu o job: desfaz este bloco e desiste
+                        raise JobLost(job.pk)
+                job.row_cursor += len(chunk)
+                job.created_count += result.created
+                job.updated_count += result.updated
+                job.error_count += len(result.errors)
+                job.errors = errors
+    except JobLost:
+        return job
+    except OperationalError:
+        # conexão perdida/banco fora: não é culpa do arquivo. O job continua RUNNING e
+        # outro ciclo do worker o retoma do último bloco commitado quando o heartbeat vencer.
+        raise
+    except Exception as exc:
+        job.status = ImportJob.Status.FAILED
+        job.errors = (job.errors + [f'Falha: {exc}'])[:MAX_STORED_ERRORS + 1]
+    else:
+        job.status = ImportJob.Status.DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'errors', 'finished_at'])
+    return job
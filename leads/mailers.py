@@ -1,7 +1,15 @@
+import smtplib
+from dataclasses import dataclass
+from functools import lru_cache
 from typing import Iterable, Optional
 from django.conf import settings
 from django.core.mail import get_connection, EmailMultiAlternatives
-from django.template.loader import render_to_string
+from django.template.loader import get_template
+
+from . import metrics
+
+# erros que indicam conexão SMTP caída (vale reconectar e tentar de novo)
+_DROPPED = (smtplib.SMTPServerDisconnected, ConnectionError)
 
 
 def _conn_for(provider: Optional[str] = None):
@@ -27,6 +35,22 @@ def _conn_for(provider: Optional[str] = None):
     return conn, conf
 
 
+@lru_cache(maxsize=32)
+def _compiled_templates(template_base: str):
+    return get_template(f'email/{template_base}.txt'), get_template(f'email/{template_base}.html')
+
+
+def _render(template_base: str, context: dict) -> tuple[str, str]:
+    """
+    Renderiza os templates texto/HTML. Os templates compilados ficam em cache
+    por processo (exceto com DEBUG, para refletir edições sem reiniciar).
+    """
+    if settings.DEBUG:
+        _compiled_templates.cache_clear()
+    text_tpl, html_tpl = _compiled_templates(template_base)
+    return text_tpl.render(context), html_tpl.render(context)
+
+
 def send_mail_using(
     provider: Optional[str],
     subject: str,
@@ -56,7 +80,17 @@ def send_mail_using(
     )
     if html_body:
         msg.attach_alternative(html_body, 'text/html')
-    return msg.send()
+    return _send(msg)
+
+
+def _send(msg: EmailMultiAlternatives) -> int:
+    try:
+        sent = msg.send()
+    except Exception:
+        metrics.inc('leads_email_messages_total', channel='direct', result='failed')
+        raise
+    metrics.inc('leads_email_messages_total', channel='direct', result='sent' if sent else 'failed')
+    return sent
 
 
 def send_templated_mail(
@@ -78,8 +112,7 @@ def send_templated_mail(
     conn, conf = _conn_for(provider)
     sender = from_email or conf['DEFAULT_FROM_EMAIL'] or conf['USER']
 
-    text_body = render_to_string(f'email/{template_base}.txt', context)
-    html_body = render_to_string(f'email/{template_base}.html', context)
+    text_body, html_body = _render(template_base, context)
 
     msg = EmailMultiAlternatives(
         subject=subject,
@@ -93,4 +126,74 @@ def send_templated_mail(
     )
     if html_body:
         msg.attach_alternative(html_body, 'text/html')
-    return msg.send()
\ No newline at end of file
+    return _send(msg)
+
+
+@dataclass
+class MailResult:
+    to: list[str]
+    sent: bool
+    error: Optional[str] = None
+
+
+def send_templated_mass_mail(
+    provider: Optional[str],
+    template_base: str,
+    messages: Iterable[dict],
+    from_email: Optional[str] = None,
+) -> list[MailResult]:
+    """
+    Envia um lote de e-mails com templates por UMA conexão SMTP do provedor
+    (um handshake TCP/TLS/AUTH para o lote inteiro).
+    Cada mensagem é um dict com: subject, to, context e, opcionalmente,
+    cc, bcc, reply_to e from_email.
+    Se a conexão cair no meio, reconecta e reenvia a mensagem uma vez.
+    Retorna um MailResult por mensagem, na mesma ordem, sem levantar exceção:
+    mensagem malformada ou servidor inacessível viram resultados com sent=False.
+    """
+    conn, conf = _conn_for(provider)
+    default_sender = from_email or conf['DEFAULT_FROM_EMAIL'] or conf['USER']
+    results = []
+    try:
+        conn.open()
+        open_error = None
+    except Exception as exc:
+        # sem conexão nenhuma mensagem sai: a falha é registrada em cada uma
+        open_error = exc
+    try:
+        for item in messages:
+            to = []
+            try:
+                to = list(item['to'])
+                if open_error is not None:
+                    raise open_error
+                text_body, html_body = _render(template_base, item.get('context', {}))
+                msg = EmailMultiAlternatives(
+                    subject=item['subject'],
+                    body=text_body,
+                    from_email=item.get('from_email') or default_sender,
+                    to=to,
+                    cc=list(item.get('cc') or []),
+                    bcc=list(item.get('bcc') or []),
+                    reply_to=list(item.get('reply_to') or []),
+                    connection=conn,
+                )
+                if html_body:
+                    msg.attach_alternative(html_body, 'text/html')
+                try:
+                    sent = conn.send_messages([msg])
+                except _DROPPED:
+                    conn.close()
+                    conn.open()
+                    sent = conn.send_messages([msg])
+            except Exception as exc:
+                results.append(MailResult(to=to, sent=False, error=f'{type(exc).__name__}: {exc}'))
+            else:
+                results.append(MailResult(to=to, sent=bool(sent)))
+    finally:
+        conn.close()
+        for outcome in ('sent', 'failed'):
+            count = sum(1 for r in results if r.sent == (outcome == 'sent'))
+            if count:
+                metrics.inc('leads_email_messages_total', count, channel='direct', result=outcome)
+    return results
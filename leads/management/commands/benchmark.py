@@ -0,0 +1,499 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+from statistics import median, quantiles
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import F
+from django.test import AsyncRequestFactory, RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from leads.api import LeadUpserter
+from leads.bulk import TagCache, bulk_delete_leads, insert_leads
+from leads.dedupe import find_duplicates
+from leads.exports import EXPORT_COLUMNS, EXPORT_FORMATS, export_stream
+from leads.importer import LeadImporter
+from leads.models import Lead, Tag
+from leads.synthetic import TAG_NAMES, LeadGenerator, seed_leads, seed_owners
+from leads.templatetags.leads_extras import lead_rows
+from leads.views import AsyncLeadListView, LeadListView
+
+
+class Rollback(Exception):
+    """Desfaz os dados criados pelo benchmark."""
+
+
+def timed(fn, repeat: int, setup=None) -> float:
+    """Mediana, em milissegundos, de `repeat` execuções de fn() (setup() roda antes de cada uma, fora do tempo)."""
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return median(samples)
+
+
+# colunas do CSV gerado para a importação da suíte (tags por último)
+IMPORT_COLUMNS = ('name', 'email', 'phone', 'company', 'status', 'source', 'value', 'notes', 'tags')
+
+
+def suite_meta(repeat: int, seed: int) -> dict:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True,
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'created_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'repeat': repeat,
+        'seed': seed,
+    }
+
+
+def compare_results(baseline: dict, current: dict, tolerance: float, floor_ms: float = 1.0) -> list:
+    """
+    (volume, medida, antes, depois) das medidas presentes nas duas execuções que pioraram
+    mais que `tolerance`. Diferenças abaixo de `floor_ms` são ruído e não contam.
+    """
+    regressions = []
+    for size, metrics in current['results'].items():
+        before = baseline.get('results', {}).get(size, {})
+        for name, new in metrics.items():
+            old = before.get(name)
+            if old is not None and new > old * (1 + tolerance) and new - old > floor_ms:
+                regressions.append((size, name, old, new))
+    return regressions
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmarks do portal. Os dados de teste são criados numa transação desfeita ao final.'
+
+    def add_arguments(self, parser):
+        sub = parser.add_subparsers(dest='bench', required=True)
+
+        rows = sub.add_parser('rows', help='Renderização das linhas de leads/_lead_table.html, com e sem cache.')
+        rows.add_argument('--page-size', type=int, default=20)
+        rows.add_argument('--repeat', type=int, default=50)
+        rows.add_argument('--changed', type=int, default=1, help='Leads alterados entre as medições "parcial".')
+
+        upsert = sub.add_parser('upsert', help='Upsert NDJSON da API (criação e depois atualização).')
+        upsert.add_argument('--rows', type=int, default=5000)
+        upsert.add_argument('--chunk-size', type=int, default=None)
+
+        export = sub.add_parser('export', help='Bytes e CPU da exportação por formato/compressão.')
+        export.add_argument('--rows', type=int, default=100000)
+        export.add_argument('--notes-length', type=int, default=200, help='Tamanho das notas de cada lead.')
+
+        concurrency = sub.add_parser(
+            'concurrency', help='Exportações CSV simultâneas: view síncrona em N workers (WSGI) x view async num loop (ASGI).',
+        )
+        concurrency.add_argument('--rows', type=int, default=5000, help='Linhas de cada exportação.')
+        concurrency.add_argument('--clients', type=int, default=20, help='Downloads simultâneos.')
+        concurrency.add_argument('--workers', type=int, default=3, help='Workers síncronos simulados (gunicorn --workers).')
+        concurrency.add_argument('--client-delay', type=float, default=200,
+                                 help='ms que o cliente leva para receber cada bloco (rede lenta).')
+
+        db = sub.add_parser('db', help='Leituras e escritas concorrentes em cada perfil de conexão do banco.')
+        db.add_argument('--readers', type=int, default=4)
+        db.add_argument('--writers', type=int, default=2)
+        db.add_argument('--seconds', type=float, default=5)
+        db.add_argument('--rows', type=int, default=5000, help='Leads iniciais (SQLite: num banco temporário).')
+
+        suite = sub.add_parser(
+            'suite', help='Lista (páginas, filtros, busca), exportação e importação CSV em volumes crescentes, em JSON.',
+        )
+        suite.add_argument('--sizes', default='10000,100000,1000000', help='Volumes de leads, separados por vírgula.')
+        suite.add_argument('--repeat', type=int, default=5, help='Execuções por medida da lista (vale a mediana).')
+        suite.add_argument('--seed', type=int, default=42)
+        suite.add_argument('--json', dest='json_path', help='Grava os resultados neste arquivo.')
+        suite.add_argument('--compare', help='JSON de uma execução anterior: falha se alguma medida piorar.')
+        suite.add_argument('--tolerance', type=float, default=0.25, help='Piora relativa tolerada (0.25 = 25%%).')
+
+        dedupe = sub.add_parser('dedupe', help='Detecção de duplicados por blocagem.')
+        dedupe.add_argument('--rows', type=int, default=100000)
+        dedupe.add_argument('--duplicates', type=float, default=0.05, help='Fração de leads com um quase-duplicado.')
+
+    def handle(self, *args, **options):
+        if options['bench'] in ('concurrency', 'db'):
+            # threads/loop usam conexões próprias: os dados precisam estar commitados
+            return getattr(self, f'bench_{options["bench"]}')(**options)
+        try:
+            with transaction.atomic():
+                getattr(self, f'bench_{options["bench"]}')(**options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _seed(self, count: int) -> list[Lead]:
+        owner, _ = get_user_model().objects.get_or_create(username='benchmark')
+        rows = [
+            (Lead(name=f'Lead {i}', email=f'lead{i}@bench.test', company=f'Empresa {i % 7}',
+                  status=Lead.Status.choices[i % len(Lead.Status.choices)][0], value=i * 10, owner=owner),
+             ['bench', f'tag-{i % 3}'])
+            for i in range(count)
+        ]
+        insert_leads(rows, TagCache())
+        return rows
+
+    def _page(self, page_size: int) -> list[Lead]:
+        return list(
+            Lead.objects.select_related('owner').prefetch_related('tags')
+            .filter(email__endswith='@bench.test').order_by('-created_at', '-id')[:page_size]
+        )
+
+    def bench_rows(self, page_size, repeat, changed, **options):
+        self._seed(page_size)
+        leads = self._page(page_size)
+
+        with override_settings(LEADS_ROW_CACHE_TIMEOUT=0):
+            uncached = timed(lambda: lead_rows(leads), repeat)
+
+        lead_rows(leads)
+        warm = timed(lambda: lead_rows(leads), repeat)
+
+        def partial():
+            # simula `changed` leads editados desde o último request
+            for lead in leads[:changed]:
+                lead.save(update_fields=['update_at'])
+            lead_rows(leads)
+
+        partial_ms = timed(partial, repeat)
+
+        self.stdout.write(f'Linhas por página: {page_size} (mediana de {repeat} execuções)')
+        self.stdout.write(f'  sem cache:              {uncached:8.2f} ms')
+        self.stdout.write(f'  cache quente:           {warm:8.2f} ms  ({uncached / warm:.1f}x)')
+        self.stdout.write(f'  {changed} linha(s) alterada(s): {partial_ms:8.2f} ms  (inclui o UPDATE)')
+
+    def bench_upsert(self, rows, chunk_size, **options):
+        owner, _ = get_user_model().objects.get_or_create(username='benchmark')
+
+        def body(status):
+            lines = (
+                json.dumps({'name': f'Lead {i}', 'email': f'lead{i}@bench.test', 'company': f'Empresa {i % 50}',
+                            'status': status, 'value': i, 'tags': ['bench', f'tag-{i % 3}']})
+                for i in range(rows)
+            )
+            return io.BytesIO('\n'.join(lines).encode())
+
+        for label, status in (('criação', 'NEW'), ('atualização', 'QLF')):
+            started = time.perf_counter()
+            result = LeadUpserter(owner=owner, chunk_size=chunk_size).run(body(status))
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'{label:12} {rows} linhas em {elapsed:6.2f} s = {rows / elapsed:8.0f} leads/s '
+                f'(criados {result["created"]}, atualizados {result["updated"]}, erros {result["error_count"]})'
+            )
+
+    def bench_export(self, rows, notes_length, **options):
+        owner, _ = get_user_model().objects.get_or_create(username='benchmark')
+        notes = ('Cliente pediu retorno sobre proposta. ' * (notes_length // 38 + 1))[:notes_length]
+        for start in range(0, rows, 5000):
+            insert_leads([
+                (Lead(name=f'Lead {i}', email=f'lead{i}@bench.test', phone=f'(11) 9{i:08d}',
+                      company=f'Empresa {i % 50}', value=i, notes=notes, owner=owner), ['bench', f'tag-{i % 3}'])
+                for i in range(start, min(start + 5000, rows))
+            ], TagCache())
+        qs = Lead.objects.filter(email__endswith='@bench.test').order_by('-created_at', '-id')
+        without_notes = [c for c in EXPORT_COLUMNS if c != 'notes']
+
+        per_100k = 100000 / rows
+        self.stdout.write(f'{rows} linhas (valores por 100k linhas)')
+        self.stdout.write(f'  {"formato":30} {"MB":>8} {"CPU s":>8}')
+        for name, compress, columns, label in (
+            ('csv', False, EXPORT_COLUMNS, 'csv'),
+            ('csv', True, EXPORT_COLUMNS, 'csv + Content-Encoding gzip'),
+            ('csv.gz', False, EXPORT_COLUMNS, 'csv.gz'),
+            ('csv.gz', False, without_notes, 'csv.gz sem notes'),
+            ('ndjson', False, EXPORT_COLUMNS, 'ndjson'),
+            ('ndjson.gz', False, EXPORT_COLUMNS, 'ndjson.gz'),
+            ('ndjson.gz', False, without_notes, 'ndjson.gz sem notes'),
+        ):
+            cpu = time.process_time()
+            size = sum(len(block) for block in export_stream(EXPORT_FORMATS[name], qs, columns, compress=compress))
+            cpu = time.process_time() - cpu
+            self.stdout.write(f'  {label:30} {size * per_100k / 1024 / 1024:8.1f} {cpu * per_100k:8.2f}')
+
+    def bench_concurrency(self, rows, clients, workers, client_delay, **options):
+        owner, _ = get_user_model().objects.get_or_create(username='benchmark')
+        try:
+            with transaction.atomic():
+                self._seed(rows)
+            self._report_concurrency(rows, clients, workers, client_delay / 1000, owner)
+        finally:
+            bulk_delete_leads(Lead.objects.filter(owner=owner))
+            owner.delete()
+
+    def _report_concurrency(self, rows, clients, workers, delay, owner):
+        params = {'format': 'csv', 'owner': str(owner.pk)}
+
+        def wsgi_client(started):
+            request = RequestFactory().get('/', params)
+            request.user = owner
+            first = None
+            try:
+                for _ in LeadListView.as_view()(request).streaming_content:
+                    first = first or time.perf_counter() - started
+                    time.sleep(delay)
+            finally:
+                connection.close()
+            return first, time.perf_counter() - started
+
+        async def asgi_client(started):
+            async def auser():
+                return owner
+
+            request = AsyncRequestFactory().get('/', params)
+            request.user, request.auser = owner, auser
+            first = None
+            async for _ in (await AsyncLeadListView.as_view()(request)).streaming_content:
+                first = first or time.perf_counter() - started
+                await asyncio.sleep(delay)
+            return first, time.perf_counter() - started
+
+        def run_wsgi():
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                return list(pool.map(lambda _: wsgi_client(started), range(clients)))
+
+        async def run_asgi():
+            started = time.perf_counter()
+            return await asyncio.gather(*(asgi_client(started) for _ in range(clients)))
+
+        self.stdout.write(
+            f'{clients} downloads simultâneos de {rows} linhas, cliente com {delay * 1000:.0f} ms por bloco'
+        )
+        for label, run in ((f'WSGI ({workers} workers)', run_wsgi), ('ASGI (1 loop)', lambda: asyncio.run(run_asgi()))):
+            started = time.perf_counter()
+            results = run()
+            elapsed = time.perf_counter() - started
+            first = [r[0] for r in results]
+            done = [r[1] for r in results]
+            self.stdout.write(
+                f'  {label:18} total {elapsed:6.2f} s = {clients / elapsed:5.1f} downloads/s | '
+                f'1º byte mediana {median(first):6.2f} s, p95 {quantiles(first, n=20)[-1]:6.2f} s | '
+                f'fim mediana {median(done):6.2f} s'
+            )
+
+    def _db_profiles(self) -> list[tuple[str, dict]]:
+        """(nome, settings da conexão) de cada perfil comparado, a partir do perfil em uso."""
+        base = connections.settings['default']
+        if connection.vendor == 'sqlite':
+            return [
+                ('padrão do Django', {**base, 'OPTIONS': {}}),
+                ('WAL + IMMEDIATE', {**base, 'OPTIONS': settings.SQLITE_OPTIONS}),
+            ]
+        options = {k: v for k, v in base['OPTIONS'].items() if k != 'pool'}
+        profiles = [
+            ('conexão por request', {**base, 'CONN_MAX_AGE': 0, 'OPTIONS': options}),
+            ('CONN_MAX_AGE=600', {**base, 'CONN_MAX_AGE': 600, 'OPTIONS': options}),
+        ]
+        if 'pool' in base['OPTIONS']:
+            profiles.append(('pool psycopg', {**base, 'CONN_MAX_AGE': 0}))
+        return profiles
+
+    def bench_db(self, readers, writers, seconds, rows, **options):
+        self.stdout.write(f'{readers} leitores + {writers} escritores por {seconds:.0f} s ({connection.vendor})')
+        for number, (label, db_settings) in enumerate(self._db_profiles()):
+            alias = f'bench_{number}'
+            tmp = None
+            if connection.vendor == 'sqlite':
+                # WAL fica gravado no arquivo: cada perfil usa um banco novo
+                fd, tmp = tempfile.mkstemp(suffix='.sqlite3')
+                os.close(fd)
+                db_settings = {**db_settings, 'NAME': tmp}
+            connections.settings[alias] = db_settings
+            try:
+                self._db_workload(alias, label, readers, writers, seconds, rows, create_tables=tmp is not None)
+            finally:
+                connections[alias].close()
+                if 'pool' in db_settings['OPTIONS']:
+                    connections[alias].close_pool()
+                del connections.settings[alias]
+                if tmp:
+                    for suffix in ('', '-wal', '-shm'):
+                        if os.path.exists(tmp + suffix):
+                            os.remove(tmp + suffix)
+
+    def _db_workload(self, alias, label, readers, writers, seconds, rows, create_tables):
+        leads = Lead.objects.using(alias)
+        if create_tables:
+            call_command('migrate', database=alias, verbosity=0)
+        # bulk_create/update não disparam signals: nada vai para o rollup do banco principal
+        statuses = [code for code, _ in Lead.Status.choices]
+        leads.bulk_create(
+            [Lead(name=f'Lead {i}', email=f'lead{i}@dbbench.test', status=statuses[i % len(statuses)], value=i)
+             for i in range(rows)],
+            batch_size=1000,
+        )
+        ids = list(leads.filter(email__endswith='@dbbench.test').values_list('pk', flat=True))
+
+        stop = time.perf_counter() + seconds
+        counts = {'read': 0, 'write': 0, 'error': 0}
+        lock = threading.Lock()
+
+        def read(i):
+            page = leads.filter(status=statuses[i % len(statuses)]).order_by('-created_at', '-id')
+            list(page[:20])
+            page.count()
+
+        def write(i):
+            with transaction.atomic(using=alias):
+                leads.bulk_create([Lead(name=f'Novo {i}-{j}', email=f'n{threading.get_ident()}.{i}.{j}@dbbench.test')
+                                   for j in range(5)])
+                leads.filter(pk=ids[i % len(ids)]).update(value=F('value') + 1)
+
+        def worker(kind, op):
+            done = errors = 0
+            while time.perf_counter() < stop:
+                try:
+                    op(done)
+                    done += 1
+                except OperationalError:  # "database is locked"
+                    errors += 1
+                # fim do "request": devolve/fecha a conexão conforme o perfil
+                connections[alias].close_if_unusable_or_obsolete()
+            connections[alias].close()
+            with lock:
+                counts[kind] += done
+                counts['error'] += errors
+
+        threads = [threading.Thread(target=worker, args=('read', read)) for _ in range(readers)]
+        threads += [threading.Thread(target=worker, args=('write', write)) for _ in range(writers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if not create_tables:
+            leads.filter(email__endswith='@dbbench.test')._raw_delete(alias)
+        self.stdout.write(
+            f'  {label:22} leituras {counts["read"] / seconds:8.0f}/s  escritas {counts["write"] / seconds:7.0f}/s  '
+            f'erros {counts["error"]}'
+        )
+
+    def bench_dedupe(self, rows, duplicates, **options):
+        every = max(int(1 / duplicates), 1) if duplicates else 0
+        batch = []
+        for i in range(rows):
+            batch.append((Lead(name=f'Lead {i} Silva', email=f'lead{i}@empresa{i % 5000}.test',
+                               phone=f'(11) 9{i:08d}', company=f'Empresa {i % 5000} Ltda'), []))
+            if every and i % every == 0:
+                # mesma pessoa com outra grafia: caixa, espaços e formatação do telefone
+                batch.append((Lead(name=f'lead  {i} SILVA', email=f'LEAD{i}@empresa{i % 5000}.test ',
+                                   phone=f'+55 11 9{i:08d}', company=f'EMPRESA {i % 5000} LTDA.'), []))
+            if len(batch) >= 5000:
+                insert_leads(batch, TagCache())
+                batch = []
+        insert_leads(batch, TagCache())
+
+        started = time.perf_counter()
+        result = find_duplicates()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'{result.leads} leads em {elapsed:6.2f} s = {result.leads / elapsed:8.0f} leads/s: '
+            f'{result.comparisons} comparações (todos os pares seriam {result.leads * (result.leads - 1) // 2}), '
+            f'{len(result.pairs)} pares, {result.skipped_blocks} bloco(s) ignorado(s)'
+        )
+
+    def bench_suite(self, sizes, repeat, seed, json_path, compare, tolerance, **options):
+        owner, _ = get_user_model().objects.get_or_create(username='benchmark')
+        generator = LeadGenerator(owner_ids=seed_owners(20), seed=seed)
+        report = {'meta': suite_meta(repeat, seed), 'results': {}}
+        for size in sorted(int(n) for n in sizes.split(',')):
+            missing = size - Lead.objects.count()
+            if missing > 0:
+                seeded = seed_leads(missing, generator=generator)
+                self.stdout.write(f'>> {missing} leads gerados em {seeded.elapsed:.1f} s')
+            self.stdout.write(f'{size} leads')
+            report['results'][str(size)] = self._suite_size(size, repeat, owner)
+        cache.clear()
+
+        if json_path:
+            with open(json_path, 'w', encoding='utf-8') as fh:
+                json.dump(report, fh, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+        if compare:
+            with open(compare, encoding='utf-8') as fh:
+                regressions = compare_results(json.load(fh), report, tolerance)
+            for size, name, old, new in regressions:
+                self.stdout.write(f'  PIORA {size:>8} {name:40} {old:9.1f} -> {new:9.1f} ms')
+            if regressions:
+                raise CommandError(f'{len(regressions)} medida(s) acima da tolerância de {tolerance:.0%}.')
+            self.stdout.write('>> Nenhuma piora acima da tolerância.')
+
+    def _suite_size(self, size, repeat, owner) -> dict:
+        """Tempos (ms) de um volume. Cada execução começa com o cache vazio (COUNT, validadores, linhas)."""
+        results = {}
+
+        def measure(name, params, times=repeat):
+            def run():
+                response = LeadListView.as_view()(request(params))
+                if response.streaming:
+                    for _ in response.streaming_content:
+                        pass
+                else:
+                    response.render()
+
+            results[name] = round(timed(run, times, setup=cache.clear), 2)
+            self.stdout.write(f'  {name:40} {results[name]:10.1f} ms')
+
+        def request(params):
+            req = RequestFactory().get('/', params)
+            req.user = owner
+            return req
+
+        pages = max(size // LeadListView.paginate_by, 1)
+        for page in (1, 10, 100, 1000, 10000):
+            if page <= pages:
+                measure(f'list/page={page}', {'page': page})
+
+        values = {
+            'q': 'silva', 'status': Lead.Status.NEW, 'source': Lead.Source.WEBSITE,
+            'tag': str(Tag.objects.get(name=TAG_NAMES[0]).pk),
+            'owner': str(get_user_model().objects.get(username='seed-owner-0').pk),
+        }
+        for n in range(1, len(values) + 1):
+            for combo in combinations(values, n):
+                measure(f'filter/{"+".join(combo)}', {k: values[k] for k in combo})
+        for q in ('silva', 'ana silva', 'gmail', 'acme ltda', 'zzzz'):
+            measure(f'search/{q}', {'q': q})
+
+        started = time.perf_counter()
+        measure('export/csv', {'format': 'csv'}, times=1)
+        self.stdout.write(f'  {"":40} {size / (time.perf_counter() - started):10.0f} linhas/s')
+
+        generator = LeadGenerator(seed=size)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(IMPORT_COLUMNS)
+        for lead, tags in generator.leads(size, start=10 ** 9):
+            writer.writerow([getattr(lead, column) for column in IMPORT_COLUMNS[:-1]] + [', '.join(tags)])
+        data = io.BytesIO(buffer.getvalue().encode())
+        del buffer
+        result = LeadImporter(owner=owner).run(data)
+        results['import/csv'] = round(result.elapsed * 1000, 2)
+        self.stdout.write(f'  {"import/csv":40} {results["import/csv"]:10.1f} ms  ({result.summary()})')
+        return results
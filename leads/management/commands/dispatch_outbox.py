@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+
+from leads import metrics
+from leads.outbox import dispatch_batch
+
+
+class Command(BaseCommand):
+    """
+    Drena a EmailOutbox em lotes, reaproveitando uma conexão SMTP por lote.
+
+    Para testar sem um provedor real, suba um servidor SMTP de debug local:
+
+        python -m aiosmtpd -n -l localhost:1025
+
+    e rode o dispatcher apontando para ele:
+
+        EMAIL_HOST=localhost EMAIL_PORT=1025 EMAIL_USE_TLS=False python manage.py dispatch_outbox --once
+    """
+
+    help = 'Envia os e-mails pendentes da outbox (retry com backoff e dead letter).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drena a fila atual e sai.')
+        parser.add_argument('--sleep', type=float, default=2.0, help='Intervalo de polling (segundos).')
+        parser.add_argument('--batch-size', type=int, default=None, help='Mensagens por lote (padrão: EMAIL_OUTBOX_BATCH_SIZE).')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                # descarta conexões vencidas (CONN_MAX_AGE) ou quebradas antes de cada lote
+                close_old_connections()
+                try:
+                    result = dispatch_batch(options['batch_size'])
+                except DatabaseError as exc:
+                    if options['once']:
+                        raise
+                    # banco indisponível: as mensagens reservadas voltam à fila quando a reserva expirar
+                    self.stderr.write(f'>> Erro de banco no dispatcher, nova tentativa em {options["sleep"]}s: {exc}')
+                    close_old_connections()
+                    time.sleep(options['sleep'])
+                    continue
+                if result.total:
+                    metrics.flush()
+                    self.stdout.write(
+                        f'>> Outbox: {result.sent} enviados, {result.retried} para retry, {result.dead} descartados'
+                    )
+                    continue
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            self.stdout.write('>> Dispatcher interrompido.')
@@ -0,0 +1,31 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand
+
+from leads.dedupe import find_duplicates
+
+
+class Command(BaseCommand):
+    help = (
+        'Procura leads duplicados (blocagem por email, domínio, telefone e empresa normalizados) '
+        'e escreve os pares em CSV: lead_a,lead_b,score,reasons.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, default=0.6, help='Score mínimo de um par (0 a 1).')
+        parser.add_argument('--max-block', type=int, default=200,
+                            help='Blocos maiores que isso são ignorados (chave pouco seletiva).')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = find_duplicates(threshold=options['threshold'], max_block=options['max_block'])
+        writer = csv.writer(self.stdout)
+        writer.writerow(['lead_a', 'lead_b', 'score', 'reasons'])
+        for pair in result.pairs:
+            writer.writerow([pair.lead_a, pair.lead_b, pair.score, '+'.join(pair.reasons)])
+        self.stderr.write(
+            f'>> {result.leads} leads, {result.blocks} blocos, {result.comparisons} comparações, '
+            f'{len(result.pairs)} pares, {result.skipped_blocks} bloco(s) grande(s) ignorado(s) '
+            f'em {time.perf_counter() - started:.1f} s'
+        )
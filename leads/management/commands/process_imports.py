@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+
+from leads import metrics
+from leads.importer import claim_job, run_job
+
+
+class Command(BaseCommand):
+    help = 'Worker da fila de importações CSV: processa ImportJobs em blocos commitados.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Processa a fila atual e sai.')
+        parser.add_argument('--sleep', type=float, default=2.0, help='Intervalo de polling (segundos).')
+        parser.add_argument('--chunk-size', type=int, default=None, help='Linhas por bloco (padrão: IMPORT_CHUNK_SIZE).')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                # descarta conexões vencidas (CONN_MAX_AGE) ou quebradas antes de cada rodada
+                close_old_connections()
+                try:
+                    job = self._process(options)
+                except DatabaseError as exc:
+                    if options['once']:
+                        raise
+                    # banco reiniciando/indisponível: o job fica RUNNING e é retomado pelo heartbeat
+                    self.stderr.write(f'>> Erro de banco no worker, nova tentativa em {options["sleep"]}s: {exc}')
+                    close_old_connections()
+                    time.sleep(options['sleep'])
+                    continue
+                if job is None:
+                    if options['once']:
+                        return
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            self.stdout.write('>> Worker interrompido.')
+
+    def _process(self, options):
+        """Processa o próximo job da fila; None quando a fila está vazia."""
+        job = claim_job()
+        if job is None:
+            return None
+        self.stdout.write(f'>> Importação #{job.pk}: retomando da linha {job.row_cursor}')
+        job = run_job(job, chunk_size=options['chunk_size'])
+        metrics.flush()
+        self.stdout.write(
+            f'>> Importação #{job.pk}: {job.get_status_display()} '
+            f'({job.created_count} criados, {job.error_count} erros)'
+        )
+        return job
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from leads.rollup import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula PipelineRollup a partir da tabela de leads e lista as divergências '
+        'do rollup incremental. Rode com pouco tráfego de escrita: a troca é numa transação.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Só verifica: não altera nada e falha se houver divergências.')
+
+    def handle(self, *args, **options):
+        differences = rebuild(dry_run=options['check'])
+        for (day, status, source, owner_id), expected, current in differences:
+            self.stdout.write(
+                f'{day} {status}/{source} owner={owner_id or "-"}: '
+                f'esperado {expected or (0, 0)}, encontrado {current or (0, 0)}'
+            )
+        if not differences:
+            self.stdout.write('>> Rollup consistente com a tabela de leads.')
+        elif options['check']:
+            raise CommandError(f'{len(differences)} divergência(s) no rollup.')
+        else:
+            self.stdout.write(f'>> Rollup recalculado ({len(differences)} divergência(s) corrigida(s)).')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from leads.synthetic import seed_leads
+
+
+class Command(BaseCommand):
+    help = (
+        'Gera N leads sintéticos (status, origem, owners, tags e notas com distribuições realistas) '
+        'com inserts em lote. A mesma --seed gera os mesmos dados.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int, help='Quantidade de leads.')
+        parser.add_argument('--owners', type=int, default=20, help='Usuários owner (seed-owner-N), criados se faltarem.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--days', type=int, default=365, help='created_at espalhado pelos últimos N dias.')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Leads por transação.')
+
+    def handle(self, *args, **options):
+        if options['count'] < 1:
+            raise CommandError('Informe uma quantidade positiva de leads.')
+        result = seed_leads(
+            options['count'], owners=options['owners'], seed=options['seed'],
+            days=options['days'], chunk_size=options['chunk_size'],
+        )
+        self.stdout.write(
+            f'>> {result.created} leads em {result.elapsed:.1f} s ({result.rows_per_second:.0f} leads/s).'
+        )
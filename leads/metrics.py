@@ -0,0 +1,341 @@
+"""
+Métricas no formato de exposição de texto do Prometheus (GET /metrics), sem dependências.
+
+Cada processo (workers do gunicorn, process_imports, dispatch_outbox) acumula
+contadores e histogramas em memória e grava um snapshot em METRICS_DIR/<pid>-<id>.json
+a cada METRICS_FLUSH_INTERVAL segundos (e na saída). O /metrics soma os snapshots do
+diretório com o estado atual do próprio processo, então qualquer worker responde pelo
+serviço inteiro; os outros processos aparecem com até METRICS_FLUSH_INTERVAL de atraso.
+
+Snapshots de processos encerrados continuam no diretório: um contador não volta
+atrás quando o gunicorn recicla um worker. O entrypoint limpa o diretório ao subir.
+Sem METRICS_DIR (runserver, testes) vale só o processo atual.
+
+Razões derivadas (acerto de cache, linhas importadas por segundo) são calculadas
+na exposição a partir dos contadores somados.
+"""
+import atexit
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed, PermissionDenied
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# nome -> (tipo, descrição, labels, buckets)
+METRICS = {
+    'http_request_duration_seconds': (
+        HISTOGRAM, 'Latência até a resposta (em streaming, até o primeiro byte) por nome de URL.',
+        ('view', 'method', 'status'), LATENCY_BUCKETS,
+    ),
+    'db_queries_total': (COUNTER, 'Queries executadas.', ('alias', 'kind'), None),
+    'db_query_duration_seconds_total': (COUNTER, 'Tempo total gasto em queries.', ('alias',), None),
+    'leads_import_rows_total': (COUNTER, 'Linhas processadas por importações.', ('source',), None),
+    'leads_import_duration_seconds_total': (COUNTER, 'Tempo gasto gravando blocos de importação.', ('source',), None),
+    'leads_email_messages_total': (COUNTER, 'E-mails por canal e resultado do envio.', ('channel', 'result'), None),
+    'cache_requests_total': (COUNTER, 'Leituras de cache por uso e resultado (hit/miss).', ('cache', 'result'), None),
+}
+
+# gauges calculados na exposição: nome -> (descrição, numerador, denominador, label comum)
+RATIOS = {
+    'cache_hit_ratio': ('Fração de leituras de cache com acerto.', None, 'cache_requests_total', 'cache'),
+    'leads_import_rows_per_second': (
+        'Linhas por segundo das importações (média desde o início).',
+        'leads_import_rows_total', 'leads_import_duration_seconds_total', 'source',
+    ),
+}
+
+_SQL_KINDS = ('select', 'insert', 'update', 'delete')
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(str(labels[label]) for label in METRICS[name][2])
+
+
+class Registry:
+    """Valores de um processo. `directory` ativa o snapshot em arquivo."""
+
+    def __init__(self, directory: Optional[str] = None, flush_interval: Optional[float] = None):
+        self.directory = Path(directory) if directory else None
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.pid = os.getpid()
+        self.name = f'{self.pid}-{uuid.uuid4().hex[:8]}'
+        self.counters: dict[tuple, float] = {}
+        # chave -> [contagem por bucket (não cumulativa, + Inf no fim), soma, total]
+        self.histograms: dict[tuple, list] = {}
+        self._flushed = time.monotonic()
+
+    def _check_fork(self) -> None:
+        # gunicorn faz fork depois de importar o app: cada worker começa do zero, com outro arquivo
+        if os.getpid() != self.pid:
+            self._reset()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self._check_fork()
+            self.counters[key] = self.counters.get(key, 0) + value
+        self._maybe_flush()
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = _key(name, labels)
+        buckets = METRICS[name][3]
+        with self._lock:
+            self._check_fork()
+            entry = self.histograms.get(key)
+            if entry is None:
+                entry = self.histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            index = next((i for i, bound in enumerate(buckets) if value <= bound), len(buckets))
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+        self._maybe_flush()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._check_fork()
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [
+                    [name, list(labels), list(buckets), total, count]
+                    for (name, labels), (buckets, total, count) in self.histograms.items()
+                ],
+            }
+
+    def _path(self) -> Path:
+        return self.directory / f'{self.name}.json'
+
+    def _maybe_flush(self) -> None:
+        interval = settings.METRICS_FLUSH_INTERVAL if self.flush_interval is None else self.flush_interval
+        if self.directory and time.monotonic() - self._flushed >= interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.directory:
+            return
+        self._flushed = time.monotonic()
+        data = self.snapshot()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path()
+        tmp = path.with_name(f'{self.name}.{threading.get_ident()}.tmp')
+        tmp.write_text(json.dumps(data))
+        # troca atômica: quem lê nunca vê um arquivo pela metade
+        os.replace(tmp, path)
+
+    def collect(self) -> dict:
+        """Snapshots do diretório (menos o deste processo) + o estado atual, somados."""
+        snapshots = [self.snapshot()]
+        if self.directory and self.directory.is_dir():
+            own = self._path().name
+            for path in self.directory.glob('*.json'):
+                if path.name == own:
+                    continue
+                try:
+                    snapshots.append(json.loads(path.read_text()))
+                except (OSError, ValueError):
+                    continue  # processo gravando agora ou arquivo removido
+        return merge(snapshots)
+
+
+def merge(snapshots: list[dict]) -> dict:
+    counters: dict[tuple, float] = {}
+    histograms: dict[tuple, list] = {}
+    for data in snapshots:
+        for name, labels, value in data.get('counters', ()):
+            if name in METRICS:
+                key = (name, tuple(labels))
+                counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, total, count in data.get('histograms', ()):
+            if name not in METRICS or len(buckets) != len(METRICS[name][3]) + 1:
+                continue  # snapshot de uma versão com outros buckets
+            key = (name, tuple(labels))
+            entry = histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+            entry[0] = [a + b for a, b in zip(entry[0], buckets)]
+            entry[1] += total
+            entry[2] += count
+    return {'counters': counters, 'histograms': histograms}
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render(state: dict) -> str:
+    """Formato de exposição de texto (version 0.0.4)."""
+    lines = []
+    for name, (kind, help_text, label_names, buckets) in METRICS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        if kind == COUNTER:
+            for (metric, values), value in sorted(state['counters'].items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(label_names, values)} {_number(value)}')
+            continue
+        for (metric, values), (counts, total, count) in sorted(state['histograms'].items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket in zip((*buckets, '+Inf'), counts):
+                cumulative += bucket
+                le = f'le="{bound}"'
+                lines.append(f'{name}_bucket{_labels(label_names, values, le)} {cumulative}')
+            lines.append(f'{name}_sum{_labels(label_names, values)} {_number(total)}')
+            lines.append(f'{name}_count{_labels(label_names, values)} {count}')
+
+    for name, (help_text, numerator, denominator, label) in RATIOS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+        for group, (part, whole) in sorted(_ratio_parts(state['counters'], numerator, denominator, label).items()):
+            if whole:
+                lines.append(f'{name}{{{label}="{_escape(group)}"}} {round(part / whole, 4)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _ratio_parts(counters: dict, numerator: Optional[str], denominator: str, label: str) -> dict:
+    """{valor do label: (numerador, denominador)}; sem numerador, conta os hits do denominador."""
+    position = METRICS[denominator][2].index(label)
+    parts: dict[str, list] = {}
+    for (metric, values), value in counters.items():
+        group = values[position]
+        if metric == denominator:
+            entry = parts.setdefault(group, [0, 0])
+            entry[1] += value
+            if numerator is None and values[-1] == 'hit':
+                entry[0] += value
+        elif metric == numerator:
+            parts.setdefault(group, [0, 0])[0] += value
+    return parts
+
+
+registry = Registry(settings.METRICS_DIR or None)
+atexit.register(registry.flush)
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    if settings.METRICS_ENABLED:
+        registry.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels) -> None:
+    if settings.METRICS_ENABLED:
+        registry.observe(name, value, **labels)
+
+
+def cache_lookup(cache: str, hits: int, misses: int = 0) -> None:
+    """Conta `hits`/`misses` leituras de cache (aceita bool para uma leitura só)."""
+    if hits:
+        inc('cache_requests_total', int(hits), cache=cache, result='hit')
+    if misses:
+        inc('cache_requests_total', int(misses), cache=cache, result='miss')
+
+
+def flush() -> None:
+    """Grava o snapshot agora (workers de fila, antes de ficarem ociosos)."""
+    if settings.METRICS_ENABLED:
+        registry.flush()
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        alias = context['connection'].alias
+        kind = sql.lstrip()[:6].lower()
+        inc('db_queries_total', alias=alias, kind=kind if kind in _SQL_KINDS else 'other')
+        inc('db_query_duration_seconds_total', time.perf_counter() - started, alias=alias)
+
+
+def _connection_created(sender, connection, **kwargs) -> None:
+    if _execute_wrapper not in connection.execute_wrappers:
+        # no início da lista: execute_wrapper() de terceiros desempilha com pop()
+        connection.execute_wrappers.insert(0, _execute_wrapper)
+
+
+def install() -> None:
+    """Conta as queries de toda conexão aberta a partir daqui (chamado no ready() do app)."""
+    connection_created.connect(_connection_created, dispatch_uid='leads.metrics')
+
+
+class MetricsMiddleware:
+    """
+    Latência por nome de URL (`request.metrics_view` sobrepõe, ex.: exportação).
+    Em respostas em streaming mede até a resposta sair, não o download inteiro.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self._observe(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._observe(request, response, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def _observe(request, response, elapsed: float) -> None:
+        view = getattr(request, 'metrics_view', None)
+        if view is None:
+            match = request.resolver_match
+            view = match.view_name if match else '<unmatched>'
+        observe(
+            'http_request_duration_seconds', elapsed,
+            view=view, method=request.method, status=response.status_code,
+        )
+
+
+def metrics_view(request):
+    """
+    Exposição para o Prometheus. Fora do DEBUG só existe com METRICS_TOKEN definido:
+    nomes de URL, volume de tráfego e tempos de banco não ficam abertos a qualquer um.
+    """
+    token = settings.METRICS_TOKEN
+    if not settings.METRICS_ENABLED or not (token or settings.DEBUG):
+        return HttpResponse(status=404)
+    # em bytes: compare_digest com str não ASCII levanta TypeError (o WSGI decodifica headers em latin-1)
+    header = request.headers.get('Authorization', '')
+    if token and not hmac.compare_digest(header.encode(), f'Bearer {token}'.encode()):
+        raise PermissionDenied
+    return HttpResponse(render(registry.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
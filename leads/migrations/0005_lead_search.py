@@ -0,0 +1,95 @@
+# Índices de busca textual mantidos no banco (ver leads/search.py).
+# PostgreSQL: coluna tsvector + trigger + GIN. SQLite: tabela FTS5 + triggers.
+
+from django.db import migrations
+
+PG_FORWARD = [
+    "ALTER TABLE leads_lead ADD COLUMN search_vector tsvector",
+    r"""
+    CREATE FUNCTION leads_lead_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+      NEW.search_vector :=
+        setweight(to_tsvector('simple', regexp_replace(coalesce(NEW.name, ''), '\W+', ' ', 'g')), 'A') ||
+        setweight(to_tsvector('simple', regexp_replace(coalesce(NEW.company, ''), '\W+', ' ', 'g')), 'B') ||
+        setweight(to_tsvector('simple', regexp_replace(
+          coalesce(NEW.email, '') || ' ' || coalesce(NEW.phone, ''), '\W+', ' ', 'g')), 'B') ||
+        setweight(to_tsvector('simple', regexp_replace(coalesce(NEW.notes, ''), '\W+', ' ', 'g')), 'D');
+      RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER leads_lead_search_vector_trg
+    BEFORE INSERT OR UPDATE OF name, email, company, phone, notes ON leads_lead
+    FOR EACH ROW EXECUTE FUNCTION leads_lead_search_vector_update()
+    """,
+    # backfill: o UPDATE dispara a trigger para as linhas existentes
+    "UPDATE leads_lead SET name = name",
+    "CREATE INDEX leads_lead_search_vector_gin ON leads_lead USING GIN (search_vector)",
+]
+
+PG_BACKWARD = [
+    "DROP INDEX IF EXISTS leads_lead_search_vector_gin",
+    "DROP TRIGGER IF EXISTS leads_lead_search_vector_trg ON leads_lead",
+    "DROP FUNCTION IF EXISTS leads_lead_search_vector_update()",
+    "ALTER TABLE leads_lead DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE leads_lead_fts USING fts5(
+      name, company, email, phone, notes,
+      content='leads_lead', content_rowid='id',
+      tokenize='unicode61 remove_diacritics 0'
+    )
+    """,
+    """
+    CREATE TRIGGER leads_lead_fts_ai AFTER INSERT ON leads_lead BEGIN
+      INSERT INTO leads_lead_fts(rowid, name, company, email, phone, notes)
+      VALUES (new.id, new.name, new.company, new.email, new.phone, new.notes);
+    END
+    """,
+    """
+    CREATE TRIGGER leads_lead_fts_ad AFTER DELETE ON leads_lead BEGIN
+      INSERT INTO leads_lead_fts(leads_lead_fts, rowid, name, company, email, phone, notes)
+      VALUES ('delete', old.id, old.name, old.company, old.email, old.phone, old.notes);
+    END
+    """,
+    """
+    CREATE TRIGGER leads_lead_fts_au AFTER UPDATE OF name, company, email, phone, notes ON leads_lead BEGIN
+      INSERT INTO leads_lead_fts(leads_lead_fts, rowid, name, company, email, phone, notes)
+      VALUES ('delete', old.id, old.name, old.company, old.email, old.phone, old.notes);
+      INSERT INTO leads_lead_fts(rowid, name, company, email, phone, notes)
+      VALUES (new.id, new.name, new.company, new.email, new.phone, new.notes);
+    END
+    """,
+    "INSERT INTO leads_lead_fts(leads_lead_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS leads_lead_fts_au",
+    "DROP TRIGGER IF EXISTS leads_lead_fts_ad",
+    "DROP TRIGGER IF EXISTS leads_lead_fts_ai",
+    "DROP TABLE IF EXISTS leads_lead_fts",
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for sql in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql, params=None)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0004_importjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'postgresql': PG_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            _run({'postgresql': PG_BACKWARD, 'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def populate_rollup(apps, schema_editor):
+    Lead = apps.get_model('leads', 'Lead')
+    PipelineRollup = apps.get_model('leads', 'PipelineRollup')
+    rows = (
+        Lead.objects.annotate(day=TruncDate('created_at'))
+        .values_list('day', 'status', 'source', 'owner_id')
+        .annotate(lead_count=Count('id'), total_value=Sum('value'))
+        .order_by()
+    )
+    PipelineRollup.objects.bulk_create([
+        PipelineRollup(day=day, status=status, source=source, owner_id=owner_id,
+                       lead_count=count, total_value=total or 0)
+        for day, status, source, owner_id, count, total in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0007_emailoutbox'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('NEW', 'Novo'), ('QLF', 'Qualidade'), ('WON', 'Ganho'), ('LST', 'Perdido'), ('CLD', 'Frio')], max_length=3)),
+                ('source', models.CharField(choices=[('WEB', 'Website'), ('ADS', 'Anúncio'), ('REF', 'Indicação'), ('EVT', 'Evento'), ('OTH', 'Outro')], max_length=3)),
+                ('lead_count', models.IntegerField(default=0)),
+                ('total_value', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-day'],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('owner__isnull', False)), fields=('day', 'status', 'source', 'owner'), name='rollup_owner_uniq'), models.UniqueConstraint(condition=models.Q(('owner__isnull', True)), fields=('day', 'status', 'source'), name='rollup_no_owner_uniq')],
+            },
+        ),
+        migrations.RunPython(populate_rollup, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0008_pipelinerollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='mode',
+            field=models.CharField(choices=[('CRT', 'Só criar'), ('UPS', 'Criar ou atualizar (email + empresa)')], default='CRT', max_length=3, verbose_name='Modo'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='updated_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:28
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+def normalize_keys(apps, schema_editor):
+    """Empresa sem espaços repetidos nos leads existentes; para se a nova chave tiver colisões."""
+    Lead = apps.get_model('leads', 'Lead')
+    seen, collisions, changed = {}, [], []
+    for pk, email, company in Lead.objects.values_list('id', 'email', 'company').iterator():
+        normalized = ' '.join(company.split())
+        if normalized != company:
+            changed.append((pk, normalized))
+        if not email:
+            continue
+        key = (email.lower(), normalized)
+        if key in seen:
+            collisions.append((seen[key], pk))
+        else:
+            seen[key] = pk
+    if collisions:
+        pairs = ', '.join(f'{a}/{b}' for a, b in collisions[:20])
+        raise RuntimeError(
+            f'{len(collisions)} lead(s) repetidos pela chave (email sem caixa, empresa): {pairs}. '
+            'Junte ou remova os duplicados (manage.py find_duplicates ajuda) e rode o migrate de novo.'
+        )
+    for pk, company in changed:
+        Lead.objects.filter(pk=pk).update(company=company)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0009_importjob_mode'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='lead',
+            name='unique_lead_email_per_company',
+        ),
+        migrations.RunPython(normalize_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='lead',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), models.F('company'), condition=models.Q(('email', ''), _negated=True), name='unique_lead_email_ci_per_company', violation_error_message='Já existe um lead com este email nesta empresa.'),
+        ),
+    ]
@@ -1,8 +1,14 @@
 from django.conf import settings
 from django.db import models
+from django.db.models.functions import Lower
 from django.utils import timezone
 
 
+def normalize_company(company: str) -> str:
+    """Empresa sem espaços repetidos: parte da chave (email, empresa) dos leads."""
+    return ' '.join((company or '').split())
+
+
 class Tag(models.Model):
     name = models.CharField(max_length=50, unique=True)
 
@@ -49,10 +55,149 @@ class Lead(models.Model):
     class Meta:
         ordering = ['-created_at']
         constraints = [
+            # email sem caixa + empresa normalizada (ver save): "Alice@Acme.com" e "alice@acme.com"
+            # são o mesmo lead. Também é o alvo do ON CONFLICT do upsert por COPY.
             models.UniqueConstraint(
-                fields=['email', 'company'], name= 'unique_lead_email_per_company', condition=~models.Q(email='')
+                Lower('email'), 'company', name='unique_lead_email_ci_per_company', condition=~models.Q(email=''),
+                violation_error_message='Já existe um lead com este email nesta empresa.',
             )
         ]
+        # Um índice por filtro da lista, sempre terminando na ordenação (-created_at);
+        # owner é parcial porque leads sem owner nunca são filtrados por owner.
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='lead_created_idx'),
+            models.Index(fields=['status', '-created_at'], name='lead_status_created_idx'),
+            models.Index(fields=['source', '-created_at'], name='lead_source_created_idx'),
+            models.Index(
+                fields=['owner', '-created_at'], name='lead_owner_created_idx',
+                condition=models.Q(owner__isnull=False),
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.name} ({self.company})'
+
+    def save(self, *args, **kwargs):
+        # bulk_create não passa por aqui: importação e upsert normalizam antes de gravar
+        self.company = normalize_company(self.company)
+        super().save(*args, **kwargs)
+
+class ImportJob(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'PEN', 'Na fila'
+        RUNNING = 'RUN', 'Processando'
+        DONE = 'DON', 'Concluída'
+        FAILED = 'ERR', 'Falhou'
+
+    class Mode(models.TextChoices):
+        CREATE = 'CRT', 'Só criar'
+        UPSERT = 'UPS', 'Criar ou atualizar (email + empresa)'
+
+    file = models.FileField('Arquivo', upload_to='imports/%Y/%m/')
+    mode = models.CharField('Modo', max_length=3, choices=Mode.choices, default=Mode.CREATE)
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='import_jobs'
+    )
+    status = models.CharField(max_length=3, choices=Status.choices, default=Status.PENDING)
+
+    # cursor = linhas de dados já processadas e commitadas (retomada após falha do worker)
+    row_cursor = models.PositiveIntegerField(default=0)
+    total_rows = models.PositiveIntegerField(null=True, blank=True)
+    created_count = models.PositiveIntegerField(default=0)
+    updated_count = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self) -> str:
+        return f'Importação #{self.pk} ({self.get_status_display()})'
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (self.Status.DONE, self.Status.FAILED)
+
+    @property
+    def progress(self) -> int:
+        if self.status == self.Status.DONE:
+            return 100
+        if not self.total_rows:
+            return 0
+        return min(100, int(self.row_cursor * 100 / self.total_rows))
+
+
+class PipelineRollup(models.Model):
+    """
+    Totais do pipeline (quantidade e soma de value) por dia de criação, status, fonte e owner.
+    Mantida incrementalmente (ver leads.rollup); manage.py rebuild_rollup recalcula do zero.
+    """
+
+    day = models.DateField()
+    status = models.CharField(max_length=3, choices=Lead.Status.choices)
+    source = models.CharField(max_length=3, choices=Lead.Source.choices)
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='+'
+    )
+    lead_count = models.IntegerField(default=0)
+    total_value = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['-day']
+        constraints = [
+            # NULL não conflita em UNIQUE: leads sem owner têm a própria constraint
+            models.UniqueConstraint(
+                fields=['day', 'status', 'source', 'owner'], name='rollup_owner_uniq',
+                condition=models.Q(owner__isnull=False),
+            ),
+            models.UniqueConstraint(
+                fields=['day', 'status', 'source'], name='rollup_no_owner_uniq',
+                condition=models.Q(owner__isnull=True),
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.day} {self.status}/{self.source}: {self.lead_count}'
+
+
+class EmailOutbox(models.Model):
+    """
+    E-mails a enviar, gravados na mesma transação da operação que os gerou.
+    O envio fica com o dispatcher (manage.py dispatch_outbox).
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'PEN', 'Pendente'
+        SENT = 'SNT', 'Enviado'
+        DEAD = 'DLQ', 'Descartado'
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254, blank=True)
+    to = models.JSONField(default=list)
+
+    status = models.CharField(max_length=3, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at'], name='outbox_pending_idx',
+                condition=models.Q(status='PEN'),
+            ),
+        ]
 
     def __str__(self) -> str:
-        return f'{self.name} ({self.company})'
\ No newline at end of file
+        return f'{self.subject} -> {", ".join(self.to)} ({self.get_status_display()})'
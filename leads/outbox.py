@@ -0,0 +1,142 @@
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from . import metrics
+from .mailers import _DROPPED
+from .models import EmailOutbox
+
+
+def enqueue_mail(
+    subject: str,
+    body: str,
+    to: Iterable[str],
+    from_email: Optional[str] = None,
+    html_body: str = '',
+) -> EmailOutbox:
+    """
+    Grava o e-mail na outbox. Chamado dentro da transação da operação que o
+    gerou: se ela sofrer rollback, o e-mail também some.
+    """
+    return EmailOutbox.objects.create(
+        subject=subject,
+        body=body,
+        html_body=html_body,
+        from_email=from_email or '',
+        to=list(to),
+    )
+
+
+@dataclass
+class DispatchResult:
+    sent: int = 0
+    retried: int = 0
+    dead: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.sent + self.retried + self.dead
+
+
+def backoff_delay(attempts: int) -> timedelta:
+    """Backoff exponencial: BASE, 2*BASE, 4*BASE... limitado a 1 hora."""
+    seconds = settings.EMAIL_OUTBOX_BACKOFF * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(seconds, 3600))
+
+
+def _claim_batch(batch_size: int) -> list[EmailOutbox]:
+    """
+    Reserva um lote de mensagens vencidas empurrando next_attempt_at para frente
+    (lease). No PostgreSQL o SKIP LOCKED permite vários dispatchers em paralelo.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status=EmailOutbox.Status.PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        if batch:
+            EmailOutbox.objects.filter(pk__in=[m.pk for m in batch]).update(
+                next_attempt_at=now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE)
+            )
+    return batch
+
+
+def _message(item: EmailOutbox, connection) -> EmailMultiAlternatives:
+    msg = EmailMultiAlternatives(
+        subject=item.subject,
+        body=item.body,
+        from_email=item.from_email or None,
+        to=item.to,
+        connection=connection,
+    )
+    if item.html_body:
+        msg.attach_alternative(item.html_body, 'text/html')
+    return msg
+
+
+def dispatch_batch(batch_size: Optional[int] = None, connection=None) -> DispatchResult:
+    """
+    Envia um lote da outbox por uma única conexão SMTP (reaproveitada entre as
+    mensagens). Falhas voltam para a fila com backoff; depois de
+    EMAIL_OUTBOX_MAX_ATTEMPTS tentativas a mensagem vai para DLQ (dead letter).
+    """
+    result = DispatchResult()
+    batch = _claim_batch(batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE)
+    if not batch:
+        return result
+
+    connection = connection or get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as exc:
+        # não conseguiu nem conectar: o lote inteiro volta para a fila com backoff
+        for item in batch:
+            _record_failure(item, exc, result)
+        return result
+
+    sent_ids = []
+    try:
+        for item in batch:
+            try:
+                try:
+                    connection.send_messages([_message(item, connection)])
+                except _DROPPED:
+                    # servidor derrubou a conexão reaproveitada (ou o socket caiu): reconecta uma vez
+                    connection.close()
+                    connection.open()
+                    connection.send_messages([_message(item, connection)])
+            except Exception as exc:
+                _record_failure(item, exc, result)
+            else:
+                sent_ids.append(item.pk)
+    finally:
+        connection.close()
+
+    if sent_ids:
+        EmailOutbox.objects.filter(pk__in=sent_ids).update(
+            status=EmailOutbox.Status.SENT, sent_at=timezone.now(), last_error=''
+        )
+        result.sent = len(sent_ids)
+        metrics.inc('leads_email_messages_total', result.sent, channel='outbox', result='sent')
+    return result
+
+
+def _record_failure(item: EmailOutbox, exc: Exception, result: DispatchResult) -> None:
+    item.attempts += 1
+    item.last_error = f'{type(exc).__name__}: {exc}'
+    if item.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        item.status = EmailOutbox.Status.DEAD
+        result.dead += 1
+        metrics.inc('leads_email_messages_total', channel='outbox', result='dead')
+    else:
+        item.next_attempt_at = timezone.now() + backoff_delay(item.attempts)
+        result.retried += 1
+        metrics.inc('leads_email_messages_total', channel='outbox', result='retry')
+    item.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
@@ -0,0 +1,160 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+
+from . import metrics
+from .filters import MAX_ID
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(created_at: datetime, pk: int, direction: str) -> str:
+    raw = json.dumps([created_at.isoformat(), pk, direction], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token: str) -> tuple[datetime, int, str]:
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        created_at, pk, direction = json.loads(raw)
+        if direction not in ('n', 'p'):
+            raise ValueError(direction)
+        pk = int(pk)
+        if not 0 < pk <= MAX_ID:
+            # fora do INTEGER do banco: estouraria no WHERE do keyset
+            raise ValueError(pk)
+        return datetime.fromisoformat(created_at), pk, direction
+    except (binascii.Error, ValueError, TypeError) as exc:
+        raise InvalidCursor(token) from exc
+
+
+class KeysetPage:
+    """Página por cursor: mesma interface usada por partials/_pagination.html, sem total."""
+
+    is_keyset = True
+
+    def __init__(self, object_list: list, has_next: bool, has_previous: bool):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self) -> bool:
+        return self._has_next
+
+    def has_previous(self) -> bool:
+        return self._has_previous
+
+    def has_other_pages(self) -> bool:
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self) -> Optional[str]:
+        if not self._has_next:
+            return None
+        last = self.object_list[-1]
+        return encode_cursor(last.created_at, last.pk, 'n')
+
+    @property
+    def previous_cursor(self) -> Optional[str]:
+        if not self._has_previous:
+            return None
+        first = self.object_list[0]
+        return encode_cursor(first.created_at, first.pk, 'p')
+
+
+class KeysetPaginator:
+    """
+    Paginação por cursor sobre (created_at, id), em ordem decrescente.
+    Cada página é um único SELECT com LIMIT, sem OFFSET e sem COUNT:
+    a página 500 custa o mesmo que a página 1.
+    """
+
+    def __init__(self, queryset: QuerySet, per_page: int):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def page(self, token: Optional[str] = None) -> KeysetPage:
+        qs = self.queryset
+        if not token:
+            rows = list(qs.order_by('-created_at', '-id')[:self.per_page + 1])
+            return KeysetPage(rows[:self.per_page], len(rows) > self.per_page, False)
+
+        created_at, pk, direction = decode_cursor(token)
+        if direction == 'n':
+            after = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            rows = list(qs.filter(after).order_by('-created_at', '-id')[:self.per_page + 1])
+            return KeysetPage(rows[:self.per_page], len(rows) > self.per_page, True)
+
+        before = Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+        rows = list(qs.filter(before).order_by('created_at', 'id')[:self.per_page + 1])
+        rows.reverse()
+        return KeysetPage(rows[-self.per_page:], True, len(rows) > self.per_page)
+
+
+def estimate_count(qs: QuerySet) -> Optional[int]:
+    """Total estimado pelo planner do PostgreSQL (EXPLAIN), sem executar a consulta."""
+    connection = connections[qs.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = qs.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator cujo COUNT fica em cache sob uma chave versionada pelo filtro
+    (ver leads.cache). Opcionalmente, no PostgreSQL, usa a estimativa do planner
+    quando o resultado é muito grande (is_estimated=True; a UI mostra "~").
+    """
+
+    def __init__(self, object_list, per_page, cache_key: Optional[str] = None,
+                 approx_threshold: int = 0, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.cache_key = cache_key
+        self.approx_threshold = approx_threshold
+        self._is_estimated = False
+
+    def _compute_count(self) -> tuple[int, bool]:
+        if self.approx_threshold:
+            estimate = estimate_count(self.object_list)
+            if estimate is not None and estimate > self.approx_threshold:
+                return estimate, True
+        return self.object_list.count(), False
+
+    @cached_property
+    def count(self) -> int:
+        cached = cache.get(self.cache_key) if self.cache_key else None
+        if self.cache_key:
+            metrics.cache_lookup('count', hits=cached is not None, misses=cached is None)
+        if cached is None:
+            cached = self._compute_count()
+            if self.cache_key:
+                cache.set(self.cache_key, cached, settings.LEADS_COUNT_CACHE_TIMEOUT)
+        count, self._is_estimated = cached
+        return count
+
+    @property
+    def is_estimated(self) -> bool:
+        return self.count is not None and self._is_estimated
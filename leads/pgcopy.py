@@ -0,0 +1,204 @@
+"""
+Caminho rápido com COPY (PostgreSQL + psycopg 3) para importação e exportação.
+
+Importação: o bloco vai por COPY ... FROM STDIN para uma tabela temporária e de lá
+para leads_lead e leads_lead_tags com INSERT ... SELECT (um statement por etapa,
+sem objetos Lead em Python). Os ids vêm da sequence já na tabela temporária, então
+as tags são ligadas por join, sem depender da ordem do RETURNING.
+
+Exportação: COPY (SELECT ...) TO STDOUT (FORMAT csv) direto para a resposta,
+com as mesmas colunas e formatação de exports.csv_stream.
+
+Nos demais bancos (ou com LEADS_PG_COPY=False) o chamador usa o ORM em lote.
+"""
+from typing import Iterator, Optional, Sequence
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Case, CharField, F, Func, QuerySet, TextField, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, NullIf, Replace
+from django.utils import timezone
+
+from . import cache as leads_cache
+from . import rollup
+from .bulk import LeadTag, UpsertResult
+from .models import Lead, Tag
+
+DUPLICATE_ERROR = 'já existe um lead com este email e empresa.'
+
+STAGE = 'leads_copy_stage'
+# colunas gravadas pela importação, na ordem da tabela temporária
+COPY_COLUMNS = ('name', 'email', 'phone', 'company', 'status', 'source', 'value', 'notes')
+
+
+def enabled() -> bool:
+    return connection.vendor == 'postgresql' and settings.LEADS_PG_COPY
+
+
+def _q(name: str) -> str:
+    return connection.ops.quote_name(name)
+
+
+def _stage(cursor, rows: Sequence[tuple[dict, Optional[list[str]]]]) -> None:
+    """Cria a tabela temporária do bloco e carrega as linhas por COPY."""
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [Lead._meta.db_table])
+    sequence = cursor.fetchone()[0]
+    cursor.execute(f'DROP TABLE IF EXISTS pg_temp.{STAGE}')
+    cursor.execute(
+        f'CREATE TEMP TABLE {STAGE} ('
+        f" id bigint DEFAULT nextval('{sequence}'::regclass),"
+        ' line integer, name text, email text, phone text, company text, status text,'
+        ' source text, value numeric, notes text, tags text'
+        ') ON COMMIT DROP'
+    )
+    defaults = {name: Lead._meta.get_field(name).get_default() for name in COPY_COLUMNS}
+    columns = ', '.join(('line', *COPY_COLUMNS, 'tags'))
+    with cursor.copy(f'COPY {STAGE} ({columns}) FROM STDIN') as copy:
+        for line, (values, tags) in enumerate(rows):
+            copy.write_row((
+                line,
+                *(values.get(name, defaults[name]) for name in COPY_COLUMNS),
+                # nomes de tag vêm de "a, b" já separados por vírgula: nenhum contém vírgula
+                None if tags is None else ','.join(dict.fromkeys(tags)),
+            ))
+
+
+def _link_tags(cursor, replace: bool) -> None:
+    """Cria as tags que faltam e liga leads e tags a partir da tabela temporária."""
+    lead_tags, tag_table = LeadTag._meta.db_table, Tag._meta.db_table
+    if replace:
+        # modo upsert: a coluna tags substitui as tags atuais
+        cursor.execute(
+            f'DELETE FROM {_q(lead_tags)} lt USING {STAGE} s '
+            f'WHERE lt.lead_id = s.id AND s.tags IS NOT NULL'
+        )
+    cursor.execute(
+        f'INSERT INTO {_q(tag_table)} (name) '
+        f"SELECT DISTINCT n.name FROM {STAGE} s, unnest(string_to_array(s.tags, ',')) AS n(name) "
+        f'ON CONFLICT (name) DO NOTHING RETURNING id'
+    )
+    if cursor.fetchall():
+        leads_cache.invalidate(leads_cache.TAGS)
+    cursor.execute(
+        f'INSERT INTO {_q(lead_tags)} (lead_id, tag_id) '
+        f'SELECT DISTINCT s.id, t.id FROM {STAGE} s '
+        f"CROSS JOIN LATERAL unnest(string_to_array(s.tags, ',')) AS n(name) "
+        f'JOIN {_q(tag_table)} t ON t.name = n.name '
+        f'JOIN {_q(Lead._meta.db_table)} l ON l.id = s.id '
+        f'ON CONFLICT DO NOTHING'
+    )
+
+
+def import_leads(
+    rows: Sequence[tuple[dict, Optional[list[str]]]], owner=None, upsert: bool = False,
+) -> tuple[UpsertResult, list[int]]:
+    """
+    Grava um bloco de (campos, tags) como insert_leads (criar) ou upsert_leads (upsert).
+    Retorna o resultado e as posições das linhas ignoradas por conflito de (email, company)
+    (só no modo criar; no upsert vale a última ocorrência da chave).
+    Deve ser chamado dentro de uma transação.
+    """
+    result, skipped = UpsertResult(), []
+    if not rows:
+        return result, skipped
+    lead_table = _q(Lead._meta.db_table)
+    present = [name for name in COPY_COLUMNS if any(name in values for values, _ in rows)]
+    select = ', '.join(f's.{name}' for name in COPY_COLUMNS)
+    now = timezone.now()
+
+    with connection.cursor() as cursor:
+        _stage(cursor, rows)
+        existing = []
+        if upsert:
+            # ON CONFLICT DO UPDATE não aceita a mesma chave duas vezes no mesmo statement
+            cursor.execute(
+                f"DELETE FROM {STAGE} s WHERE s.email <> '' AND EXISTS ("
+                f'SELECT 1 FROM {STAGE} o WHERE lower(o.email) = lower(s.email) AND o.company = s.company AND o.line > s.line)'
+            )
+            cursor.execute(
+                f'SELECT l.id FROM {lead_table} l JOIN {STAGE} s '
+                f"ON s.email <> '' AND lower(l.email) = lower(s.email) AND l.company = s.company"
+            )
+            existing = [pk for pk, in cursor.fetchall()]
+            # a contribuição antiga sai do rollup; a nova entra abaixo junto com os criados
+            rollup.remove_selection(Lead.objects.filter(pk__in=existing))
+            updates = ', '.join(f'{name} = EXCLUDED.{name}' for name in (*present, 'update_at'))
+            # mesmas expressões e condição da constraint parcial unique_lead_email_ci_per_company
+            conflict = f"ON CONFLICT (lower(email), company) WHERE NOT (email = '') DO UPDATE SET {updates}"
+        else:
+            conflict = 'ON CONFLICT DO NOTHING'
+        cursor.execute(
+            f'INSERT INTO {lead_table} (id, {", ".join(COPY_COLUMNS)}, owner_id, created_at, update_at) '
+            f'SELECT s.id, {select}, %s, %s, %s FROM {STAGE} s ORDER BY s.line '
+            f'{conflict} RETURNING id',
+            [owner.pk if owner else None, now, now],
+        )
+        written = [pk for pk, in cursor.fetchall()]
+        if upsert:
+            # linhas que atualizaram um lead passam a apontar para o id dele
+            cursor.execute(
+                f'UPDATE {STAGE} s SET id = l.id FROM {lead_table} l '
+                f"WHERE s.email <> '' AND lower(l.email) = lower(s.email) AND l.company = s.company AND s.id <> l.id"
+            )
+        else:
+            cursor.execute(
+                f'SELECT s.line FROM {STAGE} s WHERE NOT EXISTS (SELECT 1 FROM {lead_table} l WHERE l.id = s.id) '
+                f'ORDER BY s.line'
+            )
+            skipped = [line for line, in cursor.fetchall()]
+        _link_tags(cursor, replace=upsert)
+
+    result.updated = len(existing)
+    result.created = len(written) - result.updated
+    rollup.apply(rollup.grouped(Lead.objects.filter(pk__in=written)))
+    leads_cache.invalidate(leads_cache.LEADS)
+    return result, skipped
+
+
+def _label(field: str, choices) -> Case:
+    return Case(*(When(**{field: code}, then=Value(label)) for code, label in choices), default=F(field))
+
+
+def csv_columns() -> dict:
+    """Expressões SQL com a mesma saída de exports.CSV_VALUES (texto vazio vira NULL: sem aspas no CSV)."""
+    tags = RawSQL(
+        f"(SELECT string_agg(t.name, ', ' ORDER BY t.name) FROM {_q(LeadTag._meta.db_table)} lt "
+        f'JOIN {_q(Tag._meta.db_table)} t ON t.id = lt.tag_id '
+        f'WHERE lt.lead_id = {_q(Lead._meta.db_table)}.id)',
+        [], output_field=TextField(),
+    )
+    text = {
+        'name': F('name'),
+        'email': F('email'),
+        'phone': F('phone'),
+        'company': F('company'),
+        'status': _label('status', Lead.Status.choices),
+        'source': _label('source', Lead.Source.choices),
+        'owner': F(f'owner__{get_user_model().USERNAME_FIELD}'),
+        'notes': Replace(Replace(F('notes'), Value('\r\n'), Value(' ')), Value('\n'), Value(' ')),
+    }
+    return {
+        **{name: NullIf(expr, Value(''), output_field=TextField()) for name, expr in text.items()},
+        'value': Cast('value', TextField()),
+        'tags': tags,
+        # a sessão do Django no PostgreSQL usa UTC, como os datetimes do ORM
+        'created_at': Func(
+            F('created_at'), Value('YYYY-MM-DD HH24:MI:SS'), function='to_char', output_field=CharField(),
+        ),
+    }
+
+
+def csv_stream(qs: QuerySet, columns: Sequence[str]) -> Iterator[bytes]:
+    """CSV da exportação direto do COPY TO STDOUT, com o mesmo cabeçalho/BOM do caminho ORM."""
+    exprs = csv_columns()
+    qs = qs.prefetch_related(None).annotate(
+        **{f'copy_{name}': exprs[name] for name in columns}
+    ).values_list(*(f'copy_{name}' for name in columns))
+    sql, params = qs.query.sql_with_params()
+    yield ('\ufeff' + ','.join(columns) + '\n').encode()
+    with connection.cursor() as cursor:
+        with cursor.copy(f'COPY ({sql}) TO STDOUT (FORMAT csv)', params) as copy:
+            for data in copy:
+                yield bytes(data)
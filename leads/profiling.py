@@ -0,0 +1,314 @@
+"""
+Profiling por request (opt-in com LEADS_PROFILING=True).
+
+O middleware registra, para cada request, o total de queries, o tempo de banco,
+o tempo de renderização de templates e as queries mais lentas. O resumo sai no
+header `Server-Timing` (visível no DevTools do navegador) e numa linha JSON do
+logger "leads.profiling".
+
+Queries com o mesmo formato (SQL sem os literais) repetidas LEADS_PROFILING_REPEAT_THRESHOLD
+vezes ou mais são marcadas como provável N+1, com a linha que as disparou: o primeiro frame
+do projeto na pilha e, se a query saiu de dentro de um template, o template e a linha da tag.
+
+As queries são capturadas por um execute_wrapper em cada conexão e atribuídas ao
+request pelo ContextVar `_current`, que acompanha sync_to_async/async_to_sync: vale para
+as views async e para o corpo de respostas em streaming (exportação). Nesses casos o
+header só reflete o que rodou até a resposta sair; o log é gravado no fim do corpo.
+
+QueryBudgetMixin usa a mesma captura para os testes limitarem queries por view.
+"""
+import heapq
+import json
+import logging
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.base import Node, Template
+
+logger = logging.getLogger('leads.profiling')
+
+_current: ContextVar[Optional['RequestProfile']] = ContextVar('leads_profile', default=None)
+
+# literais que mudam entre execuções da mesma query: listas de IN, números (LIMIT/OFFSET), strings
+_SHAPE_RES = (
+    (re.compile(r'%s(?:, %s)+'), '%s, ...'),
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+\b'), '?'),
+)
+MAX_SQL_LENGTH = 300
+
+
+def query_shape(sql: str) -> str:
+    for pattern, repl in _SHAPE_RES:
+        sql = pattern.sub(repl, sql)
+    return sql
+
+
+def _project_path(filename: str) -> Optional[str]:
+    base = str(settings.BASE_DIR)
+    if not filename.startswith(base) or 'site-packages' in filename or filename == __file__:
+        return None
+    path = os.path.relpath(filename, base)
+    # manage.py e outros scripts da raiz só aparecem como ponto de entrada
+    return path if os.sep in path else None
+
+
+def caller() -> str:
+    """Primeiro frame do projeto na pilha e, se houver, o nó de template em renderização."""
+    code = template = None
+    frame = sys._getframe(1)
+    while frame is not None and not (code and template):
+        if code is None:
+            path = _project_path(frame.f_code.co_filename)
+            if path:
+                code = f'{path}:{frame.f_lineno} ({frame.f_code.co_name})'
+        if template is None and frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            if isinstance(node, Node) and node.origin is not None:
+                template = f'{node.origin.template_name}:{node.token.lineno}'
+        frame = frame.f_back
+    if template:
+        return f'{code} via {template}' if code else template
+    return code or '?'
+
+
+@dataclass
+class QueryShape:
+    sql: str
+    location: str
+    count: int = 0
+    duration: float = 0.0
+
+
+class RequestProfile:
+    def __init__(self, slowest: Optional[int] = None):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.shapes: dict[str, QueryShape] = {}
+        self.slowest_size = settings.LEADS_PROFILING_SLOWEST if slowest is None else slowest
+        self._slowest: list[tuple[float, int, str, str]] = []
+        self._rendering = False
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def record(self, sql: str, duration: float) -> None:
+        self.queries += 1
+        self.db_time += duration
+        shape = query_shape(sql)
+        entry = self.shapes.get(shape)
+        if entry is None:
+            entry = self.shapes[shape] = QueryShape(sql[:MAX_SQL_LENGTH], caller())
+        entry.count += 1
+        entry.duration += duration
+        if len(self._slowest) < self.slowest_size or duration > self._slowest[0][0]:
+            item = (duration, self.queries, sql[:MAX_SQL_LENGTH], entry.location)
+            if len(self._slowest) < self.slowest_size:
+                heapq.heappush(self._slowest, item)
+            else:
+                heapq.heapreplace(self._slowest, item)
+
+    @contextmanager
+    def activate(self):
+        install()
+        for conn in connections.all(initialized_only=True):
+            _install_wrapper(conn)
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+            self.elapsed = time.perf_counter() - self.started
+
+    def slowest(self) -> list[dict]:
+        return [
+            {'ms': round(duration * 1000, 2), 'sql': sql, 'location': location}
+            for duration, _, sql, location in sorted(self._slowest, reverse=True)
+        ]
+
+    def repeated(self, threshold: Optional[int] = None) -> list[QueryShape]:
+        """Formatos executados `threshold` vezes ou mais (provável N+1), do mais frequente ao menos."""
+        threshold = settings.LEADS_PROFILING_REPEAT_THRESHOLD if threshold is None else threshold
+        found = [entry for entry in self.shapes.values() if entry.count >= threshold]
+        return sorted(found, key=lambda entry: -entry.count)
+
+    def server_timing(self) -> str:
+        metrics = [
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f};desc="templates"',
+            f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}',
+        ]
+        repeated = self.repeated()
+        if repeated:
+            metrics.append(f'nplus1;desc="{len(repeated)} queries repetidas"')
+        return ', '.join(metrics)
+
+    def summary(self, request, response) -> dict:
+        return {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': self.queries,
+            'db_ms': round(self.db_time * 1000, 2),
+            'template_ms': round(self.template_time * 1000, 2),
+            'total_ms': round(self.elapsed * 1000, 2),
+            'slowest': self.slowest(),
+            'n_plus_one': [
+                {'count': entry.count, 'sql': entry.sql, 'location': entry.location}
+                for entry in self.repeated()
+            ],
+        }
+
+    def describe(self) -> str:
+        """Texto para mensagens de falha: formatos de query com contagem e origem."""
+        lines = [f'{self.queries} queries:']
+        for entry in sorted(self.shapes.values(), key=lambda entry: -entry.count):
+            lines.append(f'  {entry.count}x {entry.location}: {entry.sql}')
+        return '\n'.join(lines)
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.record(sql, time.perf_counter() - started)
+
+
+def _install_wrapper(conn, **kwargs) -> None:
+    if _execute_wrapper not in conn.execute_wrappers:
+        # no início da lista: execute_wrapper() de terceiros desempilha com pop()
+        conn.execute_wrappers.insert(0, _execute_wrapper)
+
+
+def _connection_created(sender, connection, **kwargs) -> None:
+    _install_wrapper(connection)
+
+
+_template_render = None
+
+
+def _profiled_render(self, context):
+    profile = _current.get()
+    if profile is None or profile._rendering:
+        # include/extends renderizam dentro do template externo: só o de fora é cronometrado
+        return _template_render(self, context)
+    profile._rendering = True
+    started = time.perf_counter()
+    try:
+        return _template_render(self, context)
+    finally:
+        profile.template_time += time.perf_counter() - started
+        profile._rendering = False
+
+
+def install() -> None:
+    """Liga a captura de queries (conexões novas) e o cronômetro de templates; idempotente."""
+    global _template_render
+    connection_created.connect(_connection_created, dispatch_uid='leads.profiling')
+    if Template._render is not _profiled_render:
+        _template_render = Template._render
+        Template._render = _profiled_render
+
+
+class QueryProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.LEADS_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        profile = RequestProfile()
+        with profile.activate():
+            response = self.get_response(request)
+        return self._finish(profile, request, response)
+
+    async def __acall__(self, request):
+        profile = RequestProfile()
+        with profile.activate():
+            response = await self.get_response(request)
+        return self._finish(profile, request, response)
+
+    def _finish(self, profile: RequestProfile, request, response):
+        response['Server-Timing'] = profile.server_timing()
+        if not response.streaming:
+            self._log(profile, request, response)
+        elif response.is_async:
+            response.streaming_content = self._aprofiled(profile, request, response, response.streaming_content)
+        else:
+            response.streaming_content = self._profiled(profile, request, response, response.streaming_content)
+        return response
+
+    def _profiled(self, profile, request, response, content):
+        # o corpo é consumido depois do middleware: reativa o perfil a cada bloco
+        it = iter(content)
+        try:
+            while True:
+                with profile.activate():
+                    chunk = next(it, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            self._log(profile, request, response)
+
+    async def _aprofiled(self, profile, request, response, content):
+        it = aiter(content)
+        try:
+            while True:
+                with profile.activate():
+                    chunk = await anext(it, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            self._log(profile, request, response)
+
+    @staticmethod
+    def _log(profile, request, response) -> None:
+        data = profile.summary(request, response)
+        level = logging.WARNING if data['n_plus_one'] else logging.INFO
+        logger.log(level, json.dumps(data, ensure_ascii=False))
+
+
+class QueryBudgetMixin:
+    """
+    Para TestCase: limita as queries de um trecho e falha com a lista de formatos e origens.
+
+        with self.assertQueryBudget(5):
+            resp = self.client.get(url)
+            b''.join(resp.streaming_content)  # streaming: consumir dentro do bloco
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, queries: int, repeats: Optional[int] = None):
+        """`repeats`: máximo de execuções do mesmo formato (padrão: abaixo do limite de N+1)."""
+        profile = RequestProfile()
+        with profile.activate():
+            yield profile
+        self.assertLessEqual(profile.queries, queries, profile.describe())
+        limit = settings.LEADS_PROFILING_REPEAT_THRESHOLD if repeats is None else repeats + 1
+        self.assertEqual(profile.repeated(limit), [], f'provável N+1\n{profile.describe()}')
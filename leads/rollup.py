@@ -0,0 +1,202 @@
+"""
+Manutenção incremental de PipelineRollup.
+
+Cada lead contribui com (1, value) para a linha (dia de criação, status, source, owner).
+Criar soma, remover subtrai e atualizar move a contribuição entre linhas quando
+status/source/owner mudam. Os incrementos usam F() (atômicos no banco).
+rebuild() recalcula tudo com um GROUP BY e informa as diferenças encontradas.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Iterable, Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Lead, PipelineRollup
+
+Key = tuple[date, str, str, Optional[int]]
+Delta = tuple[int, Decimal]
+State = tuple[Key, Decimal]
+
+STATE_FIELDS = ('created_at', 'status', 'source', 'owner_id', 'value')
+
+# sentinela de move_selection: None é um owner válido ("sem owner")
+KEEP = object()
+
+
+def lead_key(created_at, status, source, owner_id) -> Key:
+    return timezone.localdate(created_at), status, source, owner_id
+
+
+def lead_state(lead: Lead) -> State:
+    return lead_key(lead.created_at, lead.status, lead.source, lead.owner_id), Decimal(lead.value or 0)
+
+
+def stored_state(pk) -> Optional[State]:
+    """Estado do lead como está no banco (antes de um save)."""
+    row = Lead.objects.filter(pk=pk).values_list(*STATE_FIELDS).first()
+    if row is None:
+        return None
+    *key, value = row
+    return lead_key(*key), Decimal(value or 0)
+
+
+def _apply_one(key: Key, count: int, value: Decimal) -> None:
+    day, status, source, owner_id = key
+    lookup = dict(day=day, status=status, source=source, owner_id=owner_id)
+    changes = dict(lead_count=F('lead_count') + count, total_value=F('total_value') + value)
+    if PipelineRollup.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            PipelineRollup.objects.create(**lookup, lead_count=count, total_value=value)
+    except IntegrityError:
+        # outro processo criou a linha entre o UPDATE e o INSERT
+        PipelineRollup.objects.filter(**lookup).update(**changes)
+
+
+def apply(deltas: dict[Key, Delta]) -> None:
+    for key, (count, value) in deltas.items():
+        if count or value:
+            _apply_one(key, count, value)
+
+
+def move_many(changes: Iterable[tuple[Optional[State], Optional[State]]]) -> None:
+    """Transfere a contribuição de cada lead do estado `old` para `new` (None = inexistente)."""
+    deltas: dict[Key, Delta] = defaultdict(lambda: (0, Decimal(0)))
+    for old, new in changes:
+        if old is not None:
+            count, value = deltas[old[0]]
+            deltas[old[0]] = (count - 1, value - old[1])
+        if new is not None:
+            count, value = deltas[new[0]]
+            deltas[new[0]] = (count + 1, value + new[1])
+    apply(deltas)
+
+
+def move(old: Optional[State], new: Optional[State]) -> None:
+    move_many([(old, new)])
+
+
+def add_leads(leads: Iterable[Lead]) -> None:
+    """Soma leads recém-criados em lote (bulk_create não dispara signals)."""
+    move_many((None, lead_state(lead)) for lead in leads)
+
+
+def merge_owner(owner_id: int) -> None:
+    """
+    Usuário removido: Lead.owner vira NULL por UPDATE (SET_NULL, sem signals),
+    então as linhas dele passam para "sem owner" antes de serem apagadas em cascata.
+    """
+    rows = PipelineRollup.objects.filter(owner_id=owner_id)
+    apply({
+        (r.day, r.status, r.source, None): (r.lead_count, r.total_value)
+        for r in rows
+    })
+    rows.delete()
+
+
+def grouped(qs) -> dict[Key, Delta]:
+    """Contribuição de um conjunto de leads ao rollup, com um único GROUP BY."""
+    rows = (
+        qs.annotate(day=TruncDate('created_at'))
+        .values_list('day', 'status', 'source', 'owner_id')
+        .annotate(lead_count=Count('id'), total_value=Sum('value'))
+        .order_by()
+    )
+    return {
+        (day, status, source, owner_id): (count, Decimal(total or 0))
+        for day, status, source, owner_id, count, total in rows
+    }
+
+
+def move_selection(qs, status: Optional[str] = None, owner_id=KEEP) -> None:
+    """
+    Ações em lote (UPDATE sem signals): move os grupos do conjunto para o novo
+    status/owner. Custo proporcional ao número de grupos, não de leads.
+    Chamar antes do UPDATE, na mesma transação.
+    """
+    deltas: dict[Key, Delta] = defaultdict(lambda: (0, Decimal(0)))
+    for (day, old_status, source, old_owner), (count, total) in grouped(qs).items():
+        new_key = (day, status or old_status, source, old_owner if owner_id is KEEP else owner_id)
+        for key, sign in (((day, old_status, source, old_owner), -1), (new_key, 1)):
+            c, v = deltas[key]
+            deltas[key] = (c + sign * count, v + sign * total)
+    apply(deltas)
+
+
+def remove_selection(qs) -> None:
+    """Subtrai um conjunto de leads que vai ser apagado em lote (sem signals)."""
+    apply({key: (-count, -total) for key, (count, total) in grouped(qs).items()})
+
+
+def expected_rows() -> dict[Key, Delta]:
+    """Rollup calculado direto da tabela de leads (GROUP BY completo)."""
+    return grouped(Lead.objects.all())
+
+
+def current_rows() -> dict[Key, Delta]:
+    return {
+        (day, status, source, owner_id): (count, Decimal(total))
+        for day, status, source, owner_id, count, total in PipelineRollup.objects.values_list(
+            'day', 'status', 'source', 'owner_id', 'lead_count', 'total_value',
+        )
+        if count or total
+    }
+
+
+def diff(expected: dict[Key, Delta], current: dict[Key, Delta]) -> list[tuple[Key, Optional[Delta], Optional[Delta]]]:
+    return [
+        (key, expected.get(key), current.get(key))
+        for key in sorted(expected.keys() | current.keys(), key=str)
+        if expected.get(key) != current.get(key)
+    ]
+
+
+@transaction.atomic
+def rebuild(dry_run: bool = False) -> list[tuple[Key, Optional[Delta], Optional[Delta]]]:
+    """Recalcula o rollup do zero. Retorna as divergências encontradas no rollup anterior."""
+    expected = expected_rows()
+    differences = diff(expected, current_rows())
+    if not dry_run:
+        PipelineRollup.objects.all().delete()
+        PipelineRollup.objects.bulk_create([
+            PipelineRollup(day=day, status=status, source=source, owner_id=owner_id,
+                           lead_count=count, total_value=total)
+            for (day, status, source, owner_id), (count, total) in expected.items()
+        ])
+    return differences
+
+
+def dashboard(days: int = 30) -> dict:
+    """Totais para o painel, lidos só do rollup (tamanho independe do número de leads)."""
+    start = timezone.localdate() - timedelta(days=days - 1)
+    totals = dict(leads=Sum('lead_count'), value=Sum('total_value'))
+    rollup = PipelineRollup.objects.filter(lead_count__gt=0).order_by()
+    by_day = {
+        row['day']: row for row in rollup.filter(day__gte=start).values('day').annotate(**totals)
+    }
+    by_status = list(rollup.values('status').annotate(**totals).order_by('-leads'))
+    by_source = list(rollup.values('source').annotate(**totals).order_by('-leads'))
+    # códigos fora das choices (dados antigos, edição direta no banco) aparecem como estão
+    status_labels, source_labels = dict(Lead.Status.choices), dict(Lead.Source.choices)
+    for row in by_status:
+        row['label'] = status_labels.get(row['status'], row['status'])
+    for row in by_source:
+        row['label'] = source_labels.get(row['source'], row['source'])
+    return {
+        'overall': rollup.aggregate(**totals),
+        'by_status': by_status,
+        'by_source': by_source,
+        'by_owner': list(
+            rollup.values('owner_id', 'owner__username').annotate(**totals).order_by('-value')
+        ),
+        'by_day': [
+            by_day.get(day, {'day': day, 'leads': 0, 'value': 0})
+            for day in (start + timedelta(days=i) for i in range(days))
+        ],
+    }
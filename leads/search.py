@@ -0,0 +1,124 @@
+"""
+Backends de busca para o filtro `q` da lista de leads.
+
+Semântica comum: o texto é quebrado em termos (\\w+) e cada termo casa por
+prefixo em nome, empresa, email, telefone ou notas; todos os termos precisam
+casar (AND).
+
+- PostgreSQL: coluna `search_vector` (tsvector) mantida por trigger, índice GIN.
+- SQLite: tabela FTS5 `leads_lead_fts` (external content) mantida por triggers.
+- Demais bancos: fallback com `icontains`.
+
+Como os índices são mantidos por triggers no banco, inserts em lote
+(bulk_create, COPY) também ficam pesquisáveis.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q, QuerySet
+from django.db.models.expressions import RawSQL
+
+_TERM_RE = re.compile(r'\w+')
+
+
+def search_terms(q: str) -> list[str]:
+    return _TERM_RE.findall(q.lower())
+
+
+class IcontainsSearch:
+    ranked = False
+
+    def filter(self, qs: QuerySet, q: str) -> QuerySet:
+        return qs.filter(
+            Q(name__icontains=q)
+            | Q(email__icontains=q)
+            | Q(company__icontains=q)
+            | Q(phone__icontains=q)
+            | Q(notes__icontains=q)
+        )
+
+    def rank(self, qs: QuerySet, q: str) -> QuerySet:
+        return qs
+
+    def cache_key(self, q: str) -> str:
+        """Forma de `q` para chaves de cache: buscas com a mesma chave casam as mesmas linhas."""
+        # icontains compara o texto inteiro, com espaços; a caixa depende do banco
+        return q
+
+
+class TermSearch(IcontainsSearch):
+    """Backends por termos: só os termos (já em minúsculas) chegam ao banco."""
+
+    ranked = True
+
+    def cache_key(self, q):
+        terms = search_terms(q)
+        return ' '.join(terms) if terms else q
+
+
+class PostgresSearch(TermSearch):
+
+    @staticmethod
+    def _tsquery(terms: list[str]) -> str:
+        return ' & '.join(f'{t}:*' for t in terms)
+
+    def filter(self, qs, q):
+        terms = search_terms(q)
+        if not terms:
+            return super().filter(qs, q)
+        return qs.filter(RawSQL(
+            '"leads_lead"."search_vector" @@ to_tsquery(\'simple\', %s)',
+            [self._tsquery(terms)],
+            output_field=BooleanField(),
+        ))
+
+    def rank(self, qs, q):
+        terms = search_terms(q)
+        if not terms:
+            return qs
+        return qs.annotate(search_rank=RawSQL(
+            'ts_rank("leads_lead"."search_vector", to_tsquery(\'simple\', %s))',
+            [self._tsquery(terms)],
+            output_field=FloatField(),
+        ))
+
+
+class SQLiteSearch(TermSearch):
+
+    @staticmethod
+    def _match(terms: list[str]) -> str:
+        return ' '.join(f'"{t}"*' for t in terms)
+
+    def filter(self, qs, q):
+        terms = search_terms(q)
+        if not terms:
+            return super().filter(qs, q)
+        return qs.filter(RawSQL(
+            '"leads_lead"."id" IN (SELECT rowid FROM leads_lead_fts WHERE leads_lead_fts MATCH %s)',
+            [self._match(terms)],
+            output_field=BooleanField(),
+        ))
+
+    def rank(self, qs, q):
+        terms = search_terms(q)
+        if not terms:
+            return qs
+        # bm25() é "menor = melhor"; invertido para ordenar igual ao ts_rank
+        return qs.annotate(search_rank=RawSQL(
+            '(SELECT -bm25(leads_lead_fts) FROM leads_lead_fts '
+            'WHERE leads_lead_fts MATCH %s AND rowid = "leads_lead"."id")',
+            [self._match(terms)],
+            output_field=FloatField(),
+        ))
+
+
+def get_search_backend() -> IcontainsSearch:
+    """Escolhe o backend pelo banco em uso; LEADS_SEARCH_BACKEND="icontains" força o fallback."""
+    if settings.LEADS_SEARCH_BACKEND == 'icontains':
+        return IcontainsSearch()
+    if connection.vendor == 'postgresql':
+        return PostgresSearch()
+    if connection.vendor == 'sqlite':
+        return SQLiteSearch()
+    return IcontainsSearch()
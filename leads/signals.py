@@ -0,0 +1,79 @@
+from django.conf import settings
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import cache as leads_cache
+from . import rollup
+from .backends import forget_user
+from .models import Lead, Tag
+
+
+@receiver(post_save, sender=Lead)
+@receiver(post_delete, sender=Lead)
+def lead_changed(sender, **kwargs):
+    leads_cache.invalidate(leads_cache.LEADS)
+
+
+@receiver(pre_save, sender=Lead)
+def lead_rollup_before_save(sender, instance, raw=False, **kwargs):
+    # estado no banco, não o da instância em memória (que pode estar desatualizada)
+    if not raw:
+        instance._rollup_old = rollup.stored_state(instance.pk) if instance.pk else None
+
+
+@receiver(post_save, sender=Lead)
+def lead_rollup_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        rollup.move(instance.__dict__.pop('_rollup_old', None), rollup.lead_state(instance))
+
+
+@receiver(post_delete, sender=Lead)
+def lead_rollup_deleted(sender, instance, **kwargs):
+    rollup.move(rollup.lead_state(instance), None)
+
+
+@receiver(m2m_changed, sender=Lead.tags.through)
+def lead_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # tag.lead_set.clear(): guarda os leads afetados antes de perdê-los
+        instance._cleared_lead_ids = list(instance.lead_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        lead_ids = [instance.pk]
+    elif action == 'post_clear':
+        lead_ids = instance.__dict__.pop('_cleared_lead_ids', [])
+    else:
+        lead_ids = pk_set or []
+    # tags fazem parte do lead exibido/exportado: update_at alimenta ETags e cache de linhas
+    Lead.objects.filter(pk__in=lead_ids).update(update_at=timezone.now())
+    leads_cache.invalidate(leads_cache.LEADS)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, **kwargs):
+    leads_cache.invalidate(leads_cache.TAGS)
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def user_rollup_before_delete(sender, instance, **kwargs):
+    rollup.merge_owner(instance.pk)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_cache_changed(sender, instance, **kwargs):
+    # CachedModelBackend: o próximo request recarrega o usuário (senha, is_active...)
+    forget_user(instance.pk)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, update_fields=None, **kwargs):
+    # login só atualiza last_login: não muda a lista de owners
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return
+    leads_cache.invalidate(leads_cache.OWNERS)
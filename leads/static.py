@@ -0,0 +1,51 @@
+"""
+WhiteNoiseMiddleware que também roda como middleware async.
+
+O WhiteNoiseMiddleware original é só síncrono: sob ASGI o Django adapta a cadeia
+inteira de middlewares em volta dele (sync_to_async), e todo request, inclusive os
+da view async, ocuparia uma thread do executor do começo ao fim. Aqui a
+busca do arquivo é um dict (ou, com WHITENOISE_AUTOREFRESH, uma busca no disco
+numa thread) e o corpo é lido em blocos numa thread, sem segurar o loop.
+Sob WSGI o comportamento é o do WhiteNoise.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.http import FileResponse
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+async def _aread(fileobj, block_size: int = FileResponse.block_size):
+    read = sync_to_async(fileobj.read, thread_sensitive=False)
+    try:
+        while chunk := await read(block_size):
+            yield chunk
+    finally:
+        await sync_to_async(fileobj.close, thread_sensitive=False)()
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, **kwargs):
+        super().__init__(get_response, **kwargs)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file, thread_sensitive=False)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is None:
+            return await self.get_response(request)
+        response = await sync_to_async(self.serve, thread_sensitive=False)(static_file, request)
+        if getattr(response, 'file_to_stream', None) is not None:
+            # iterador síncrono seria lido inteiro (sync_to_async(list)) pelo handler ASGI
+            response.streaming_content = _aread(response.file_to_stream)
+        return response
@@ -0,0 +1,180 @@
+"""
+Gerador de leads sintéticos com distribuições próximas às de produção.
+
+- status/source com pesos fixos (a maioria dos leads fica em Novo/Website)
+- owners com distribuição de cauda longa (poucos vendedores concentram os leads)
+  e uma fração sem owner
+- tags por popularidade decrescente (Zipf), de 0 a 4 por lead
+- notas vazias em boa parte dos leads; nas demais, tamanho log-normal
+- created_at espalhado pelos últimos `days` dias, mais denso perto de hoje
+
+Tudo sai de um random.Random(seed): a mesma semente gera os mesmos dados.
+A gravação usa insert_leads (bulk_create + insert das tags) em blocos e recalcula o rollup no fim.
+"""
+import random
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+from typing import Iterator, Optional, Sequence
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import rollup
+from .bulk import TagCache, insert_leads
+from .dedupe import strip_accents, words
+from .importer import chunked
+from .models import Lead
+
+STATUS_WEIGHTS = {
+    Lead.Status.NEW: 35, Lead.Status.QUALIFIED: 25, Lead.Status.COLD: 20, Lead.Status.LOST: 12, Lead.Status.WON: 8,
+}
+SOURCE_WEIGHTS = {
+    Lead.Source.WEBSITE: 40, Lead.Source.ADS: 25, Lead.Source.REFERRAL: 15, Lead.Source.EVENT: 10,
+    Lead.Source.OTHER: 10,
+}
+# fração de leads sem owner / sem email / sem notas
+UNOWNED = 0.1
+NO_EMAIL = 0.05
+NO_NOTES = 0.4
+
+FIRST_NAMES = (
+    'Ana', 'Bruno', 'Carla', 'Diego', 'Eduarda', 'Felipe', 'Gabriela', 'Henrique', 'Isabela', 'João',
+    'Karina', 'Lucas', 'Mariana', 'Nicolas', 'Olívia', 'Pedro', 'Rafaela', 'Samuel', 'Tatiane', 'Vinícius',
+    'Alice', 'Bernardo', 'Camila', 'Daniel', 'Fernanda', 'Gustavo', 'Helena', 'Igor', 'Júlia', 'Leonardo',
+)
+LAST_NAMES = (
+    'Silva', 'Santos', 'Oliveira', 'Souza', 'Rodrigues', 'Ferreira', 'Alves', 'Pereira', 'Lima', 'Gomes',
+    'Costa', 'Ribeiro', 'Martins', 'Carvalho', 'Almeida', 'Lopes', 'Soares', 'Fernandes', 'Vieira', 'Barbosa',
+)
+COMPANY_WORDS = (
+    'Acme', 'Alfa', 'Atlas', 'Aurora', 'Beta', 'Brasil', 'Central', 'Delta', 'Digital', 'Eco', 'Global',
+    'Horizonte', 'Nova', 'Omega', 'Prime', 'Rede', 'Sol', 'Sul', 'Tech', 'Vale', 'Vida', 'Vitória',
+)
+COMPANY_SUFFIXES = ('Ltda', 'S/A', 'ME', 'Comércio', 'Serviços', 'Tecnologia', '')
+FREE_DOMAINS = ('gmail.com', 'hotmail.com', 'outlook.com', 'yahoo.com.br', 'uol.com.br')
+TAG_NAMES = (
+    'Hot', 'Follow-up', 'Cliente', 'Proposta', 'Demo', 'Enterprise', 'PME', 'Renovação', 'Indicação',
+    'Evento', 'Newsletter', 'Webinar', 'Parceiro', 'Inbound', 'Outbound', 'Orçamento', 'Urgente',
+    'Sem resposta', 'Retornar', 'Trial', 'Upsell', 'Churn', 'VIP', 'Sul', 'Sudeste', 'Nordeste',
+    'Norte', 'Centro-Oeste', 'Internacional', 'Teste',
+)
+NOTE_SENTENCES = (
+    'Cliente pediu retorno sobre a proposta.', 'Ligar na próxima semana.', 'Interesse no plano anual.',
+    'Enviado material por email.', 'Aguardando aprovação do financeiro.', 'Participou do webinar de março.',
+    'Comparando com concorrente.', 'Solicitou desconto para 50 licenças.', 'Reunião marcada com a diretoria.',
+    'Sem orçamento neste trimestre.', 'Contato veio por indicação de cliente atual.',
+)
+
+
+def _weighted(rng: random.Random, weights: dict) -> list:
+    return rng.choices(list(weights), weights=list(weights.values()), k=1)[0]
+
+
+@dataclass
+class LeadGenerator:
+    owner_ids: Sequence[Optional[int]] = ()
+    seed: int = 42
+    days: int = 365
+
+    def __post_init__(self):
+        self.rng = random.Random(self.seed)
+        self.now = timezone.now()
+        # Zipf: a tag i tem peso 1/(i+1); o owner i, 1/(i+1)^0.8
+        self.tag_weights = [1 / (i + 1) for i in range(len(TAG_NAMES))]
+        self.owner_weights = [1 / (i + 1) ** 0.8 for i in range(len(self.owner_ids))]
+
+    def _owner_id(self) -> Optional[int]:
+        if not self.owner_ids or self.rng.random() < UNOWNED:
+            return None
+        return self.rng.choices(self.owner_ids, weights=self.owner_weights, k=1)[0]
+
+    def _tags(self) -> list[str]:
+        count = self.rng.choices((0, 1, 2, 3, 4), weights=(30, 35, 20, 10, 5), k=1)[0]
+        return list(dict.fromkeys(self.rng.choices(TAG_NAMES, weights=self.tag_weights, k=count)))
+
+    def _notes(self) -> str:
+        if self.rng.random() < NO_NOTES:
+            return ''
+        # mediana ~120 caracteres, cauda até alguns KB
+        length = min(int(self.rng.lognormvariate(4.8, 0.9)), 4000)
+        text = []
+        while sum(len(s) + 1 for s in text) < length:
+            text.append(self.rng.choice(NOTE_SENTENCES))
+        return ' '.join(text)[:length]
+
+    def lead(self, index: int) -> tuple[Lead, list[str]]:
+        """O `index` entra no email: índices distintos nunca violam (email, company)."""
+        rng = self.rng
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        company = f'{rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_SUFFIXES)}'.strip()
+        if rng.random() < NO_EMAIL:
+            email = ''
+        else:
+            domain = (
+                rng.choice(FREE_DOMAINS) if rng.random() < 0.5 else ''.join(words(company)[:2]) + '.com.br'
+            )
+            email = strip_accents(f'{first}.{last}{index}@{domain}').lower()
+        # mais leads recentes: idade em dias ~ exponencial, limitada a `days`
+        age = min(rng.expovariate(3 / self.days), self.days) if self.days else 0
+        lead = Lead(
+            name=f'{first} {last}',
+            email=email,
+            phone=f'({rng.randint(11, 99)}) 9{rng.randint(0, 99999999):08d}' if rng.random() < 0.8 else '',
+            company=company,
+            status=_weighted(rng, STATUS_WEIGHTS),
+            source=_weighted(rng, SOURCE_WEIGHTS),
+            owner_id=self._owner_id(),
+            value=Decimal(int(rng.lognormvariate(8, 1.2))).quantize(Decimal('0.01')),
+            notes=self._notes(),
+            created_at=self.now - timedelta(days=age),
+        )
+        return lead, self._tags()
+
+    def leads(self, count: int, start: int = 0) -> Iterator[tuple[Lead, list[str]]]:
+        for index in range(start, start + count):
+            yield self.lead(index)
+
+
+def seed_owners(count: int, prefix: str = 'seed-owner') -> list[int]:
+    """Cria (ou reaproveita) `count` usuários owner; devolve os ids."""
+    User = get_user_model()
+    names = [f'{prefix}-{i}' for i in range(count)]
+    existing = set(User.objects.filter(username__in=names).values_list('username', flat=True))
+    User.objects.bulk_create([User(username=name) for name in names if name not in existing])
+    ids = dict(User.objects.filter(username__in=names).values_list('username', 'id'))
+    return [ids[name] for name in names]
+
+
+@dataclass
+class SeedResult:
+    created: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.created / self.elapsed if self.elapsed else 0.0
+
+
+def seed_leads(
+    count: int, owners: int = 20, seed: int = 42, days: int = 365, chunk_size: int = 5000,
+    generator: Optional[LeadGenerator] = None,
+) -> SeedResult:
+    """Grava `count` leads sintéticos, um bloco por transação."""
+    started = time.perf_counter()
+    generator = generator or LeadGenerator(owner_ids=seed_owners(owners), seed=seed, days=days)
+    # índices a partir do maior id: rodar de novo não repete emails
+    start = (Lead.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+    tag_cache = TagCache()
+    result = SeedResult()
+    for rows in chunked(generator.leads(count, start), chunk_size):
+        with transaction.atomic():
+            # created_at espalhado = milhares de grupos no rollup: recalculado uma vez no fim
+            insert_leads(rows, tag_cache, update_rollup=False)
+        result.created += len(rows)
+    rollup.rebuild()
+    result.elapsed = time.perf_counter() - started
+    return result
@@ -0,0 +1,94 @@
+import hashlib
+
+from django import template
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.html import format_html_join
+from django.utils.safestring import mark_safe
+
+from leads import cache as leads_cache
+from leads import metrics
+from leads.models import Tag
+
+register = template.Library()
+
+# incrementar ao alterar leads/_lead_row.html (descarta as linhas já em cache)
+ROW_TEMPLATE_VERSION = 2
+
+# as opções só mudam quando Tag/usuários mudam (versão invalidada por signals)
+OPTIONS_TIMEOUT = 60 * 60 * 24
+
+
+def _cached_options(namespace: str, build) -> str:
+    key = leads_cache.versioned_key(namespace, 'options')
+    html = cache.get(key)
+    metrics.cache_lookup('options', hits=html is not None, misses=html is None)
+    if html is None:
+        html = str(build())
+        cache.set(key, html, OPTIONS_TIMEOUT)
+    return html
+
+
+def _mark_selected(html: str, selected) -> str:
+    # valores são ids numéricos: marca a opção selecionada sem re-renderizar a lista
+    selected = str(selected or '')
+    if selected.isdigit():
+        html = html.replace(f'<option value="{selected}">', f'<option value="{selected}" selected>', 1)
+    return mark_safe(html)
+
+
+@register.simple_tag
+def tag_options(selected=None):
+    html = _cached_options(leads_cache.TAGS, lambda: format_html_join(
+        '\n', '<option value="{}">{}</option>', Tag.objects.order_by('name').values_list('id', 'name')
+    ))
+    return _mark_selected(html, selected)
+
+
+@register.simple_tag
+def owner_options(selected=None):
+    User = get_user_model()
+    html = _cached_options(leads_cache.OWNERS, lambda: format_html_join(
+        '\n', '<option value="{}">{}</option>',
+        User.objects.order_by(User.USERNAME_FIELD).values_list('id', User.USERNAME_FIELD),
+    ))
+    return _mark_selected(html, selected)
+
+
+def row_cache_key(lead) -> str:
+    """
+    Chave do HTML de uma linha: id + update_at, mais o que a linha mostra de
+    outras tabelas (tags e owner). Como tags/owner já vêm do prefetch/select_related,
+    trocar tags do lead ou renomear tag/owner gera outra chave sem consulta extra.
+    """
+    tags = '\x1f'.join(t.name for t in lead.tags.all())
+    owner = lead.owner.get_username() if lead.owner_id else ''
+    digest = hashlib.md5(f'{tags}\x1e{owner}'.encode(), usedforsecurity=False).hexdigest()
+    return f'leads:row:{ROW_TEMPLATE_VERSION}:{lead.pk}:{lead.update_at.timestamp()}:{digest}'
+
+
+def render_lead_row(lead) -> str:
+    return render_to_string('leads/_lead_row.html', {'lead': lead})
+
+
+@register.simple_tag
+def lead_rows(leads):
+    """Renderiza as linhas da tabela: um get_many no cache, só os leads alterados são renderizados."""
+    leads = list(leads)
+    timeout = settings.LEADS_ROW_CACHE_TIMEOUT
+    if not timeout:
+        return mark_safe(''.join(render_lead_row(lead) for lead in leads))
+
+    keys = [row_cache_key(lead) for lead in leads]
+    cached = cache.get_many(keys)
+    missing = {}
+    for key, lead in zip(keys, leads):
+        if key not in cached:
+            missing[key] = render_lead_row(lead)
+    metrics.cache_lookup('rows', hits=len(cached), misses=len(missing))
+    if missing:
+        cache.set_many(missing, timeout)
+        cached.update(missing)
+    return mark_safe(''.join(cached[key] for key in keys))
@@ -1,15 +1,66 @@
-from django.test import TestCase, Client, override_settings
+import base64
+import gzip
+import io
+import json
+import re
+import shutil
+import smtplib
+import socket
+import tempfile
+from datetime import timedelta
+from itertools import combinations
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import AsyncRequestFactory, TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core import mail
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.checks import run_checks
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.utils import timezone
+
+from .bulk import TagCache, bulk_add_tags, insert_leads
+from .dedupe import find_duplicates
+from .filters import LeadFilters
+from .forms import CSVImportForm
+from .importer import LeadImporter
+from . import mailers, metrics, pgcopy
+from .models import EmailOutbox, ImportJob, Lead, PipelineRollup, Tag
+from .outbox import dispatch_batch, enqueue_mail
+from .pagination import encode_cursor
+from .profiling import QueryBudgetMixin, RequestProfile
+from .synthetic import LeadGenerator
+from .views import AsyncLeadListView
+from . import rollup
+
+MEDIA_ROOT = tempfile.mkdtemp()
+# cache próprio dos testes: o padrão (FileBasedCache em /tmp) é o mesmo diretório do portal
+# rodando na máquina, e os cache.clear() dos testes apagariam sessões e versões de produção
+TEST_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "leads-tests"}}
+
 
-from .models import Lead, Tag
+def tearDownModule():
+    shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
 
 
-@override_settings(EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend")
-class LeadPortalTests(TestCase):
+@override_settings(
+    CACHES=TEST_CACHES,
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    MEDIA_ROOT=MEDIA_ROOT,
+)
+class LeadPortalTests(QueryBudgetMixin, TestCase):
     def setUp(self):
+        cache.clear()
         User = get_user_model()
         self.user = User.objects.create_user(
             username="tester", password="pass1234", email="tester@example.com"
@@ -96,6 +147,534 @@ class LeadPortalTests(TestCase):
         self.assertIn("Alice", content)
         self.assertIn("Bob", content)
 
+    def test_export_ndjson_gzip_and_field_selection(self):
+        url = reverse("leads:list")
+        resp = self.client.get(url, {"format": "ndjson", "tag": str(self.tag_hot.pk)})
+        self.assertEqual(resp["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(resp.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]["email"], "alice@acme.com")
+        self.assertEqual((rows[0]["status"], rows[0]["tags"], rows[0]["value"]), ("NEW", ["Hot"], "1000.00"))
+
+        # arquivo .gz: o conteúdo é o mesmo CSV
+        resp = self.client.get(url, {"format": "csv.gz"})
+        self.assertEqual(resp["Content-Type"], "application/gzip")
+        self.assertIn("leads.csv.gz", resp["Content-Disposition"])
+        self.assertFalse(resp.has_header("Content-Encoding"))
+        content = gzip.decompress(b"".join(resp.streaming_content)).decode("utf-8-sig")
+        self.assertIn("Alice,alice@acme.com,1111,Acme,Novo,Website,tester,1000.00,Hot", content)
+
+        # CSV comprimido no transporte só quando o cliente aceita gzip
+        resp = self.client.get(url, {"format": "csv"}, headers={"Accept-Encoding": "gzip, br"})
+        self.assertEqual(resp["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp["Vary"])
+        self.assertEqual(gzip.decompress(b"".join(resp.streaming_content)).decode("utf-8-sig"), content)
+        plain = self.client.get(url, {"format": "csv"})
+        self.assertNotEqual(plain["ETag"], resp["ETag"])
+
+        # subconjunto de colunas: notes nem sai do banco
+        resp = self.client.get(url, {"format": "csv", "fields": "email,name,bogus"})
+        with CaptureQueriesContext(connection) as ctx:
+            content = b"".join(resp.streaming_content).decode("utf-8-sig")
+        self.assertEqual(content.splitlines()[0], "name,email")
+        self.assertIn("Alice,alice@acme.com", content)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertNotIn("notes", ctx.captured_queries[0]["sql"])
+
+    async def test_async_list_view_streams_export_from_aiterator(self):
+        async def auser():
+            return self.user
+
+        def request(params, **headers):
+            req = AsyncRequestFactory().get(reverse("leads:list"), params, headers=headers)
+            req.user, req.auser = self.user, auser
+            return req
+
+        view = AsyncLeadListView.as_view()
+        self.assertTrue(AsyncLeadListView.view_is_async)
+        resp = await view(request({"format": "csv", "tag": str(self.tag_hot.pk)}))
+        self.assertTrue(resp.is_async)
+        content = b"".join([block async for block in resp.streaming_content]).decode("utf-8-sig")
+        self.assertEqual(content.splitlines()[1], "Alice,alice@acme.com,1111,Acme,Novo,Website,tester,1000.00,Hot,Primeiro contato,"
+                         f"{self.lead1.created_at:%Y-%m-%d %H:%M:%S}")
+        self.assertEqual(len(content.splitlines()), 2)
+
+        resp = await view(request({"format": "ndjson.gz"}, **{"If-None-Match": resp["ETag"]}))
+        self.assertEqual(resp.status_code, 200)
+        rows = gzip.decompress(b"".join([block async for block in resp.streaming_content])).splitlines()
+        self.assertEqual(len(rows), 2)
+        resp = await view(request({"format": "ndjson.gz"}, **{"If-None-Match": resp["ETag"]}))
+        self.assertEqual(resp.status_code, 304)
+
+        # página HTML: a view síncrona roda numa thread
+        resp = await view(request({}))
+        await sync_to_async(resp.render)()
+        self.assertContains(resp, "Bob")
+
+        anonymous = request({})
+        anonymous.auser = sync_to_async(AnonymousUser)
+        resp = await view(anonymous)
+        self.assertEqual(resp.status_code, 302)
+
+    @override_settings(DEBUG=True)
+    def test_asgi_middleware_chain_stays_async(self):
+        # o Django registra em debug cada middleware que precisou ser adaptado (sync_to_async)
+        with mock.patch("django.core.handlers.base.logger") as logger:
+            ASGIHandler()
+        adapted = [call.args for call in logger.debug.call_args_list if "adapted" in call.args[0]]
+        self.assertEqual(adapted, [])
+
+    @override_settings(WHITENOISE_USE_FINDERS=True)
+    async def test_static_files_served_by_async_middleware(self):
+        resp = await self.async_client.get("/static/admin/css/base.css")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.is_async)
+        body = b"".join([chunk async for chunk in resp.streaming_content])
+        self.assertEqual(len(body), int(resp["Content-Length"]))
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_export_csv_fixed_queries_per_chunk(self):
+        tag_cold = Tag.objects.create(name="Cold")
+        for i in range(3):
+            lead = Lead.objects.create(name=f"Extra {i}", email=f"x{i}@ex.com", company="X", owner=self.user)
+            lead.tags.add(self.tag_hot, tag_cold)
+
+        resp = self.client.get(reverse("leads:list"), {"format": "csv"})
+        # 5 leads em blocos de 2 => 1 SELECT de leads (com owner via join) + 1 SELECT de tags por bloco
+        with self.assertNumQueries(1 + 3):
+            content = b"".join(resp.streaming_content).decode("utf-8-sig")
+
+        self.assertIn("Extra 2,x2@ex.com,,X,Novo,Outro,tester,0.00,\"Cold, Hot\"", content)
+        self.assertIn("Alice,alice@acme.com,1111,Acme,Novo,Website,tester,1000.00,Hot", content)
+
+    def test_status_and_source_options_in_both_pagination_modes(self):
+        for mode in ("offset", "keyset"):
+            with override_settings(LEADS_PAGINATION=mode):
+                resp = self.client.get(reverse("leads:list"), {"status": "QLF"})
+            self.assertContains(resp, '<option value="QLF" selected>Qualidade</option>', html=True)
+            self.assertContains(resp, '<option value="REF" >Indicação</option>', html=True)
+            # select de status das ações em lote
+            self.assertContains(resp, '<option value="LST">Perdido</option>', count=2, html=True)
+
+    @override_settings(LEADS_PAGINATION="keyset")
+    def test_keyset_pagination(self):
+        for i in range(25):
+            Lead.objects.create(name=f"Page {i}", company="P", status=Lead.Status.NEW)
+        expected = list(
+            Lead.objects.filter(status=Lead.Status.NEW).order_by("-created_at", "-id").values_list("pk", flat=True)
+        )
+        self.assertEqual(len(expected), 26)
+
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(reverse("leads:list"), {"status": Lead.Status.NEW})
+        self.assertFalse([q for q in ctx.captured_queries if "COUNT(" in q["sql"]])
+        page = resp.context["page_obj"]
+        self.assertEqual([l.pk for l in page], expected[:20])
+        self.assertFalse(page.has_previous())
+        # links preservam os filtros do formulário HTMX
+        self.assertContains(resp, f"?status=NEW&amp;cursor={page.next_cursor}")
+
+        resp = self.client.get(reverse("leads:list"), {"status": Lead.Status.NEW, "cursor": page.next_cursor})
+        page2 = resp.context["page_obj"]
+        self.assertEqual([l.pk for l in page2], expected[20:])
+        self.assertFalse(page2.has_next())
+        self.assertTrue(page2.has_previous())
+
+        resp = self.client.get(reverse("leads:list"), {"status": Lead.Status.NEW, "cursor": page2.previous_cursor})
+        self.assertEqual([l.pk for l in resp.context["page_obj"]], expected[:20])
+
+        resp = self.client.get(reverse("leads:list"), {"cursor": "invalido"})
+        self.assertEqual(resp.status_code, 404)
+        # pk além do INTEGER do banco: cursor inválido como os demais, não OverflowError
+        forged = encode_cursor(timezone.now(), 10 ** 23, "n")
+        self.assertEqual(self.client.get(reverse("leads:list"), {"cursor": forged}).status_code, 404)
+
+    def _search(self, q):
+        resp = self.client.get(reverse("leads:list"), {"q": q})
+        return [l.name for l in resp.context["leads"]]
+
+    def test_fulltext_search_prefix_terms_and_sync(self):
+        self.assertEqual(self._search("ali"), ["Alice"])
+        self.assertEqual(self._search("acme.com"), ["Alice"])
+        self.assertEqual(self._search("1111"), ["Alice"])
+        self.assertEqual(self._search("primeiro contato"), ["Alice"])
+        self.assertEqual(self._search("primeiro bob"), [])
+
+        # mantido em sincronia em update, delete e inserts em lote
+        self.lead2.notes = "Reunião marcada"
+        self.lead2.save()
+        self.assertEqual(self._search("reunião"), ["Bob"])
+        self.lead1.delete()
+        self.assertEqual(self._search("ali"), [])
+        csv_content = "name,email,company\nZeca,zeca@zulu.com,Zulu\n"
+        LeadImporter().run(SimpleUploadedFile("leads.csv", csv_content.encode("utf-8")))
+        self.assertEqual(self._search("zul"), ["Zeca"])
+
+    def test_fulltext_search_ranks_by_relevance(self):
+        Lead.objects.create(name="Carol", company="Outra", notes="acme citada nas notas")
+        # Alice casa no nome da empresa (peso maior) e vem antes, mesmo sendo mais antiga
+        self.assertEqual(self._search("acme"), ["Alice", "Carol"])
+
+    @override_settings(LEADS_SEARCH_BACKEND="icontains")
+    def test_icontains_search_backend(self):
+        self.assertEqual(self._search("lic"), ["Alice"])
+
+    def _count_queries(self, params):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(reverse("leads:list"), params)
+        return resp, [q for q in ctx.captured_queries if "COUNT(" in q["sql"]]
+
+    def test_count_cache_per_filter_signature_and_invalidation(self):
+        resp, counts = self._count_queries({"status": Lead.Status.NEW, "q": "Acme"})
+        self.assertEqual(len(counts), 1)
+        self.assertEqual(resp.context["paginator"].count, 1)
+
+        # mesmo filtro normalizado (caixa/espaços em q): sem COUNT
+        resp, counts = self._count_queries({"status": Lead.Status.NEW, "q": "  acme "})
+        self.assertEqual(counts, [])
+        self.assertEqual(resp.context["paginator"].count, 1)
+
+        # save de lead invalida
+        Lead.objects.create(name="Acme 2", company="Acme", status=Lead.Status.NEW)
+        resp, counts = self._count_queries({"status": Lead.Status.NEW, "q": "acme"})
+        self.assertEqual(len(counts), 1)
+        self.assertEqual(resp.context["paginator"].count, 2)
+
+        # mudança de tags (M2M) invalida
+        self._count_queries({"tag": str(self.tag_hot.pk)})
+        self.lead2.tags.add(self.tag_hot)
+        resp, counts = self._count_queries({"tag": str(self.tag_hot.pk)})
+        self.assertEqual(len(counts), 1)
+        self.assertEqual(resp.context["paginator"].count, 2)
+
+        # delete invalida
+        self.lead2.delete()
+        resp, counts = self._count_queries({"tag": str(self.tag_hot.pk)})
+        self.assertEqual(resp.context["paginator"].count, 1)
+
+    def test_filter_signature_follows_search_backend(self):
+        spaced, single = LeadFilters(q="ana  silva"), LeadFilters(q="Ana silva")
+        self.assertEqual(spaced.signature(), single.signature())
+        # icontains compara o texto inteiro: espaços diferentes casam linhas diferentes
+        with override_settings(LEADS_SEARCH_BACKEND="icontains"):
+            self.assertNotEqual(spaced.signature(), single.signature())
+
+    def test_invalid_tag_and_owner_ids_filter_nothing(self):
+        for params in ({"tag": "²"}, {"owner": "99999999999999999999"}, {"owner": "-1"}, {"tag": "abc"}):
+            resp = self.client.get(reverse("leads:list"), params)
+            self.assertEqual(resp.status_code, 200, params)
+            self.assertEqual(list(resp.context["leads"]), [], params)
+
+    @override_settings(LEADS_APPROX_COUNT_THRESHOLD=1000)
+    def test_approximate_count_is_marked_in_paginator(self):
+        Lead.objects.bulk_create([Lead(name=f"N{i}", company="N") for i in range(25)])
+        with mock.patch("leads.pagination.estimate_count", return_value=150000):
+            resp = self.client.get(reverse("leads:list"))
+        self.assertTrue(resp.context["paginator"].is_estimated)
+        self.assertContains(resp, "de ~7500")
+        self.assertContains(resp, "~150000 leads")
+
+    def _dropdown_queries(self, params=None):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(reverse("leads:list"), params or {})
+        sqls = [q["sql"] for q in ctx.captured_queries]
+        options = [
+            sql for sql in sqls
+            if ('FROM "leads_tag"' in sql and "JOIN" not in sql) or ('FROM "auth_user" ORDER BY' in sql)
+        ]
+        return resp, options
+
+    def test_filter_dropdowns_are_cached_fragments(self):
+        resp, queries = self._dropdown_queries({"tag": str(self.tag_hot.pk)})
+        self.assertEqual(len(queries), 2)
+        self.assertContains(resp, f'<option value="{self.tag_hot.pk}" selected>Hot</option>', html=False)
+
+        # requisição "quente": zero queries para os dropdowns, seleção ainda aplicada
+        resp, queries = self._dropdown_queries({"owner": str(self.user.pk)})
+        self.assertEqual(queries, [])
+        self.assertContains(resp, f'<option value="{self.user.pk}" selected>tester</option>', html=False)
+        self.assertContains(resp, f'<option value="{self.tag_hot.pk}">Hot</option>', html=False)
+
+        # login (só last_login) não invalida; alterações em Tag e usuários sim
+        self.client.login(username="tester", password="pass1234")
+        _, queries = self._dropdown_queries()
+        self.assertEqual(queries, [])
+
+        self.tag_hot.name = "Quente"
+        self.tag_hot.save()
+        get_user_model().objects.create_user(username="zoe")
+        resp, queries = self._dropdown_queries()
+        self.assertEqual(len(queries), 2)
+        self.assertContains(resp, ">Quente</option>")
+        self.assertContains(resp, ">zoe</option>")
+
+    def test_lead_rows_are_cached_until_the_row_changes(self):
+        from .templatetags import leads_extras
+
+        url = reverse("leads:list")
+        with mock.patch.object(leads_extras, "render_lead_row", wraps=leads_extras.render_lead_row) as render:
+            self.client.get(url)
+            self.assertEqual(render.call_count, 2)
+
+            render.reset_mock()
+            resp = self.client.get(url)
+            self.assertEqual(render.call_count, 0)
+            self.assertContains(resp, 'id="row-%d"' % self.lead1.pk)
+
+            # só a linha alterada é renderizada de novo
+            self.lead2.name = "Roberto"
+            self.lead2.save()
+            render.reset_mock()
+            resp = self.client.get(url)
+            self.assertEqual([c.args[0].pk for c in render.call_args_list], [self.lead2.pk])
+            self.assertContains(resp, "Roberto")
+
+        # tags (M2M) e owner aparecem na linha: mudanças neles também renovam o HTML
+        self.tag_hot.name = "Quente"
+        self.tag_hot.save()
+        self.user.username = "vendedor"
+        self.user.save()
+        resp = self.client.get(url)
+        self.assertContains(resp, ">Quente</span>")
+        self.assertContains(resp, "<td>vendedor</td>", html=False)
+        self.lead1.tags.clear()
+        resp = self.client.get(url)
+        self.assertNotContains(resp, ">Quente</span>")
+
+    def test_htmx_list_request_renders_only_the_table(self):
+        url = reverse("leads:list")
+        full = self.client.get(url, {"q": "alice"})
+        self.assertContains(full, 'id="filters-form"')
+        self.assertIn("HX-Request", full["Vary"])
+
+        partial = self.client.get(url, {"q": "alice"}, headers={"HX-Request": "true"})
+        self.assertTemplateUsed(partial, "leads/_lead_table.html")
+        self.assertTemplateNotUsed(partial, "leads/lead_list.html")
+        self.assertNotContains(partial, 'id="filters-form"')
+        self.assertNotContains(partial, 'class="modal fade"')
+        self.assertContains(partial, "Alice")
+        self.assertNotContains(partial, "Bob")
+        self.assertIn("HX-Request", partial["Vary"])
+        self.assertLess(len(partial.content), len(full.content) / 2)
+
+        restore = self.client.get(url, headers={"HX-Request": "true", "HX-History-Restore-Request": "true"})
+        self.assertContains(restore, 'id="filters-form"')
+
+    def test_conditional_get_on_list_and_export(self):
+        url = reverse("leads:list")
+        csv_params = {"format": "csv", "tag": str(self.tag_hot.pk)}
+        resp = self.client.get(url, csv_params)
+        b"".join(resp.streaming_content)
+        etag, last_modified = resp["ETag"], resp["Last-Modified"]
+
+        # validador em cache: 304 sem nenhuma consulta em leads_lead
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(url, csv_params, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp["ETag"], etag)
+        self.assertFalse([q for q in ctx.captured_queries if "leads_lead" in q["sql"]])
+        resp = self.client.get(url, csv_params, headers={"If-Modified-Since": last_modified})
+        self.assertEqual(resp.status_code, 304)
+
+        def changed():
+            resp = self.client.get(url, csv_params, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            b"".join(resp.streaming_content)
+            return resp["ETag"]
+
+        # M2M, renomear tag e delete mudam a ETag (delete sem mudar max(update_at))
+        self.lead2.tags.add(self.tag_hot)
+        etag = changed()
+        self.tag_hot.name = "Quente"
+        self.tag_hot.save()
+        etag = changed()
+        self.lead1.delete()
+        changed()
+
+        # lista HTML: ETag própria, distinta entre página inteira e parcial HTMX
+        self.client.get(url)  # recebe o cookie CSRF, que entra na ETag do HTML
+        page = self.client.get(url)
+        partial = self.client.get(url, headers={"HX-Request": "true"})
+        self.assertNotEqual(page["ETag"], partial["ETag"])
+        resp = self.client.get(url, headers={"If-None-Match": page["ETag"]})
+        self.assertEqual(resp.status_code, 304)
+        self.assertIn("HX-Request", resp["Vary"])
+        Lead.objects.create(name="Nova", company="N")
+        resp = self.client.get(url, headers={"If-None-Match": page["ETag"]})
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, "Nova")
+
+    def test_pipeline_rollup_is_maintained_incrementally(self):
+        def check():
+            self.assertEqual(rollup.rebuild(dry_run=True), [])
+
+        check()
+        other = get_user_model().objects.create_user(username="outro")
+        # transições de status, owner e valor (instância desatualizada não engana o rollup)
+        stale = Lead.objects.get(pk=self.lead1.pk)
+        self.lead1.status = Lead.Status.WON
+        self.lead1.save()
+        stale.owner = other
+        stale.value = 5000
+        stale.save()
+        check()
+
+        csv_content = "name,email,company,value\nZeca,zeca@zulu.com,Zulu,10\nYara,yara@y.com,Y,20\n"
+        LeadImporter(owner=other).run(SimpleUploadedFile("leads.csv", csv_content.encode("utf-8")))
+        check()
+
+        self.lead2.delete()
+        other.delete()  # SET_NULL nos leads do owner removido
+        check()
+        row = PipelineRollup.objects.get(owner=None, status=Lead.Status.NEW, source=Lead.Source.WEBSITE)
+        self.assertEqual((row.lead_count, row.total_value), (1, 5000))
+
+        # divergência é detectada e corrigida pelo comando
+        PipelineRollup.objects.update(lead_count=99)
+        with self.assertRaises(CommandError):
+            call_command("rebuild_rollup", check=True, stdout=io.StringIO())
+        call_command("rebuild_rollup", stdout=io.StringIO())
+        check()
+
+    def test_dashboard_reads_only_the_rollup(self):
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(reverse("leads:dashboard"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse([q for q in ctx.captured_queries if '"leads_lead"' in q["sql"]])
+        totals = resp.context["totals"]
+        self.assertEqual(totals["overall"], {"leads": 2, "value": 3000})
+        self.assertEqual(
+            {r["label"]: r["leads"] for r in totals["by_status"]}, {"Novo": 1, "Qualidade": 1}
+        )
+        self.assertEqual(totals["by_day"][-1]["leads"], 2)
+        self.assertContains(resp, "R$ 3000,00")
+
+    def test_import_normalizes_choices_and_dashboard_tolerates_unknown_codes(self):
+        csv_content = (
+            "name,email,phone,company,status,source,value,notes,tags\n"
+            "Um,um@ex.com,,C,won,web,,,\n"
+            "Dois,dois@ex.com,,C,Ganho,indicacao,,,\n"
+            "Tres,tres@ex.com,,C,xyz,WEB,,,\n"
+        )
+        result = LeadImporter(owner=self.user).run(io.BytesIO(csv_content.encode()))
+        self.assertEqual(result.created, 2)
+        self.assertEqual(result.errors, ["Linha 4: status desconhecido: 'xyz'"])
+        self.assertEqual(
+            set(Lead.objects.filter(company="C").values_list("status", "source")),
+            {(Lead.Status.WON, Lead.Source.WEBSITE), (Lead.Status.WON, Lead.Source.REFERRAL)},
+        )
+
+        # código gravado por fora das choices: o painel mostra o próprio código
+        Lead.objects.filter(pk=self.lead1.pk).update(status="ZZZ")
+        rollup.rebuild()
+        resp = self.client.get(reverse("leads:dashboard"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("ZZZ", [r["label"] for r in resp.context["totals"]["by_status"]])
+
+    def _api_post(self, lines, **headers):
+        body = "\n".join(l if isinstance(l, str) else json.dumps(l) for l in lines)
+        return self.client.post(reverse("leads:api_leads"), body, content_type="application/x-ndjson", **headers)
+
+    def test_api_bulk_upsert_ndjson(self):
+        resp = self._api_post([
+            {"name": "Alice Souza", "email": "alice@acme.com", "company": "Acme", "status": "QLF", "tags": ["VIP"]},
+            {"name": "Nova", "email": "nova@n.com", "company": "N", "value": 12.5, "tags": "a, b"},
+            {"name": "Nova 2", "email": "nova@n.com", "company": "N", "value": "7"},
+            {"name": "Sem email"},
+            {"name": "Ruim", "status": "XXX"},
+            "{quebrado",
+            "",
+            {"email": "sem-nome@x.com"},
+        ])
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual((data["created"], data["updated"], data["rows"]), (2, 1, 7))
+        self.assertEqual([e["line"] for e in data["errors"]], [5, 6, 8])
+        self.assertIn("status", data["errors"][0]["error"])
+
+        self.lead1.refresh_from_db()
+        # só os campos enviados mudam; tags enviadas substituem as atuais
+        self.assertEqual((self.lead1.name, self.lead1.status, self.lead1.phone), ("Alice Souza", "QLF", "1111"))
+        self.assertEqual([t.name for t in self.lead1.tags.all()], ["VIP"])
+        nova = Lead.objects.get(email="nova@n.com")
+        self.assertEqual((nova.name, nova.value, nova.owner), ("Nova 2", 7, self.user))
+        self.assertEqual(nova.tags.count(), 0)
+        self.assertEqual(rollup.rebuild(dry_run=True), [])
+
+    def test_api_auth_and_ndjson_listing(self):
+        url = reverse("leads:api_leads")
+        self.assertEqual(Client().get(url).status_code, 401)
+        # sessão sem token CSRF não pode fazer POST
+        csrf_client = Client(enforce_csrf_checks=True)
+        csrf_client.login(username="tester", password="pass1234")
+        self.assertEqual(csrf_client.post(url, "{}", content_type="application/x-ndjson").status_code, 403)
+
+        basic = "Basic " + base64.b64encode(b"tester:pass1234").decode()
+        resp = Client(enforce_csrf_checks=True).get(url, {"tag": str(self.tag_hot.pk)}, HTTP_AUTHORIZATION=basic)
+        self.assertEqual(resp["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(resp.streaming_content).splitlines()]
+        self.assertEqual([(r["name"], r["tags"], r["owner"], r["value"]) for r in rows],
+                         [("Alice", ["Hot"], "tester", "1000.00")])
+
+        resp = self.client.get(url, {"status": "QLF"}, headers={"If-None-Match": resp["ETag"]})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([json.loads(l)["name"] for l in b"".join(resp.streaming_content).splitlines()], ["Bob"])
+        resp = self.client.get(url, {"status": "QLF"}, headers={"If-None-Match": resp["ETag"]})
+        self.assertEqual(resp.status_code, 304)
+
+        bad = "Basic " + base64.b64encode(b"tester:errada").decode()
+        self.assertEqual(Client().get(url, HTTP_AUTHORIZATION=bad).status_code, 401)
+
+    def _bulk(self, **data):
+        return self.client.post(reverse("leads:bulk"), data)
+
+    def test_bulk_actions_are_set_based(self):
+        extra = insert_leads([(Lead(name=f"Lote {i}", company="L", owner=self.user), []) for i in range(30)], TagCache())
+        ids = [l.pk for l in extra]
+        before = Lead.objects.get(pk=ids[0]).update_at
+        self._bulk(action="status", scope="selected", ids=ids[:1], set_status="WON")
+
+        # mesmo número de queries para 2 ou 29 leads (o rollup custa por grupo, não por lead)
+        with CaptureQueriesContext(connection) as few:
+            self._bulk(action="status", scope="selected", ids=ids[1:3], set_status="WON")
+        with CaptureQueriesContext(connection) as many:
+            resp = self._bulk(action="status", scope="selected", ids=ids[3:], set_status="WON")
+        self.assertEqual(len(few), len(many))
+        self.assertRedirects(resp, reverse("leads:list"), fetch_redirect_response=False)
+        self.assertEqual(Lead.objects.filter(status="WON").count(), 30)
+        self.assertGreater(Lead.objects.get(pk=ids[0]).update_at, before)
+
+        # escopo "filtro atual": status=WON (sem ids marcados); volta para a lista filtrada
+        other = get_user_model().objects.create_user(username="outro")
+        resp = self._bulk(action="owner", scope="filtered", status="WON", set_owner=other.pk)
+        self.assertRedirects(resp, reverse("leads:list") + "?status=WON", fetch_redirect_response=False)
+        self.assertEqual(Lead.objects.filter(owner=other).count(), 30)
+
+        self._bulk(action="add_tag", scope="filtered", owner=other.pk, set_tag=self.tag_hot.pk)
+        self._bulk(action="add_tag", scope="selected", ids=ids[:5], set_tag=self.tag_hot.pk)  # sem duplicar
+        self.assertEqual(self.tag_hot.lead_set.count(), 31)
+        self._bulk(action="remove_tag", scope="selected", ids=ids[:10], set_tag=self.tag_hot.pk)
+        self.assertEqual(self.tag_hot.lead_set.count(), 21)
+
+        resp = self._bulk(action="delete", scope="filtered", q="lote", tag=self.tag_hot.pk)
+        self.assertEqual(Lead.objects.filter(name__startswith="Lote").count(), 10)
+        self.assertEqual(self.tag_hot.lead_set.count(), 1)
+        self.assertEqual(self._search("lote"), [f"Lote {i}" for i in reversed(range(10))])
+        self.assertEqual(self.client.get(reverse("leads:list")).context["paginator"].count, 12)
+        self.assertEqual(rollup.rebuild(dry_run=True), [])
+
+        # sem tags: nenhum INSERT com "IN ()"
+        self.assertEqual(bulk_add_tags(Lead.objects.all(), []), 0)
+
+        # sem seleção: nada muda
+        resp = self._bulk(action="delete", scope="selected")
+        self.assertEqual(Lead.objects.count(), 12)
+        # id fora do intervalo do banco: erro de validação, não 500
+        for bad in ["99999999999999999999999", "abc", "-1"]:
+            resp = self._bulk(action="delete", scope="selected", ids=[ids[10], bad])
+            self.assertRedirects(resp, reverse("leads:list"), fetch_redirect_response=False)
+        self.assertEqual(Lead.objects.count(), 12)
+
     def test_create_sends_email_and_persists(self):
         data = {
             "name": "Carol",
@@ -112,9 +691,17 @@ class LeadPortalTests(TestCase):
         resp = self.client.post(reverse("leads:create"), data, follow=True)
         self.assertEqual(resp.status_code, 200)
         self.assertTrue(Lead.objects.filter(name="Carol", company="Corp").exists())
+        # o request só grava na outbox; nada de SMTP no caminho da criação
+        self.assertEqual(len(mail.outbox), 0)
+        item = EmailOutbox.objects.get()
+        self.assertEqual(item.to, ["tester@example.com"])
+
+        call_command("dispatch_outbox", once=True, stdout=io.StringIO())
         # e-mail enviado (locmem backend)
         self.assertEqual(len(mail.outbox), 1)
         self.assertIn("Novo Lead: Carol", mail.outbox[0].subject)
+        item.refresh_from_db()
+        self.assertEqual(item.status, EmailOutbox.Status.SENT)
 
     def test_update_and_delete(self):
         lead = self.lead2
@@ -154,5 +741,665 @@ class LeadPortalTests(TestCase):
         file = SimpleUploadedFile("leads.csv", csv_content.encode("utf-8"), content_type="text/csv")
         resp = self.client.post(reverse("leads:import"), {"file": file}, follow=True)
         self.assertEqual(resp.status_code, 200)
+        job = ImportJob.objects.get()
+        self.assertRedirects(resp, reverse("leads:import_job", args=[job.pk]))
+        # nada é importado dentro do request
+        self.assertFalse(Lead.objects.filter(name="Diego").exists())
+
+        call_command("process_imports", once=True, stdout=io.StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.Status.DONE)
+        self.assertEqual((job.row_cursor, job.total_rows, job.created_count), (2, 2, 2))
         self.assertTrue(Lead.objects.filter(name="Diego", company="Delta").exists())
-        self.assertTrue(Lead.objects.filter(name="Eva", company="Echo").exists())
\ No newline at end of file
+        self.assertTrue(Lead.objects.filter(name="Eva", company="Echo").exists())
+
+        resp = self.client.get(reverse("leads:import_progress", args=[job.pk]))
+        self.assertContains(resp, "Concluída")
+        self.assertNotContains(resp, "hx-trigger")
+
+    def test_import_csv_in_chunks_with_tag_cache(self):
+        rows = "".join(
+            f"Lead {i},lead{i}@ex.com,{i},Chunk,NEW,WEB,10,,\"Hot, Novo\"\n" for i in range(7)
+        )
+        csv_content = "name,email,phone,company,status,source,value,notes,tags\n" + rows
+        file = SimpleUploadedFile("leads.csv", csv_content.encode("utf-8"), content_type="text/csv")
+
+        with CaptureQueriesContext(connection) as ctx:
+            result = LeadImporter(owner=self.user, chunk_size=3).run(file)
+
+        self.assertEqual(result.created, 7)
+        self.assertEqual(result.rows, 7)
+        self.assertEqual(Lead.objects.filter(company="Chunk").count(), 7)
+        self.assertEqual(Tag.objects.filter(name__in=["Hot", "Novo"]).count(), 2)
+        self.assertEqual(self.tag_hot.lead_set.filter(company="Chunk").count(), 7)
+        # cada tag distinta é resolvida uma única vez, não por linha nem por bloco
+        tag_selects = [q for q in ctx.captured_queries if q["sql"].startswith('SELECT "leads_tag"')]
+        self.assertEqual(len(tag_selects), 2)
+        # um insert de leads e um de tags (M2M) por bloco
+        inserts = [q for q in ctx.captured_queries if q["sql"].startswith('INSERT INTO "leads_lead"')]
+        self.assertEqual(len(inserts), 3)
+        through = [q for q in ctx.captured_queries if q["sql"].startswith('INSERT INTO "leads_lead_tags"')]
+        self.assertEqual(len(through), 3)
+
+    def test_import_csv_isolates_invalid_rows(self):
+        csv_content = (
+            "\ufeffname,email,phone,company,status,source,value,notes,tags\n"
+            "Dup,alice@acme.com,1,Acme,NEW,WEB,1,,\n"
+            "Novo,novo@acme.com,2,Acme,NEW,WEB,1,,\n"
+        )
+        file = SimpleUploadedFile("leads.csv", csv_content.encode("utf-8"), content_type="text/csv")
+        result = LeadImporter(chunk_size=10).run(file)
+        self.assertEqual(result.created, 1)
+        self.assertEqual(len(result.errors), 1)
+        self.assertIn("Linha 2", result.errors[0])
+        self.assertTrue(Lead.objects.filter(email="novo@acme.com").exists())
+
+    def test_upsert_matches_email_case_insensitively_and_requires_company(self):
+        bia = Lead.objects.create(name="Bia", email="Bia@Beta.com", company=" Beta  Ltda")
+        self.assertEqual(bia.company, "Beta Ltda")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Lead.objects.create(name="Dup", email="BIA@BETA.COM", company="Beta Ltda")
+
+        upsert = "name,email,company\nBia CSV,bia@beta.com,Beta   Ltda\n"
+        result = LeadImporter(owner=self.user, mode=ImportJob.Mode.UPSERT).run(io.BytesIO(upsert.encode()))
+        self.assertEqual((result.created, result.updated), (0, 1))
+        data = self._api_post([
+            {"name": "Bia API", "email": "BIA@beta.com", "company": "Beta Ltda"},
+            {"name": "Sem empresa", "email": "bia@beta.com"},
+        ]).json()
+        self.assertEqual((data["created"], data["updated"]), (0, 1))
+        self.assertEqual([e["line"] for e in data["errors"]], [2])
+        self.assertEqual(list(Lead.objects.filter(company="Beta Ltda").values_list("name", flat=True)), ["Bia API"])
+
+        # sem a coluna company a chave seria (email, ''): o arquivo é recusado
+        no_company = b"name,email\nBia,bia@beta.com\n"
+        form = CSVImportForm(
+            data={"mode": ImportJob.Mode.UPSERT}, files={"file": SimpleUploadedFile("leads.csv", no_company)},
+        )
+        self.assertIn("company", form.errors["file"][0])
+        with self.assertRaisesMessage(ValueError, "company"):
+            LeadImporter(mode=ImportJob.Mode.UPSERT).run(io.BytesIO(no_company))
+
+    def test_import_upsert_mode_updates_existing_leads(self):
+        csv_content = (
+            "name,email,company,status,tags\n"
+            "Alice Souza,  ALICE@acme.com ,Acme,QLF,\"Novo\"\n"
+            "Carol,carol@gamma.com,Gamma  ,NEW,\n"
+            "Carol B,carol@gamma.com,Gamma,WON,\n"
+        )
+        job = ImportJob.objects.create(
+            file=SimpleUploadedFile("leads.csv", csv_content.encode("utf-8")),
+            owner=self.user,
+            mode=ImportJob.Mode.UPSERT,
+        )
+        call_command("process_imports", once=True, stdout=io.StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.Status.DONE)
+        self.assertEqual((job.created_count, job.updated_count, job.error_count), (1, 1, 0))
+        self.lead1.refresh_from_db()
+        self.assertEqual((self.lead1.name, self.lead1.status), ("Alice Souza", Lead.Status.QUALIFIED))
+        # colunas ausentes do CSV não são apagadas; a coluna tags substitui as tags
+        self.assertEqual((self.lead1.phone, self.lead1.value), ("1111", 1000))
+        self.assertEqual([t.name for t in self.lead1.tags.all()], ["Novo"])
+        # linhas repetidas no mesmo arquivo: vale a última
+        carol = Lead.objects.get(email="carol@gamma.com")
+        self.assertEqual((carol.name, carol.company, carol.status), ("Carol B", "Gamma", Lead.Status.WON))
+
+        # no modo criação a mesma chave (após normalizar) é um erro isolado da linha
+        file = SimpleUploadedFile("leads.csv", b"name,email,company\nOutra,Carol@Gamma.com, Gamma\n")
+        result = LeadImporter(chunk_size=10).run(file)
+        self.assertEqual((result.created, len(result.errors)), (0, 1))
+
+    def test_find_duplicates_scores_pairs_within_blocks(self):
+        dup = Lead.objects.create(name="alice", email="Alice@ACME.com ", phone="+55 11 1111", company="ACME Ltda.")
+        near = Lead.objects.create(name="Bob  Silva", email="bob.s@gmail.com", phone="(11) 9876-5432", company="Beta S/A")
+        far = Lead.objects.create(name="BOB silva", email="b.silva+x@gmail.com", phone="11 98765432", company="")
+        Lead.objects.create(name="Outro", email="outro@beta.com", company="Beta")
+
+        result = find_duplicates(threshold=0.6)
+        pairs = {(p.lead_a, p.lead_b): p for p in result.pairs}
+        self.assertEqual(pairs[(self.lead1.pk, dup.pk)].reasons, ("email",))
+        self.assertEqual(pairs[(near.pk, far.pk)].reasons, ("phone", "name"))
+        self.assertNotIn((self.lead2.pk, near.pk), pairs)
+        # só pares que dividem algum bloco são comparados
+        self.assertLess(result.comparisons, 15)
+
+        # blocos grandes demais são ignorados, não comparados
+        result = find_duplicates(threshold=0.6, max_block=1)
+        self.assertEqual((result.comparisons, result.pairs), (0, []))
+        self.assertGreater(result.skipped_blocks, 0)
+
+        out = io.StringIO()
+        call_command("find_duplicates", stdout=out, stderr=io.StringIO())
+        self.assertIn(f"{self.lead1.pk},{dup.pk},1.0,email", out.getvalue())
+
+
+    def _import_and_export_round_trip(self):
+        csv_content = (
+            "name,email,phone,company,status,source,value,notes,tags\n"
+            "Caio,caio@ex.com,1,Copy,NEW,WEB,10,\"linha 1\nlinha 2\",\"Hot, Novo\"\n"
+            "Dup,ALICE@acme.com,2,Acme,NEW,WEB,1,,\n"
+            "Dani,,3,Copy,QLF,REF,20,,\n"
+        )
+        result = LeadImporter(owner=self.user, chunk_size=10).run(io.BytesIO(csv_content.encode()))
+        self.assertEqual((result.created, result.rows), (2, 3))
+        self.assertEqual(len(result.errors), 1)
+        self.assertIn("Linha 3", result.errors[0])
+
+        upsert = "email,company,status,tags\ncaio@ex.com,Copy,WON,Frio\nnovo@ex.com,Copy,,\n"
+        result = LeadImporter(owner=self.user, chunk_size=10, mode=ImportJob.Mode.UPSERT).run(
+            io.BytesIO(upsert.encode())
+        )
+        self.assertEqual((result.created, result.updated), (1, 1))
+        caio = Lead.objects.get(email="caio@ex.com")
+        self.assertEqual((caio.name, caio.status, caio.owner), ("Caio", Lead.Status.WON, self.user))
+        self.assertEqual([t.name for t in caio.tags.all()], ["Frio"])
+        self.assertEqual(rollup.rebuild(dry_run=True), [])
+
+        resp = self.client.get(reverse("leads:list"), {"format": "csv", "q": "Caio"})
+        content = b"".join(resp.streaming_content).decode("utf-8-sig")
+        self.assertEqual(content.splitlines()[1], f"Caio,caio@ex.com,1,Copy,Ganho,Website,tester,10.00,Frio,linha 1 linha 2,"
+                         f"{caio.created_at:%Y-%m-%d %H:%M:%S}")
+        resp = self.client.get(reverse("leads:list"), {"format": "csv", "fields": "name,email,tags", "status": "QLF"})
+        self.assertIn("Dani,,\n", b"".join(resp.streaming_content).decode("utf-8-sig"))
+
+    @override_settings(LEADS_PG_COPY=False)
+    def test_import_and_export_orm_path(self):
+        self._import_and_export_round_trip()
+
+    @override_settings(LEADS_PG_COPY=True)
+    def test_import_and_export_copy_path(self):
+        # COPY só existe no PostgreSQL; nos demais bancos este teste cobre o fallback
+        self.assertEqual(pgcopy.enabled(), connection.vendor == "postgresql")
+        self._import_and_export_round_trip()
+
+    def test_import_job_resumes_from_last_committed_chunk(self):
+        rows = "".join(f"R{i},r{i}@ex.com,{i},Resume,NEW,WEB,1,,\n" for i in range(5))
+        csv_content = "name,email,phone,company,status,source,value,notes,tags\n" + rows
+        # worker anterior morreu depois de commitar as 2 primeiras linhas
+        job = ImportJob.objects.create(
+            file=SimpleUploadedFile("leads.csv", csv_content.encode("utf-8")),
+            owner=self.user,
+            status=ImportJob.Status.RUNNING,
+            row_cursor=2,
+            heartbeat_at=timezone.now() - timedelta(hours=1),
+        )
+        Lead.objects.create(name="R0", email="r0@ex.com", company="Resume")
+        Lead.objects.create(name="R1", email="r1@ex.com", company="Resume")
+
+        call_command("process_imports", once=True, chunk_size=2, stdout=io.StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.Status.DONE)
+        self.assertEqual(job.row_cursor, 5)
+        self.assertEqual(job.created_count, 3)
+        self.assertEqual(job.error_count, 0)
+        self.assertEqual(Lead.objects.filter(company="Resume").count(), 5)
+
+    def test_worker_survives_database_errors(self):
+        job = ImportJob.objects.create(
+            file=SimpleUploadedFile("leads.csv", b"name,email,company\nW,w@ex.com,W\n"),
+            owner=self.user,
+        )
+        # queda do banco no meio do job: não vira FAILED, o job fica para ser retomado
+        with mock.patch.object(LeadImporter, "import_chunk", side_effect=OperationalError("server closed the connection")):
+            with self.assertRaises(OperationalError):
+                call_command("process_imports", once=True, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.Status.RUNNING)
+
+        # em loop, o worker registra o erro, dorme e tenta de novo em vez de sair
+        stderr = io.StringIO()
+        claims = [OperationalError("database is locked"), None, KeyboardInterrupt]
+        with mock.patch("leads.management.commands.process_imports.claim_job", side_effect=claims) as claim, \
+                mock.patch("leads.management.commands.process_imports.close_old_connections") as close, \
+                mock.patch("leads.management.commands.process_imports.time.sleep") as sleep:
+            call_command("process_imports", sleep=0.5, stdout=io.StringIO(), stderr=stderr)
+        self.assertEqual(claim.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertGreaterEqual(close.call_count, 3)
+        self.assertIn("database is locked", stderr.getvalue())
+
+    def test_running_job_with_fresh_heartbeat_is_not_claimed(self):
+        job = ImportJob.objects.create(
+            file=SimpleUploadedFile("leads.csv", b"name\nX\n"),
+            owner=self.user,
+            status=ImportJob.Status.RUNNING,
+            heartbeat_at=timezone.now(),
+        )
+        call_command("process_imports", once=True, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.Status.RUNNING)
+        self.assertFalse(Lead.objects.filter(name="X").exists())
+
+    def test_sqlite_connection_profile(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("perfil específico do SQLite")
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS["busy_timeout"])
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+        self.assertEqual(connection.transaction_mode, settings.SQLITE_OPTIONS["transaction_mode"])
+
+    def test_query_budgets_for_list_export_and_import(self):
+        for i in range(20):
+            lead = Lead.objects.create(name=f"Budget {i}", email=f"b{i}@ex.com", company="B", owner=self.user)
+            lead.tags.add(self.tag_hot)
+        url = reverse("leads:list")
+
+        # sessão + usuário + validador + dropdowns de tag/owner + página + tags da página
+        with self.assertQueryBudget(7):
+            self.client.get(url)
+        # sessão + usuário + leads + tags do bloco, qualquer que seja o total de leads
+        with self.assertQueryBudget(4):
+            resp = self.client.get(url, {"format": "csv"})
+            b"".join(resp.streaming_content)
+
+        rows = "".join(f"Imp {i},imp{i}@ex.com,,I,NEW,WEB,1,,Hot\n" for i in range(30))
+        header = "name,email,phone,company,status,source,value,notes,tags\n"
+        file = SimpleUploadedFile("leads.csv", (header + rows).encode())
+        with self.assertQueryBudget(3):
+            self.client.post(reverse("leads:import"), {"file": file})
+        # blocos de 10: as mesmas ~8 queries por bloco, nenhuma por linha
+        with override_settings(IMPORT_CHUNK_SIZE=10), self.assertQueryBudget(8 + 3 * 8, repeats=3):
+            call_command("process_imports", once=True, stdout=io.StringIO())
+        self.assertEqual(Lead.objects.filter(company="I").count(), 30)
+
+    def test_session_and_user_come_from_cache(self):
+        url = reverse("leads:list")
+
+        def warm_queries():
+            # Client novo: o SessionMiddleware fixa o engine ao ser carregado
+            client = Client()
+            client.login(username="tester", password="pass1234")
+            client.get(url)
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(client.get(url).status_code, 200)
+            return client, ctx.captured_queries
+
+        with override_settings(SESSION_ENGINE="django.contrib.sessions.backends.db", AUTH_USER_CACHE_TIMEOUT=0):
+            _, baseline = warm_queries()
+        with override_settings(SESSION_ENGINE="django.contrib.sessions.backends.cached_db", AUTH_USER_CACHE_TIMEOUT=300):
+            client, queries = warm_queries()
+        # sem o SELECT em django_session e o SELECT em auth_user
+        self.assertEqual(len(queries), len(baseline) - 2)
+        self.assertFalse([q for q in queries if re.search(r'FROM "(django_session|auth_user)"', q["sql"])])
+
+        # trocar a senha invalida o usuário em cache: a sessão antiga deixa de valer
+        self.user.set_password("nova-senha-123")
+        self.user.save()
+        self.assertEqual(client.get(url).status_code, 302)
+
+    def test_session_and_user_cache_require_shared_cache(self):
+        locmem = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+        cached = {"SESSION_ENGINE": "django.contrib.sessions.backends.cached_db", "AUTH_USER_CACHE_TIMEOUT": 300}
+        with override_settings(DEBUG=False, CACHES=locmem, **cached):
+            ids = [msg.id for msg in run_checks(tags=["caches"])]
+        self.assertEqual(ids, ["leads.W001", "leads.E002", "leads.E003"])
+        shared = {"default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": MEDIA_ROOT}}
+        with override_settings(DEBUG=False, CACHES=shared, **cached):
+            self.assertEqual(run_checks(tags=["caches"]), [])
+
+        # sessões abertas pelo ModelBackend (antes do cache) continuam válidas
+        client = Client()
+        client.force_login(self.user, backend="django.contrib.auth.backends.ModelBackend")
+        self.assertEqual(client.get(reverse("leads:list")).status_code, 200)
+        # senha errada: recusada uma vez, sem repetir o hash no ModelBackend
+        with mock.patch("django.contrib.auth.backends.ModelBackend.authenticate", autospec=True,
+                        side_effect=lambda *args, **kwargs: None) as authenticate:
+            self.assertFalse(Client().login(username="tester", password="errada"))
+        self.assertEqual(authenticate.call_count, 1)
+
+    @override_settings(SESSION_ENGINE="django.contrib.sessions.backends.signed_cookies")
+    def test_signed_cookie_sessions(self):
+        client = Client()
+        client.login(username="tester", password="pass1234")
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(client.get(reverse("leads:list")).status_code, 200)
+        self.assertFalse([q for q in ctx.captured_queries if "django_session" in q["sql"]])
+
+    def test_seed_leads_is_deterministic_and_keeps_rollup(self):
+        call_command("seed_leads", 300, owners=3, seed=7, chunk_size=100, stdout=io.StringIO())
+        seeded = Lead.objects.exclude(pk__in=[self.lead1.pk, self.lead2.pk])
+        self.assertEqual(seeded.count(), 300)
+        self.assertEqual(set(seeded.values_list("status", flat=True)), set(Lead.Status.values))
+        self.assertGreater(seeded.filter(owner__username="seed-owner-0").count(),
+                           seeded.filter(owner__username="seed-owner-2").count())
+        self.assertEqual(rollup.rebuild(dry_run=True), [])
+
+        # mesma semente, mesmos dados (o índice do email é o que muda entre execuções)
+        first = [(lead.name, lead.company, lead.status, tags) for lead, tags in LeadGenerator(seed=7).leads(5)]
+        again = [(lead.name, lead.company, lead.status, tags) for lead, tags in LeadGenerator(seed=7).leads(5)]
+        self.assertEqual(first, again)
+
+    @override_settings(LEADS_PROFILING=True)
+    def test_profiling_middleware_server_timing_and_log(self):
+        client = Client()
+        client.force_login(self.user)
+        with self.assertLogs("leads.profiling", "INFO") as logs:
+            resp = client.get(reverse("leads:list"))
+        # a sessão já está no cache (cached_db grava no login); o usuário ainda vem do banco
+        self.assertRegex(resp["Server-Timing"], r'^db;dur=[\d.]+;desc="6 queries", tpl;dur=[\d.]+')
+        data = json.loads(logs.records[0].getMessage())
+        self.assertEqual((data["path"], data["status"], data["queries"]), ("/", 200, 6))
+        self.assertGreater(data["template_ms"], 0)
+        self.assertEqual(len(data["slowest"]), settings.LEADS_PROFILING_SLOWEST)
+        self.assertEqual(data["n_plus_one"], [])
+
+        # streaming: o log sai no fim do corpo, já com as queries da exportação
+        # (sessão e usuário agora vêm do cache: só leads + tags)
+        resp = client.get(reverse("leads:list"), {"format": "csv"})
+        with self.assertLogs("leads.profiling", "INFO") as logs:
+            b"".join(resp.streaming_content)
+        self.assertEqual(json.loads(logs.records[0].getMessage())["queries"], 2)
+
+    def test_profile_flags_repeated_queries_with_calling_line(self):
+        for i in range(5):
+            Lead.objects.create(name=f"N+1 {i}", company="N")
+        with RequestProfile().activate() as profile:
+            for lead in Lead.objects.filter(company="N"):
+                list(lead.tags.all())
+        (repeated,) = profile.repeated()
+        self.assertEqual(repeated.count, 5)
+        self.assertIn("leads_lead_tags", repeated.sql)
+        self.assertRegex(repeated.location, r"^leads/tests\.py:\d+ \(test_profile_flags_repeated_queries")
+
+
+@override_settings(CACHES=TEST_CACHES)
+class QueryPlanTests(TestCase):
+    """
+    Captura o EXPLAIN de cada combinação de filtros da lista e falha se alguma
+    cair em varredura completa de tabela (sem índice).
+    """
+
+    FULL_SCAN = {
+        # SQLite: "SCAN <tabela>" sem "USING INDEX"/"VIRTUAL TABLE" depois
+        "sqlite": re.compile(r"\bSCAN \S+$", re.MULTILINE),
+        "postgresql": re.compile(r"Seq Scan on leads_\w+"),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = get_user_model().objects.create_user(username="plan")
+        cls.tag = Tag.objects.create(name="Plan")
+        for i in range(30):
+            lead = Lead.objects.create(
+                name=f"Plan {i}", company="Acme", status=Lead.Status.NEW,
+                source=Lead.Source.WEBSITE, owner=cls.owner if i % 2 else None,
+            )
+            lead.tags.add(cls.tag)
+
+    def test_filter_combinations_use_indexes(self):
+        pattern = self.FULL_SCAN.get(connection.vendor)
+        if pattern is None:
+            self.skipTest(f"sem regra de EXPLAIN para {connection.vendor}")
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                # tabelas pequenas sempre dariam Seq Scan; força o planner a mostrar o índice
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+        values = {
+            "q": "acme", "status": Lead.Status.NEW, "source": Lead.Source.WEBSITE,
+            "tag": str(self.tag.pk), "owner": str(self.owner.pk),
+        }
+        for n in range(len(values) + 1):
+            for combo in combinations(values, n):
+                filters = LeadFilters(**{k: values[k] for k in combo})
+                qs = filters.apply(Lead.objects.all(), rank=True)
+                for label, page in (("offset", qs[:20]), ("keyset", qs.order_by("-created_at", "-id")[:20])):
+                    with self.subTest(filters=combo, pagination=label):
+                        plan = page.explain()
+                        self.assertIsNone(pattern.search(plan), f"varredura completa:\n{plan}")
+                        if connection.vendor == "sqlite" and {"status", "source", "owner"} & set(combo):
+                            # filtro por igualdade precisa de busca no índice, não de percorrer o índice da ordenação
+                            self.assertIn("SEARCH leads_lead USING", plan)
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise smtplib.SMTPDataError(451, "tente mais tarde")
+
+
+@override_settings(CACHES=TEST_CACHES, EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend")
+class EmailOutboxTests(TestCase):
+    def test_lead_rollback_discards_outbox_message(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            enqueue_mail("Novo Lead: X", "corpo", ["a@ex.com"])
+            raise RuntimeError
+        self.assertFalse(EmailOutbox.objects.exists())
+
+    def test_batch_shares_one_connection(self):
+        for i in range(3):
+            enqueue_mail(f"Msg {i}", "corpo", [f"u{i}@ex.com"])
+        result = dispatch_batch()
+        self.assertEqual((result.sent, result.retried, result.dead), (3, 0, 0))
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(EmailOutbox.objects.filter(status=EmailOutbox.Status.SENT).count(), 3)
+
+    def test_reset_socket_reconnects_and_worker_survives_database_errors(self):
+        for i in range(3):
+            enqueue_mail(f"Msg {i}", "corpo", [f"u{i}@ex.com"])
+        send = LocmemEmailBackend.send_messages
+        calls = []
+
+        def reset_once(backend, messages):
+            calls.append(messages)
+            if len(calls) == 2:
+                raise ConnectionResetError("connection reset by peer")
+            return send(backend, messages)
+
+        with mock.patch.object(LocmemEmailBackend, "send_messages", autospec=True, side_effect=reset_once), \
+                mock.patch.object(LocmemEmailBackend, "open", autospec=True) as open_:
+            result = dispatch_batch()
+        self.assertEqual((result.sent, result.retried), (3, 0))
+        self.assertEqual(open_.call_count, 2)
+
+        stderr = io.StringIO()
+        batches = [OperationalError("database is locked"), KeyboardInterrupt]
+        with mock.patch("leads.management.commands.dispatch_outbox.dispatch_batch", side_effect=batches) as batch, \
+                mock.patch("leads.management.commands.dispatch_outbox.time.sleep") as sleep:
+            call_command("dispatch_outbox", sleep=0.5, stdout=io.StringIO(), stderr=stderr)
+        self.assertEqual(batch.call_count, 2)
+        sleep.assert_called_once_with(0.5)
+        self.assertIn("database is locked", stderr.getvalue())
+
+    @override_settings(
+        EMAIL_BACKEND="leads.tests.FailingEmailBackend", EMAIL_OUTBOX_MAX_ATTEMPTS=2, EMAIL_OUTBOX_BACKOFF=60
+    )
+    def test_retry_with_backoff_then_dead_letter(self):
+        item = enqueue_mail("Falha", "corpo", ["a@ex.com"])
+
+        result = dispatch_batch()
+        self.assertEqual(result.retried, 1)
+        item.refresh_from_db()
+        self.assertEqual((item.status, item.attempts), (EmailOutbox.Status.PENDING, 1))
+        self.assertIn("SMTPDataError", item.last_error)
+        self.assertGreater(item.next_attempt_at, timezone.now() + timedelta(seconds=50))
+        # ainda em backoff: nada a enviar
+        self.assertEqual(dispatch_batch().total, 0)
+
+        EmailOutbox.objects.filter(pk=item.pk).update(next_attempt_at=timezone.now())
+        result = dispatch_batch()
+        self.assertEqual(result.dead, 1)
+        item.refresh_from_db()
+        self.assertEqual((item.status, item.attempts), (EmailOutbox.Status.DEAD, 2))
+
+    def test_dispatch_against_local_debugging_smtp_server(self):
+        try:
+            from aiosmtpd.controller import Controller
+            from aiosmtpd.handlers import Sink
+        except ImportError:
+            self.skipTest("aiosmtpd não instalado")
+
+        class Recorder(Sink):
+            def __init__(self):
+                self.messages = []
+
+            async def handle_DATA(self, server, session, envelope):
+                self.messages.append(envelope)
+                return "250 OK"
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        handler = Recorder()
+        controller = Controller(handler, hostname="127.0.0.1", port=port)
+        controller.start()
+        self.addCleanup(controller.stop)
+
+        for i in range(2):
+            enqueue_mail(f"Msg {i}", "corpo", [f"u{i}@ex.com"], from_email="portal@ex.com")
+        with self.settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+            EMAIL_HOST="127.0.0.1", EMAIL_PORT=port, EMAIL_USE_TLS=False, EMAIL_USE_SSL=False,
+            EMAIL_HOST_USER="", EMAIL_HOST_PASSWORD="",
+        ):
+            result = dispatch_batch()
+        self.assertEqual(result.sent, 2)
+        self.assertEqual(sorted(e.rcpt_tos[0] for e in handler.messages), ["u0@ex.com", "u1@ex.com"])
+
+
+class FlakyEmailBackend(LocmemEmailBackend):
+    """Derruba a conexão uma vez, no segundo envio."""
+
+    opens = 0
+    sends = 0
+
+    def open(self):
+        FlakyEmailBackend.opens += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        FlakyEmailBackend.sends += 1
+        if FlakyEmailBackend.sends == 2:
+            raise smtplib.SMTPServerDisconnected("conexão encerrada")
+        return super().send_messages(messages)
+
+
+@override_settings(CACHES=TEST_CACHES, EMAIL_BACKEND="leads.tests.FlakyEmailBackend")
+class MassMailTests(TestCase):
+    def setUp(self):
+        FlakyEmailBackend.opens = FlakyEmailBackend.sends = 0
+        mailers._compiled_templates.cache_clear()
+
+    def test_batch_reuses_connection_reconnects_and_caches_templates(self):
+        lead = Lead(name="Alice", email="alice@acme.com", company="Acme")
+        messages = [
+            {"subject": f"Lead {i}", "to": [f"u{i}@ex.com"], "context": {"lead": lead}}
+            for i in range(4)
+        ]
+        with mock.patch("leads.mailers.get_template", wraps=mailers.get_template) as get_tpl:
+            results = mailers.send_templated_mass_mail("gmail", "new_lead", messages, from_email="p@ex.com")
+
+        self.assertEqual([r.sent for r in results], [True] * 4)
+        self.assertEqual([r.to for r in results], [[f"u{i}@ex.com"] for i in range(4)])
+        # uma conexão para o lote + uma reconexão após a queda
+        self.assertEqual(FlakyEmailBackend.opens, 2)
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertIn("Alice", mail.outbox[0].body)
+        self.assertEqual(mail.outbox[0].alternatives[0].mimetype, "text/html")
+        # .txt e .html compilados uma única vez para o lote inteiro
+        self.assertEqual(get_tpl.call_count, 2)
+
+    def test_batch_reports_every_message_when_connection_or_item_fails(self):
+        messages = [
+            {"subject": "Ok", "to": ["a@ex.com"]},
+            {"subject": "Sem destinatário"},
+            {"subject": "Ok", "to": ["b@ex.com"]},
+        ]
+        results = mailers.send_templated_mass_mail("gmail", "new_lead", messages, from_email="p@ex.com")
+        self.assertEqual([r.sent for r in results], [True, False, True])
+        self.assertEqual(results[1].to, [])
+        self.assertIn("KeyError", results[1].error)
+
+        refused = ConnectionRefusedError("smtp fora do ar")
+        with mock.patch.object(FlakyEmailBackend, "open", side_effect=refused):
+            results = mailers.send_templated_mass_mail("gmail", "new_lead", messages, from_email="p@ex.com")
+        self.assertEqual(len(results), 3)
+        self.assertFalse(any(r.sent for r in results))
+        self.assertEqual(results[0].to, ["a@ex.com"])
+        self.assertIn("smtp fora do ar", results[0].error)
+        self.assertIn("smtp fora do ar", results[2].error)
+
+    def test_per_message_errors_do_not_abort_batch(self):
+        messages = [
+            {"subject": "Sem contexto", "to": ["a@ex.com"]},
+            {"subject": "Quebrado", "to": ["b@ex.com"], "context": {}},
+        ]
+        messages[1].pop("subject")
+        results = mailers.send_templated_mass_mail("gmail", "new_lead", messages)
+        self.assertTrue(results[0].sent)
+        self.assertFalse(results[1].sent)
+        self.assertIn("KeyError", results[1].error)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry._reset()
+        self.user = get_user_model().objects.create_user(username="metrics", password="pass1234")
+        self.client.login(username="metrics", password="pass1234")
+        Lead.objects.create(name="Alice", email="alice@acme.com", company="Acme")
+
+    def test_liveness_and_readiness(self):
+        self.assertEqual(self.client.get("/healthz").json(), {"status": "ok"})
+        self.assertEqual(self.client.get("/readyz").status_code, 200)
+        with mock.patch.object(connection, "cursor", side_effect=OperationalError("db-host:5432 fora")), \
+                self.assertLogs("app.urls", "WARNING"):
+            resp = self.client.get("/readyz")
+        self.assertEqual(resp.status_code, 503)
+        # detalhes do banco só no log
+        self.assertEqual(resp.json(), {"status": "unavailable"})
+
+    @override_settings(DEBUG=True)
+    def test_metrics_exposition(self):
+        self.client.get(reverse("leads:list"))
+        self.client.get(reverse("leads:list"))
+        resp = self.client.get(reverse("leads:list"), {"format": "csv"})
+        b"".join(resp.streaming_content)
+
+        resp = self.client.get("/metrics")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = resp.content.decode()
+        self.assertIn("# TYPE http_request_duration_seconds histogram", body)
+        self.assertIn(
+            'http_request_duration_seconds_bucket{view="leads:list",method="GET",status="200",le="+Inf"} 2', body
+        )
+        self.assertIn('http_request_duration_seconds_count{view="leads:export",method="GET",status="200"} 1', body)
+        self.assertRegex(body, r'db_queries_total\{alias="default",kind="select"\} \d+')
+        self.assertIn('cache_hit_ratio{cache="count"}', body)
+
+    def test_metrics_token(self):
+        # fora do DEBUG (como nos testes) e sem token o endpoint não existe
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+        with override_settings(METRICS_TOKEN="segredo"):
+            self.assertEqual(self.client.get("/metrics").status_code, 403)
+            self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer errado").status_code, 403)
+            self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer é").status_code, 403)
+            resp = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer segredo")
+        self.assertEqual(resp.status_code, 200)
+
+    def test_snapshots_from_other_processes_are_summed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for rows, seconds in ((100, 2.0), (300, 2.0)):
+            worker = metrics.Registry(directory)
+            worker.inc("leads_import_rows_total", rows, source="csv")
+            worker.inc("leads_import_duration_seconds_total", seconds, source="csv")
+            worker.observe("http_request_duration_seconds", 0.2, view="leads:list", method="GET", status=200)
+            worker.flush()
+
+        body = metrics.render(metrics.Registry(directory).collect())
+        self.assertIn('leads_import_rows_total{source="csv"} 400', body)
+        self.assertIn('leads_import_rows_per_second{source="csv"} 100', body)
+        self.assertIn(
+            'http_request_duration_seconds_bucket{view="leads:list",method="GET",status="200",le="0.1"} 0', body
+        )
+        self.assertIn(
+            'http_request_duration_seconds_bucket{view="leads:list",method="GET",status="200",le="0.25"} 2', body
+        )
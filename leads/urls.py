@@ -1,18 +1,34 @@
+from django.conf import settings
 from django.urls import path
+
+from .api import leads_api
 from .views import (
+    AsyncLeadListView,
     LeadListView,
     LeadCreateView,
     LeadUpdateView,
     LeadDeleteView,
+    bulk_action_view,
     import_csv_view,
+    import_job_view,
+    import_progress_view,
+    dashboard_view,
 )
 
 app_name = "leads"
 
+# servindo via ASGI, a lista/exportação usa a versão async (ver AsyncLeadListView)
+list_view = AsyncLeadListView if settings.LEADS_ASYNC_VIEWS else LeadListView
+
 urlpatterns = [
-    path("", LeadListView.as_view(), name="list"),
+    path("", list_view.as_view(), name="list"),
     path("novo/", LeadCreateView.as_view(), name="create"),
     path("<int:pk>/editar/", LeadUpdateView.as_view(), name="update"),
     path("<int:pk>/remover/", LeadDeleteView.as_view(), name="delete"),
+    path("lote/", bulk_action_view, name="bulk"),
     path("importar/", import_csv_view, name="import"),
+    path("importar/<int:pk>/", import_job_view, name="import_job"),
+    path("importar/<int:pk>/progresso/", import_progress_view, name="import_progress"),
+    path("painel/", dashboard_view, name="dashboard"),
+    path("api/leads/", leads_api, name="api_leads"),
 ]
\ No newline at end of file
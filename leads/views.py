@@ -1,126 +1,214 @@
-import csv
-import io
-from decimal import Decimal
-from urllib.parse import quote
+from urllib.parse import quote, urlencode
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth import get_user_model
+from django.contrib.messages import get_messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.mail import send_mail
+from django.core.handlers.asgi import ASGIRequest
 from django.db import transaction
-from django.db.models import Q
-from django.http import StreamingHttpResponse
-from django.shortcuts import redirect, render
-from django.urls import reverse_lazy
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse, reverse_lazy
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.views.decorators.http import require_POST
 from django.views.generic import ListView, CreateView, UpdateView, DeleteView
 
-from .forms import LeadForm, CSVImportForm
-from .models import Lead, Tag
+from . import bulk
+from .conditional import count_cache_key, list_validator
+from .exports import EXPORT_FORMATS, accepts_gzip, aexport_stream, export_columns, export_stream
+from .filters import LeadFilters
+from .forms import LeadBulkActionForm, LeadForm, CSVImportForm
+from .models import ImportJob, Lead
+from .outbox import enqueue_mail
+from .pagination import CachedCountPaginator, InvalidCursor, KeysetPaginator
+from .rollup import dashboard
 
 
 class LeadListView(LoginRequiredMixin, ListView):
     model = Lead
     template_name = 'leads/lead_list.html'
+    # requisições HTMX dos filtros/paginação trocam só o conteúdo de #lead-list
+    partial_template_name = 'leads/_lead_table.html'
     context_object_name = 'leads'
     paginate_by = 20
 
+    def _is_partial(self) -> bool:
+        # restauração de histórico do HTMX precisa da página inteira
+        headers = self.request.headers
+        return headers.get('HX-Request') == 'true' and headers.get('HX-History-Restore-Request') != 'true'
+
+    def _validator(self):
+        if self._should_export():
+            # formato, colunas e Content-Encoding geram bytes diferentes: ETags diferentes
+            return list_validator(
+                self.filters, 'export', self.request.GET['format'].lower(),
+                ','.join(self._export_columns()), self._gzip_response(),
+            )
+        if len(get_messages(self.request)):
+            # há mensagem flash pendente: a página precisa ser renderizada de novo
+            return None
+        # o HTML inclui usuário e token CSRF; parcial e página inteira são representações distintas
+        csrf = self.request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+        # o agregado (com COUNT) só compensa quando a página já faz o COUNT exato
+        exact = settings.LEADS_PAGINATION != 'keyset' and not settings.LEADS_APPROX_COUNT_THRESHOLD
+        return list_validator(
+            self.filters, 'html', self._is_partial(), self.request.user.pk, csrf, exact=exact,
+        )
+
+    def get(self, request, *args, **kwargs):
+        # GET condicional: ETag/Last-Modified calculados sem executar a consulta da lista
+        self.filters = LeadFilters.from_params(request.GET)
+        validator = self._validator()
+        if validator is not None and (not_modified := self._not_modified(validator)) is not None:
+            return not_modified
+        resp = super().get(request, *args, **kwargs)
+        return self._with_validator(resp, validator) if validator is not None else resp
+
+    def _not_modified(self, validator):
+        resp = get_conditional_response(
+            self.request, etag=validator.etag, last_modified=validator.last_modified.timestamp(),
+        )
+        return None if resp is None else self._with_validator(resp, validator)
+
+    def _with_validator(self, resp, validator):
+        resp['ETag'] = validator.etag
+        resp['Last-Modified'] = http_date(validator.last_modified.timestamp())
+        # o navegador sempre revalida (If-None-Match) em vez de reusar sem perguntar
+        resp.setdefault('Cache-Control', 'private, no-cache')
+        patch_vary_headers(resp, ('HX-Request', 'HX-History-Restore-Request'))
+        if self._should_export():
+            patch_vary_headers(resp, ('Accept-Encoding',))
+        return resp
+
+    def get_template_names(self):
+        return [self.partial_template_name] if self._is_partial() else super().get_template_names()
+
+    def _export_format(self):
+        return EXPORT_FORMATS.get(self.request.GET.get('format', '').lower())
+
     def _should_export(self) -> bool:
-        return self.request.GET.get('format', '').lower() == 'csv'
+        return self._export_format() is not None
+
+    def _export_columns(self) -> list[str]:
+        return export_columns(self.request.GET.get('fields', ''))
+
+    def _gzip_response(self) -> bool:
+        # csv.gz/ndjson.gz já são arquivos gzip; os demais formatos comprimem no transporte
+        return (
+            settings.EXPORT_GZIP_RESPONSE and not self._export_format().gzip
+            and accepts_gzip(self.request)
+        )
+
+    def setup(self, request, *args, **kwargs):
+        super().setup(request, *args, **kwargs)
+        if self._should_export():
+            # série própria nas métricas: exportação tem outra latência
+            request.metrics_view = 'leads:export'
 
     def get_paginate_by(self, queryset):
-        # Exporta tudo quando for CSV (sem paginação)
+        # Exporta tudo quando for exportação (sem paginação)
         return None if self._should_export() else self.paginate_by
 
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        # COUNT em cache por assinatura do filtro; invalidado quando leads/tags mudam
+        return CachedCountPaginator(
+            queryset, per_page, orphans=orphans, allow_empty_first_page=allow_empty_first_page,
+            cache_key=count_cache_key(self.filters),
+            approx_threshold=settings.LEADS_APPROX_COUNT_THRESHOLD,
+            **kwargs,
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        if settings.LEADS_PAGINATION != 'keyset':
+            return super().paginate_queryset(queryset, page_size)
+        # Paginação por cursor (created_at, id): sem OFFSET e sem COUNT
+        paginator = KeysetPaginator(queryset, page_size)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor:
+            raise Http404('Cursor de paginação inválido.')
+        return paginator, page, page.object_list, page.has_other_pages()
+
     def get_queryset(self):
         qs = Lead.objects.select_related('owner').prefetch_related('tags')
-        q = self.request.GET.get('q', '').strip()
-        status = self.request.GET.get('status', '').strip()
-        source = self.request.GET.get('source', '').strip()
-        tag = self.request.GET.get('tag', '').strip()
-        owner = self.request.GET.get('owner', '').strip()
-
-        if q:
-            qs = qs.filter(
-                Q(name__icontains=q)
-                | Q(email__icontains=q)
-                | Q(company__icontains=q)
-                | Q(phone__icontains=q)
-                | Q(notes__icontains=q)
-            )
-        if status:
-            qs = qs.filter(status=status)
-        if source:
-            qs = qs.filter(source=source)
-        if tag:
-            qs = qs.filter(tags__id=tag)
-        if owner:
-            qs = qs.filter(owner__id=owner)
-
-        return qs.distinct()  # evita duplicados com M2M
+        self.filters = LeadFilters.from_params(self.request.GET)
+        # relevância primeiro; na paginação por cursor a ordem precisa ser (created_at, id)
+        return self.filters.apply(qs, rank=settings.LEADS_PAGINATION != 'keyset')
 
     def get_context_data(self, **kwargs):
-        ctx = super().get_context_data(**kwargs)
-        ctx['tags'] = Tag.objects.order_by('name')
-        ctx['owners'] = get_user_model().objects.order_by('username')
-        return ctx
+        context = super().get_context_data(**kwargs)
+        if not self._should_export():
+            # na paginação por cursor `leads` é uma lista: não dá para chegar às choices por leads.model
+            context.update(status_choices=Lead.Status.choices, source_choices=Lead.Source.choices)
+        return context
 
     def render_to_response(self, context, **response_kwargs):
         if not self._should_export():
-            return super().render_to_response(context, **response_kwargs)
-
-        qs = context['object_list']
-
-        class Echo:
-            @staticmethod
-            def write(value):
-                return value
-
-        def row_iter():
-            # BOM para Excel (Windows) reconhecer UTF-8
-            yield '\ufeff'
-            writer = csv.writer(Echo(), lineterminator='\n')
-            # Cabeçalho
-            yield writer.writerow([
-                'name', 'email', 'phone', 'company', 'status', 'source',
-                'owner', 'value', 'tags', 'notes', 'created_at',
-            ])
-            # Linhas
-            for lead in qs:
-                tags = ', '.join(lead.tags.values_list('name', flat=True))
-                owner = lead.owner.get_username() if lead.owner else ''
-                yield writer.writerow([
-                    lead.name,
-                    lead.email,
-                    lead.phone,
-                    lead.company,
-                    lead.get_status_display(),
-                    lead.get_source_display(),
-                    owner,
-                    f'{lead.value:.2f}',
-                    tags,
-                    (lead.notes or '').replace('\r\n', ' ').replace('\n', ' '),
-                    lead.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                ])
-
-        resp = StreamingHttpResponse(row_iter(), content_type='text/csv; charset=utf-8')
-        filename = 'leads.csv'
+            resp = super().render_to_response(context, **response_kwargs)
+            # mesma URL, HTML diferente para HTMX: caches/navegador não podem misturar
+            patch_vary_headers(resp, ('HX-Request', 'HX-History-Restore-Request'))
+            return resp
+
+        return self._export_response(context['object_list'], export_stream)
+
+    def _export_response(self, qs, stream):
+        fmt, compress = self._export_format(), self._gzip_response()
+        resp = StreamingHttpResponse(
+            stream(fmt, qs, self._export_columns(), compress=compress),
+            content_type=fmt.content_type,
+        )
+        if compress:
+            resp['Content-Encoding'] = 'gzip'
+        filename = fmt.filename
         resp['Content-Disposition'] = (
             f'attachment; filename="{filename}"; filename*=UTF-8\'\'{quote(filename)}'
         )
         return resp
 
 
+class AsyncLeadListView(LeadListView):
+    """
+    LeadListView com handlers async, para servir via ASGI (LEADS_ASYNC_VIEWS).
+    A exportação sai de um iterador async (aiterator): um download lento não prende
+    um worker inteiro. A página HTML (COUNT, página e templates) e o validador da
+    exportação rodam em sync_to_async (thread_sensitive: uma thread do executor por
+    request, não uma por worker); só o corpo da exportação corre no loop.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        # LoginRequiredMixin.dispatch é síncrono e carregaria request.user dentro do loop
+        request.user = await request.auser()
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+        return await super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
+
+    async def get(self, request, *args, **kwargs):
+        if not self._should_export():
+            return await sync_to_async(super().get)(request, *args, **kwargs)
+        self.filters = LeadFilters.from_params(request.GET)
+        validator = await sync_to_async(self._validator)()
+        if (not_modified := self._not_modified(validator)) is not None:
+            return not_modified
+        # sob WSGI (ex.: runserver) um iterador async seria lido inteiro antes de responder
+        stream = aexport_stream if isinstance(request, ASGIRequest) else export_stream
+        return self._with_validator(self._export_response(self.get_queryset(), stream), validator)
+
+
 class LeadCreateView(LoginRequiredMixin, CreateView):
     model = Lead
     form_class = LeadForm
     template_name = 'leads/lead_form.html'
     success_url = reverse_lazy('leads:list')
 
+    @transaction.atomic
     def form_valid(self, form):
         resp = super().form_valid(form)
         lead = self.object
-        # Notificação por email (usa suas configs SMTP do settings)
+        # Notificação por email: vai para a outbox na mesma transação do lead
+        # e é enviada pelo dispatcher (manage.py dispatch_outbox), fora do request
         subject = f'Novo Lead: {lead.name}'
         body = (
             f'Lead criado por {self.request.user}:\n'
@@ -128,7 +216,7 @@ class LeadCreateView(LoginRequiredMixin, CreateView):
             f'Status: {lead.get_status_display()} | Fonte: {lead.get_source_display()}'
         )
         if self.request.user.email:
-            send_mail(subject, body, None, [self.request.user.email], fail_silently=True)
+            enqueue_mail(subject, body, [self.request.user.email])
         messages.success(self.request, 'Lead criado com sucesso ✔️')
         return resp
 
@@ -154,44 +242,73 @@ class LeadDeleteView(LoginRequiredMixin, DeleteView):
         return super().delete(request, *args, **kwargs)
 
 
+@login_required
+@require_POST
+def bulk_action_view(request):
+    """Ações em lote da lista: sobre os ids marcados ou sobre tudo que bate com os filtros."""
+    filters = LeadFilters.from_params(request.POST)
+    back = reverse('leads:list')
+    if filters.params():
+        back += '?' + urlencode(filters.params())
+
+    form = LeadBulkActionForm(request.POST)
+    if not form.is_valid():
+        errors = [e for field_errors in form.errors.values() for e in field_errors]
+        messages.error(request, errors[0])
+        return redirect(back)
+
+    data = form.cleaned_data
+    if data['scope'] == 'selected':
+        qs = Lead.objects.filter(pk__in=data['ids'])
+    else:
+        qs = filters.apply(Lead.objects.all())
+
+    action = data['action']
+    if action == 'status':
+        count = bulk.bulk_update_leads(qs, status=data['set_status'])
+    elif action == 'owner':
+        count = bulk.bulk_update_leads(qs, owner=data['set_owner'])
+    elif action == 'add_tag':
+        count = bulk.bulk_add_tags(qs, [data['set_tag']])
+    elif action == 'remove_tag':
+        count = bulk.bulk_remove_tags(qs, [data['set_tag']])
+    else:
+        count = bulk.bulk_delete_leads(qs)
+    messages.success(request, f'{dict(form.ACTIONS)[action]}: {count} lead(s) ✔️')
+    return redirect(back)
+
+
 @login_required
 def import_csv_view(request):
     if request.method == 'POST':
         form = CSVImportForm(request.POST, request.FILES)
         if form.is_valid():
-            file = form.cleaned_data['file']
-            decoded = file.read().decode('utf-8', errors='ignore')
-            reader = csv.DictReader(io.StringIO(decoded))
-            created = 0
-            with transaction.atomic():
-                for row in reader:
-                    # tags
-                    tags_names = [t.strip() for t in (row.get('tags') or '').split(',') if t.strip()]
-                    tag_objs = [Tag.objects.get_or_create(name=n)[0] for n in tags_names]
-
-                    # valor
-                    value_raw = (row.get('value') or '0').replace(',', '.')
-                    try:
-                        value = Decimal(value_raw)
-                    except Exception:
-                        value = Decimal('0')
-
-                    lead = Lead.objects.create(
-                        name=(row.get('name') or '').strip(),
-                        email=(row.get('email') or '').strip(),
-                        phone=(row.get('phone') or '').strip(),
-                        company=(row.get('company') or '').strip(),
-                        status=(row.get('status') or Lead.Status.NEW),
-                        source=(row.get('source') or Lead.Source.OTHER),
-                        value=value,
-                        notes=(row.get('notes') or '').strip(),
-                        owner=request.user if request.user.is_authenticated else None,
-                    )
-                    if tag_objs:
-                        lead.tags.add(*tag_objs)
-                    created += 1
-            messages.success(request, f'Importação concluída: {created} leads ✔️')
-            return redirect('leads:list')
+            # processamento fica com o worker (manage.py process_imports)
+            job = ImportJob.objects.create(
+                file=form.cleaned_data['file'], mode=form.cleaned_data['mode'], owner=request.user,
+            )
+            messages.info(request, 'Arquivo recebido. A importação está sendo processada em segundo plano.')
+            return redirect('leads:import_job', pk=job.pk)
     else:
         form = CSVImportForm()
-    return render(request, 'leads/import_csv.html', {'form': form})
+    jobs = ImportJob.objects.filter(owner=request.user)[:5]
+    return render(request, 'leads/import_csv.html', {'form': form, 'jobs': jobs})
+
+
+@login_required
+def import_job_view(request, pk):
+    job = get_object_or_404(ImportJob, pk=pk, owner=request.user)
+    return render(request, 'leads/import_job.html', {'job': job})
+
+
+@login_required
+def import_progress_view(request, pk):
+    # fragmento consultado via HTMX (hx-trigger="every 1s") até o job terminar
+    job = get_object_or_404(ImportJob, pk=pk, owner=request.user)
+    return render(request, 'leads/_import_progress.html', {'job': job})
+
+
+@login_required
+def dashboard_view(request):
+    # lê só PipelineRollup: custo proporcional a dias x status x fontes x owners, não ao total de leads
+    return render(request, 'leads/dashboard.html', {'totals': dashboard(days=30)})